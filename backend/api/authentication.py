@@ -0,0 +1,204 @@
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import (TokenAuthentication,
+                                           get_authorization_header)
+
+from .lru import LRUCache
+from .shared_cache import shared_cache
+
+TOKEN_KEY = "auth-token:{}"
+EPOCH_KEY = "auth-token-epoch:{}"
+
+# Поля пользователя в кеше: только то, что нужно для проверки доступа.
+# Пароль и личные данные не кешируются, они догружаются из базы
+USER_FIELDS = ("id", "is_active", "is_staff", "is_superuser")
+
+
+class TokenUserCache:
+    """
+    Пользователи по ключу токена: LRU в памяти процесса и общий кеш
+    AUTH_TOKEN_CACHE_ALIAS на AUTH_TOKEN_CACHE_TTL секунд.
+
+    Записи помечены эпохой токена из общего кеша. Отзыв токена меняет
+    его эпоху, и все процессы перестают доверять своим записям о нем.
+    Запись LRU принимается без обращения к общему кешу
+    AUTH_TOKEN_EPOCH_CHECK_TTL секунд: на этот срок отзыв может
+    запоздать в других воркерах. Без общего кеша (пустой алиас,
+    LocMemCache) работает только LRU с тем же сроком
+    """
+
+    def __init__(self, maxsize, ttl, check_ttl):
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, check_ttl)
+
+    @property
+    def shared(self):
+        return shared_cache(settings.AUTH_TOKEN_CACHE_ALIAS)
+
+    @staticmethod
+    def digest(key):
+        # Ключи токенов не попадают в кеш в открытом виде
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def lookup(self, key):
+        """Пользователь токена (или None) и эпоха токена"""
+        digest = self.digest(key)
+        entry = self.local.get(digest)
+        if entry is not None:
+            return self._user(entry[1]), entry[0]
+        shared = self.shared
+        if shared is None:
+            return None, None
+        keys = (TOKEN_KEY.format(digest), EPOCH_KEY.format(digest))
+        found = shared.get_many(keys)
+        epoch = found.get(keys[1]) or shared.get_or_set(
+            keys[1], uuid.uuid4().hex, self.ttl
+        )
+        return self._resolve(digest, epoch, found.get(keys[0])), epoch
+
+    async def alookup(self, key):
+        digest = self.digest(key)
+        entry = self.local.get(digest)
+        if entry is not None:
+            return self._user(entry[1]), entry[0]
+        shared = self.shared
+        if shared is None:
+            return None, None
+        keys = (TOKEN_KEY.format(digest), EPOCH_KEY.format(digest))
+        found = await shared.aget_many(keys)
+        epoch = found.get(keys[1]) or await shared.aget_or_set(
+            keys[1], uuid.uuid4().hex, self.ttl
+        )
+        return self._resolve(digest, epoch, found.get(keys[0])), epoch
+
+    def _resolve(self, digest, epoch, shared_entry):
+        if shared_entry is None or shared_entry[0] != epoch:
+            return None
+        self.local.set(digest, shared_entry)
+        return self._user(shared_entry[1])
+
+    @staticmethod
+    def _fields(user):
+        return tuple(getattr(user, field) for field in USER_FIELDS)
+
+    @staticmethod
+    def _user(fields):
+        # Каждый запрос получает свой экземпляр: изменения request.user
+        # не попадают в кеш. Остальные поля отложены и читаются из базы
+        # при обращении, save() сохраняет только загруженные поля
+        model = get_user_model()
+        data = dict(zip(USER_FIELDS, fields))
+        return model.from_db(DEFAULT_DB_ALIAS, USER_FIELDS, [
+            data[field.attname] for field in model._meta.concrete_fields
+            if field.attname in data
+        ])
+
+    def store(self, key, user, epoch):
+        """
+        Запоминает пользователя под эпохой, прочитанной до запроса
+        к базе: если токен успели отозвать, запись не будет принята
+        """
+        digest = self.digest(key)
+        entry = (epoch, self._fields(user))
+        self.local.set(digest, entry)
+        shared = self.shared
+        if shared is not None:
+            shared.set(TOKEN_KEY.format(digest), entry, self.ttl)
+
+    async def astore(self, key, user, epoch):
+        digest = self.digest(key)
+        entry = (epoch, self._fields(user))
+        self.local.set(digest, entry)
+        shared = self.shared
+        if shared is not None:
+            await shared.aset(TOKEN_KEY.format(digest), entry, self.ttl)
+
+    def invalidate(self, keys):
+        digests = [self.digest(key) for key in keys]
+        for digest in digests:
+            self.local.pop(digest)
+        shared = self.shared
+        if shared is None or not digests:
+            return
+        shared.set_many(
+            {EPOCH_KEY.format(digest): uuid.uuid4().hex for digest in digests},
+            self.ttl,
+        )
+        shared.delete_many([TOKEN_KEY.format(digest) for digest in digests])
+
+
+token_users = TokenUserCache(
+    settings.AUTH_TOKEN_CACHE_SIZE,
+    settings.AUTH_TOKEN_CACHE_TTL,
+    settings.AUTH_TOKEN_EPOCH_CHECK_TTL,
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication, который берет пользователя токена из кеша
+    token_users и идет в базу только при промахе
+    """
+
+    def authenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        key = self.get_key(request)
+        if key is None:
+            return None
+        return await self.aauthenticate_credentials(key)
+
+    def get_key(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. No credentials provided.")
+            )
+        if len(auth) > 2:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. "
+                  "Token string should not contain spaces.")
+            )
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(
+                _("Invalid token header. "
+                  "Token string should not contain invalid characters.")
+            )
+
+    def authenticate_credentials(self, key):
+        user, epoch = token_users.lookup(key)
+        if user is not None:
+            return user, self.get_model()(key=key, user=user)
+        user, token = super().authenticate_credentials(key)
+        token_users.store(key, user, epoch)
+        return user, token
+
+    async def aauthenticate_credentials(self, key):
+        user, epoch = await token_users.alookup(key)
+        if user is not None:
+            return user, self.get_model()(key=key, user=user)
+        token = await self.get_model().objects.select_related(
+            "user"
+        ).filter(key=key).afirst()
+        if token is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _("User inactive or deleted.")
+            )
+        await token_users.astore(key, token.user, epoch)
+        return token.user, token
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+from recipes.models import Recipe
+
+from .relations import user_relations
+from .serializers.recipes import RecipeFragmentSerializer
+
+
+class RecipeFragmentCache:
+    """
+    Кеш сериализованных рецептов без пользовательских флагов.
+
+    Фрагмент хранится под версией рецепта из базы (fragment_version):
+    изменения рецепта, его ингредиентов и автора увеличивают версию,
+    и ни один процесс больше не читает старый фрагмент.
+
+    Флаги is_favorited, is_in_shopping_cart и is_subscribed берутся из
+    наборов связей пользователя user_relations и подставляются при ответе.
+    """
+
+    key_prefix = "recipe-fragment:v3"
+
+    @property
+    def cache(self):
+        return caches[settings.RECIPE_CACHE_ALIAS]
+
+    def key(self, recipe_id, version):
+        return f"{self.key_prefix}:{recipe_id}:{version}"
+
+    def get_many(self, recipes):
+        keys = self._keys(recipes)
+        fragments = self._found(keys, self.cache.get_many(keys))
+        missing = self._missing(recipes, fragments)
+        if missing:
+            fragments.update(self.build(missing))
+        return fragments
+
+    async def aget_many(self, recipes):
+        keys = self._keys(recipes)
+        fragments = self._found(keys, await self.cache.aget_many(keys))
+        missing = self._missing(recipes, fragments)
+        if missing:
+            fragments.update(await self.abuild(missing))
+        return fragments
+
+    def _keys(self, recipes):
+        return {
+            self.key(recipe.id, recipe.fragment_version): recipe.id
+            for recipe in recipes
+        }
+
+    @staticmethod
+    def _found(keys, cached):
+        return {keys[key]: value for key, value in cached.items()}
+
+    @staticmethod
+    def _missing(recipes, fragments):
+        return [recipe.id for recipe in recipes if recipe.id not in fragments]
+
+    @staticmethod
+    def _source(recipe_ids):
+        # Кеш заполняется с основной базы: отставшая реплика не должна
+        # попасть в него на весь срок жизни фрагмента
+        return (
+            Recipe.objects.using(DEFAULT_DB_ALIAS)
+            .filter(id__in=recipe_ids)
+            .with_details()
+        )
+
+    @staticmethod
+    def _serialize(recipes):
+        return {
+            fragment["id"]: fragment
+            for fragment in RecipeFragmentSerializer(recipes, many=True).data
+        }
+
+    def build(self, recipe_ids):
+        recipes = list(self._source(recipe_ids))
+        fragments = self._serialize(recipes)
+        self.cache.set_many(self._entries(recipes, fragments))
+        return fragments
+
+    async def abuild(self, recipe_ids):
+        recipes = [recipe async for recipe in self._source(recipe_ids)]
+        fragments = self._serialize(recipes)
+        await self.cache.aset_many(self._entries(recipes, fragments))
+        return fragments
+
+    def _entries(self, recipes, fragments):
+        # Версия берется из той же строки, что и данные фрагмента: чтение,
+        # начатое до изменения, запишет фрагмент под старой версией
+        return {
+            self.key(recipe.id, recipe.fragment_version): fragments[recipe.id]
+            for recipe in recipes
+        }
+
+    def render(self, recipes, request):
+        """Собирает ответ для рецептов с флагами пользователя запроса"""
+        fragments = self.get_many(recipes)
+        relations = user_relations.get(request.user, self._needed(recipes))
+        return self._render(fragments, recipes, relations, request)
+
+    async def arender(self, recipes, request):
+        fragments = await self.aget_many(recipes)
+        relations = await user_relations.aget(
+            request.user, self._needed(recipes)
+        )
+        return self._render(fragments, recipes, relations, request)
+
+    @staticmethod
+    def _needed(recipes):
+        recipe_ids = [recipe.id for recipe in recipes]
+        return {
+            "favorites": recipe_ids,
+            "cart": recipe_ids,
+            "following": [recipe.author_id for recipe in recipes],
+        }
+
+    @classmethod
+    def _render(cls, fragments, recipes, relations, request):
+        return [
+            cls._merge(fragments[recipe.id], recipe, relations, request)
+            for recipe in recipes
+            if recipe.id in fragments
+        ]
+
+    @classmethod
+    def _merge(cls, fragment, recipe, relations, request):
+        author = dict(fragment["author"])
+        for field in ("avatar", "avatar_variants"):
+            author[field] = cls._absolute(author[field], request)
+        author["is_subscribed"] = relations.has("following", recipe.author_id)
+        data = dict(fragment)
+        for field in ("image", "image_variants"):
+            data[field] = cls._absolute(data[field], request)
+        data["author"] = author
+        data["is_favorited"] = relations.has("favorites", recipe.id)
+        data["is_in_shopping_cart"] = relations.has("cart", recipe.id)
+        return data
+
+    @classmethod
+    def _absolute(cls, value, request):
+        """Делает абсолютными ссылки на файлы, в том числе в картах"""
+        if isinstance(value, dict):
+            return {
+                key: cls._absolute(item, request)
+                for key, item in value.items()
+            }
+        if value:
+            return request.build_absolute_uri(value)
+        return value
+
+
+recipe_fragments = RecipeFragmentCache()
@@ -0,0 +1,201 @@
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+# Значения по умолчанию для настройки POOL базы данных
+POOL_DEFAULTS = {
+    "SIZE": 10,
+    "TIMEOUT": 10,
+    "MAX_LIFETIME": 1800,
+    "CHECK_AFTER": 30,
+}
+# Статус соединения без открытой транзакции (psycopg2 и psycopg)
+IDLE = 0
+STATS = (
+    "checkouts", "waits", "wait_seconds", "timeouts", "connects",
+    "reconnects",
+)
+
+
+class PoolTimeout(OperationalError):
+    """Свободное соединение не появилось за TIMEOUT секунд"""
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created = self.released = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Ограниченный пул соединений процесса, общий для потоков воркера.
+
+    Не больше SIZE соединений выдано одновременно, остальные потоки ждут
+    до TIMEOUT секунд. Соединение, простоявшее больше CHECK_AFTER секунд,
+    перед выдачей проверяется запросом, а старше MAX_LIFETIME секунд
+    закрывается и открывается заново
+    """
+
+    def __init__(self, size, timeout, max_lifetime, check_after):
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.idle = deque()
+        self.used = {}
+        self.stats = dict.fromkeys(STATS, 0)
+
+    def count(self, stat, value=1):
+        with self.lock:
+            self.stats[stat] += value
+
+    def acquire(self, connect):
+        if not self.slots.acquire(blocking=False):
+            started = time.monotonic()
+            acquired = self.slots.acquire(timeout=self.timeout)
+            self.count("waits")
+            self.count("wait_seconds", time.monotonic() - started)
+            if not acquired:
+                self.count("timeouts")
+                raise PoolTimeout(
+                    f"Нет свободного соединения с базой за {self.timeout} с"
+                )
+        try:
+            pooled = self.take_idle()
+            if pooled is None:
+                pooled = PooledConnection(connect())
+                self.count("connects")
+        except BaseException:
+            self.slots.release()
+            raise
+        with self.lock:
+            self.stats["checkouts"] += 1
+            self.used[id(pooled.connection)] = pooled
+        return pooled.connection
+
+    def take_idle(self):
+        while True:
+            with self.lock:
+                if not self.idle:
+                    return None
+                pooled = self.idle.pop()
+            now = time.monotonic()
+            if now - pooled.created > self.max_lifetime:
+                self.discard(pooled.connection)
+                continue
+            if now - pooled.released > self.check_after and not (
+                self.is_usable(pooled.connection)
+            ):
+                self.count("reconnects")
+                self.discard(pooled.connection)
+                continue
+            return pooled
+
+    def release(self, connection, reusable=True):
+        with self.lock:
+            pooled = self.used.pop(id(connection), None)
+        if pooled is None:
+            self.discard(connection)
+            return
+        try:
+            if not reusable:
+                self.discard(connection)
+            elif self.reset(connection):
+                pooled.released = time.monotonic()
+                with self.lock:
+                    self.idle.append(pooled)
+            else:
+                self.count("reconnects")
+                self.discard(connection)
+        finally:
+            self.slots.release()
+
+    def is_usable(self, connection):
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except Exception:
+            return False
+        return self.reset(connection)
+
+    @staticmethod
+    def reset(connection):
+        """Откатывает незавершенную транзакцию, False — соединение сломано"""
+        if connection.closed:
+            return False
+        try:
+            if connection.info.transaction_status != IDLE:
+                connection.rollback()
+            return connection.info.transaction_status == IDLE
+        except Exception:
+            return False
+
+    @staticmethod
+    def discard(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "size": self.size,
+                "in_use": len(self.used),
+                "idle": len(self.idle),
+            }
+
+
+class PoolRegistry:
+    """Пулы процесса по параметрам подключения; после fork — новые"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pools = {}
+        self.pid = os.getpid()
+
+    def get(self, alias, settings_dict):
+        key = (
+            alias,
+            settings_dict["HOST"],
+            settings_dict["PORT"],
+            settings_dict["NAME"],
+            settings_dict["USER"],
+        )
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pools, self.pid = {}, os.getpid()
+            pool = self.pools.get(key)
+            if pool is None:
+                options = {**POOL_DEFAULTS, **settings_dict.get("POOL", {})}
+                pool = self.pools[key] = ConnectionPool(
+                    size=options["SIZE"],
+                    timeout=options["TIMEOUT"],
+                    max_lifetime=options["MAX_LIFETIME"],
+                    check_after=options["CHECK_AFTER"],
+                )
+            return pool
+
+    def stats(self):
+        """Статистика пулов по алиасам баз текущего процесса"""
+        with self.lock:
+            pools = list(self.pools.items()) if (
+                self.pid == os.getpid()
+            ) else []
+        stats = {}
+        for (alias, *_), pool in pools:
+            snapshot = pool.snapshot()
+            current = stats.setdefault(alias, dict.fromkeys(snapshot, 0))
+            for key, value in snapshot.items():
+                current[key] += value
+        return stats
+
+
+pools = PoolRegistry()
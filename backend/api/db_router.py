@@ -0,0 +1,194 @@
+import hashlib
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = "db_pin"
+PIN_KEY = "primary-pin:{}"
+
+# Реплика для чтения в текущем запросе; None — читать с основной базы
+read_alias = ContextVar("read_alias", default=None)
+
+# Отставание реплики в секундах. Время последней примененной транзакции
+# стареет, пока на основной базе нет записей, поэтому реплика, которая
+# применила все полученное, считается догнавшей. На основной базе
+# функции WAL возвращают NULL, и отставание равно 0
+LAG_SQL = """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(
+            EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+        )
+    END
+"""
+
+
+class ReplicaPool:
+    """
+    Реплики из настроек с проверкой доступности: реплика, к которой не
+    удалось подключиться или которая отстала больше REPLICA_MAX_LAG
+    секунд, не используется REPLICA_CHECK_INTERVAL секунд
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked = {}
+
+    @property
+    def aliases(self):
+        return [
+            alias for alias in settings.DATABASES
+            if alias != DEFAULT_DB_ALIAS
+        ]
+
+    def choose(self):
+        aliases = self.aliases
+        random.shuffle(aliases)
+        for alias in aliases:
+            if self.is_healthy(alias):
+                return alias
+        return None
+
+    def is_healthy(self, alias):
+        now = time.monotonic()
+        with self.lock:
+            checked_at, healthy = self.checked.get(alias, (None, None))
+        if checked_at is not None and (
+            now - checked_at < settings.REPLICA_CHECK_INTERVAL
+        ):
+            return healthy
+        healthy = self.check(alias)
+        with self.lock:
+            self.checked[alias] = (now, healthy)
+        return healthy
+
+    @staticmethod
+    def check(alias):
+        connection = connections[alias]
+        try:
+            connection.ensure_connection()
+            if connection.vendor != "postgresql":
+                return True
+            with connection.cursor() as cursor:
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+        except DatabaseError:
+            connection.close()
+            return False
+        return lag <= settings.REPLICA_MAX_LAG
+
+
+replicas = ReplicaPool()
+
+
+class PrimaryReplicaRouter:
+    """
+    Запись — в основную базу, чтение — в реплику, выбранную
+    ReplicaRoutingMiddleware для текущего запроса
+    """
+
+    def db_for_read(self, model, **hints):
+        # Связанные объекты читаются из той же базы, что и исходный
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return read_alias.get() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Отправляет чтение безопасных запросов в реплики. После своих
+    изменяющих запросов клиент REPLICA_PIN_SECONDS секунд читает
+    с основной базы, чтобы сразу видеть свои изменения
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas.aliases:
+            return self.get_response(request)
+        alias = None
+        if request.method in SAFE_METHODS and not self.is_pinned(request):
+            alias = replicas.choose()
+        token = read_alias.set(alias)
+        try:
+            response = self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if self.needs_pin(request, response):
+            self.pin(request, response)
+        return response
+
+    async def __acall__(self, request):
+        # read_alias попадает в потоки sync_to_async вместе с контекстом
+        if not replicas.aliases:
+            return await self.get_response(request)
+        alias = None
+        if request.method in SAFE_METHODS and not (
+            await sync_to_async(self.is_pinned)(request)
+        ):
+            alias = await sync_to_async(replicas.choose)()
+        token = read_alias.set(alias)
+        try:
+            response = await self.get_response(request)
+        finally:
+            read_alias.reset(token)
+        if self.needs_pin(request, response):
+            await sync_to_async(self.pin)(request, response)
+        return response
+
+    @staticmethod
+    def needs_pin(request, response):
+        return (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+        )
+
+    @staticmethod
+    def pin_key(request):
+        authorization = request.headers.get("Authorization")
+        if not authorization:
+            return None
+        return PIN_KEY.format(
+            hashlib.sha256(authorization.encode()).hexdigest()
+        )
+
+    def is_pinned(self, request):
+        if PIN_COOKIE in request.COOKIES:
+            return True
+        key = self.pin_key(request)
+        return key is not None and cache.get(key) is not None
+
+    def pin(self, request, response):
+        response.set_cookie(
+            PIN_COOKIE, "1", max_age=settings.REPLICA_PIN_SECONDS,
+            httponly=True, samesite="Lax",
+        )
+        key = self.pin_key(request)
+        if key is not None:
+            cache.set(key, True, settings.REPLICA_PIN_SECONDS)
@@ -0,0 +1,159 @@
+import gzip
+import hashlib
+import threading
+import time
+import uuid
+from bisect import bisect_left
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from recipes.models import Ingredient
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATALOG_VERSION_KEY = "ingredient-catalog-version"
+
+
+def get_catalog_version():
+    """Текущая версия справочника ингредиентов"""
+    return cache.get_or_set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+async def aget_catalog_version():
+    return await cache.aget_or_set(
+        CATALOG_VERSION_KEY, uuid.uuid4().hex, None
+    )
+
+
+def bump_catalog_version():
+    """Помечает справочник ингредиентов измененным"""
+    cache.set(CATALOG_VERSION_KEY, uuid.uuid4().hex, None)
+
+
+class IngredientIndex:
+    """
+    Отсортированный по имени (без учета регистра) справочник ингредиентов
+    в памяти процесса для поиска по префиксу и по id.
+
+    Индекс перестраивается при смене версии справочника, а также не реже
+    раза в INGREDIENT_INDEX_TTL секунд на случай кеша без общего хранилища.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _get_state(self):
+        version = get_catalog_version()
+        state = self._state
+        if state is None or not self._is_fresh(state, version):
+            with self._lock:
+                state = self._state
+                if state is None or not self._is_fresh(state, version):
+                    state = self._build(version, list(self._rows()))
+                    self._state = state
+        return state
+
+    async def _aget_state(self):
+        version = await aget_catalog_version()
+        state = self._state
+        if state is None or not self._is_fresh(state, version):
+            rows = [row async for row in self._rows()]
+            state = self._state = self._build(version, rows)
+        return state
+
+    @staticmethod
+    def _is_fresh(state, version):
+        return (
+            state["version"] == version
+            and time.monotonic() - state["built_at"]
+            < settings.INGREDIENT_INDEX_TTL
+        )
+
+    @staticmethod
+    def _rows():
+        return Ingredient.objects.using(DEFAULT_DB_ALIAS).values_list(
+            "id", "name", "measurement_unit"
+        )
+
+    @staticmethod
+    def _build(version, rows):
+        items = sorted(
+            (
+                {"id": pk, "name": name, "measurement_unit": unit}
+                for pk, name, unit in rows
+            ),
+            key=lambda item: (item["name"].casefold(), item["id"]),
+        )
+        return {
+            "version": version,
+            "built_at": time.monotonic(),
+            "keys": [item["name"].casefold() for item in items],
+            "items": items,
+            "by_id": {item["id"]: item for item in items},
+        }
+
+    def all(self):
+        return self._get_state()["items"]
+
+    def catalog(self):
+        """
+        Готовое JSON-представление всего справочника и его сжатые
+        варианты, собираемые один раз на версию справочника
+        """
+        return self._catalog(self._get_state())
+
+    async def acatalog(self):
+        return self._catalog(await self._aget_state())
+
+    def _catalog(self, state):
+        if "catalog" not in state:
+            with self._lock:
+                if "catalog" not in state:
+                    state["catalog"] = self._build_catalog(state["items"])
+        return state["catalog"]
+
+    @staticmethod
+    def _build_catalog(items):
+        body = JSONRenderer().render(items)
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {
+            "identity": body,
+            "gzip": gzip.compress(body, compresslevel=9, mtime=0),
+        }
+        if brotli is not None:
+            variants["br"] = brotli.compress(body)
+        return {"etag": digest, "variants": variants}
+
+    def get(self, pk):
+        return self._get_state()["by_id"].get(pk)
+
+    async def aget(self, pk):
+        return (await self._aget_state())["by_id"].get(pk)
+
+    def search(self, prefix, limit=None):
+        return self._search(self._get_state(), prefix, limit)
+
+    async def asearch(self, prefix, limit=None):
+        return self._search(await self._aget_state(), prefix, limit)
+
+    @staticmethod
+    def _search(state, prefix, limit):
+        keys, items = state["keys"], state["items"]
+        prefix = prefix.casefold()
+        results = []
+        index = bisect_left(keys, prefix)
+        while index < len(keys) and keys[index].startswith(prefix):
+            if limit is not None and len(results) >= limit:
+                break
+            results.append(items[index])
+            index += 1
+        return results
+
+
+ingredient_index = IngredientIndex()
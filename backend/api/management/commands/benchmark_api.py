@@ -0,0 +1,544 @@
+import itertools
+import json
+import math
+import subprocess
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, reverse
+from django.utils import timezone
+from recipes.models import Ingredient, Recipe
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+from ... import urls
+
+User = get_user_model()
+
+# Пользователи, созданные бенчмарком, удаляются после прогона
+BENCHMARK_EMAIL = "benchmark-{}@example.com"
+BENCHMARK_PASSWORD = "benchmark-password-4821"
+# Картинка 1x1 PNG
+IMAGE = (
+    "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAAA1"
+    "BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMAAAAASUVO"
+    "RK5CYII="
+)
+RECIPE = {
+    "name": "Рецепт бенчмарка",
+    "text": "Описание",
+    "cooking_time": 10,
+    "image": IMAGE,
+    "ingredients": [{"id": "{ingredient}", "amount": 100}],
+}
+
+# (название, метод, маршрут, аргументы маршрута, параметры, тело,
+# авторизация: True — токен пользователя, "metrics" — METRICS_TOKEN,
+# "login" — токен, полученный сценарием входа).
+# Значения в фигурных скобках берутся из контекста, пары POST/DELETE
+# идут подряд, чтобы каждый проход оставлял данные нетронутыми
+SCENARIOS = (
+    ("ingredients-list", "GET", "api:ingredients-list", {},
+     {"name": "абр"}, None, False),
+    ("ingredients-detail", "GET", "api:ingredients-detail",
+     {"pk": "{ingredient}"}, {}, None, False),
+    ("recipes-list-anonymous", "GET", "api:recipes-list", {},
+     {"limit": 6}, None, False),
+    ("recipes-list", "GET", "api:recipes-list", {},
+     {"limit": 6}, None, True),
+    ("recipes-list-cursor", "GET", "api:recipes-list", {},
+     {"limit": 6, "cursor": ""}, None, True),
+    ("recipes-list-author", "GET", "api:recipes-list", {},
+     {"limit": 6, "author": "{author}"}, None, True),
+    ("recipes-list-favorited", "GET", "api:recipes-list", {},
+     {"limit": 6, "is_favorited": 1}, None, True),
+    ("recipes-detail", "GET", "api:recipes-detail",
+     {"pk": "{recipe}"}, {}, None, True),
+    ("recipes-get-link", "GET", "api:recipes-get-link",
+     {"pk": "{recipe}"}, {}, None, False),
+    ("short-link", "GET", "short-link",
+     {"code": "{short_code}"}, {}, None, False),
+    ("recipes-feed", "GET", "api:recipes-feed", {},
+     {"limit": 6}, None, True),
+    ("recipes-download-shopping-cart", "GET",
+     "api:recipes-download-shopping-cart", {}, {}, None, True),
+    ("recipes-favorite-add", "POST", "api:recipes-favorite",
+     {"pk": "{free_recipe}"}, {}, None, True),
+    ("recipes-favorite-remove", "DELETE", "api:recipes-favorite",
+     {"pk": "{free_recipe}"}, {}, None, True),
+    ("recipes-shopping-cart-add", "POST", "api:recipes-shopping-cart",
+     {"pk": "{free_recipe}"}, {}, None, True),
+    ("recipes-shopping-cart-remove", "DELETE", "api:recipes-shopping-cart",
+     {"pk": "{free_recipe}"}, {}, None, True),
+    ("recipes-favorite-bulk-add", "POST", "api:recipes-favorite-bulk", {},
+     {}, {"recipes": ["{free_recipe}"]}, True),
+    ("recipes-favorite-bulk-remove", "DELETE", "api:recipes-favorite-bulk",
+     {}, {}, {"recipes": ["{free_recipe}"]}, True),
+    ("recipes-shopping-cart-bulk-add", "POST",
+     "api:recipes-shopping-cart-bulk", {}, {},
+     {"recipes": ["{free_recipe}"]}, True),
+    ("recipes-shopping-cart-bulk-remove", "DELETE",
+     "api:recipes-shopping-cart-bulk", {}, {},
+     {"recipes": ["{free_recipe}"]}, True),
+    ("users-list", "GET", "api:users-list", {}, {"limit": 6}, None, False),
+    ("users-detail", "GET", "api:users-detail",
+     {"id": "{author}"}, {}, None, True),
+    ("users-me", "GET", "api:users-me", {}, {}, None, True),
+    ("users-subscriptions", "GET", "api:users-subscriptions", {},
+     {"limit": 6, "recipes_limit": 3}, None, True),
+    ("users-subscribe", "POST", "api:users-subscribe",
+     {"id": "{free_author}"}, {}, None, True),
+    ("users-unsubscribe", "DELETE", "api:users-subscribe",
+     {"id": "{free_author}"}, {}, None, True),
+    ("recipes-create", "POST", "api:recipes-list", {}, {}, RECIPE, True),
+    ("recipes-update", "PATCH", "api:recipes-detail",
+     {"pk": "{created_recipe}"}, {}, RECIPE, True),
+    ("recipes-destroy", "DELETE", "api:recipes-detail",
+     {"pk": "{created_recipe}"}, {}, None, True),
+    ("users-signup", "POST", "api:users-list", {}, {},
+     {"email": "{new_email}", "username": "{new_username}",
+      "first_name": "Бенчмарк", "last_name": "Бенчмарк",
+      "password": BENCHMARK_PASSWORD}, False),
+    ("auth-token-login", "POST", "api:login", {}, {},
+     {"email": "{login_email}", "password": BENCHMARK_PASSWORD}, False),
+    ("auth-token-logout", "POST", "api:logout", {}, {}, None, "login"),
+    ("metrics", "GET", "api:metrics", {}, {}, None, "metrics"),
+)
+# Сценарий -> (очередь, поле ответа): созданные объекты нужны следующим
+# сценариям. Удаление забирает объект из очереди, остальные берут
+# последний
+CAPTURES = {
+    "recipes-create": ("recipe", "id"),
+    "auth-token-login": ("token", "auth_token"),
+}
+
+
+def percentile(values, percent):
+    """Перцентиль по ближайшему рангу"""
+    values = sorted(values)
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+def fill(value, context):
+    if isinstance(value, str):
+        return value.format_map(context)
+    if isinstance(value, dict):
+        return {key: fill(item, context) for key, item in value.items()}
+    if isinstance(value, list):
+        return [fill(item, context) for item in value]
+    return value
+
+
+class ScenarioContext(dict):
+    """
+    Контекст одного запроса: значения, которые создает сам бенчмарк,
+    берутся у команды при первом обращении
+    """
+
+    def __init__(self, command, method, values):
+        super().__init__(values)
+        self.command = command
+        self.method = method
+
+    def __missing__(self, key):
+        value = self[key] = self.command.generated(key, self.method)
+        return value
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет эндпоинты API через тестовый клиент Django или "
+        "запущенный сервер и считает p50/p95/p99, число запросов к базе "
+        "и размер ответов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=50,
+            help="Сколько раз выполнить каждый сценарий",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=2,
+            help="Сколько проходов сделать без замеров",
+        )
+        parser.add_argument(
+            "--base-url",
+            help=(
+                "Адрес запущенного сервера с той же базой, например "
+                "http://localhost:8000. По умолчанию — тестовый клиент"
+            ),
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help=(
+                "Сколько запросов сценария отправлять одновременно "
+                "(только с --base-url)"
+            ),
+        )
+        parser.add_argument(
+            "--user",
+            help="Email пользователя, от имени которого идут запросы",
+        )
+        parser.add_argument(
+            "--only",
+            nargs="+",
+            default=[],
+            help="Запустить только сценарии с этими названиями",
+        )
+        parser.add_argument("--output", help="Сохранить результаты в JSON")
+        parser.add_argument(
+            "--compare",
+            help="JSON прошлого прогона для сравнения",
+        )
+
+    def handle(self, *args, **options):
+        context = self.get_context(options["user"])
+        token = Token.objects.get_or_create(user=context.pop("user"))[0]
+        self.base_url = options["base_url"]
+        concurrency = options["concurrency"]
+        if concurrency > 1 and not self.base_url:
+            raise CommandError("--concurrency работает только с --base-url")
+        self.headers = {"Authorization": f"Token {token.key}"}
+        if not self.base_url:
+            host = next(
+                (
+                    host.lstrip(".") for host in settings.ALLOWED_HOSTS
+                    if host != "*"
+                ),
+                "localhost",
+            )
+            self.client = Client(HTTP_HOST=host)
+
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options["only"] or scenario[0] in options["only"]
+        ]
+        if not settings.METRICS_TOKEN:
+            self.stdout.write("Без METRICS_TOKEN сценарий metrics пропущен")
+            scenarios = [
+                scenario for scenario in scenarios
+                if scenario[6] != "metrics"
+            ]
+        self.report_uncovered()
+        self.created = {queue: deque() for queue, _ in CAPTURES.values()}
+        self.created_lock = threading.Lock()
+        self.sequence = itertools.count()
+        self.login_emails = self.create_login_users(concurrency)
+        try:
+            results = self.run_scenarios(scenarios, context, options)
+        finally:
+            self.cleanup()
+        self.finish(results, options)
+
+    def run_scenarios(self, scenarios, context, options):
+        concurrency = options["concurrency"]
+        samples = {scenario[0]: [] for scenario in scenarios}
+        durations = dict.fromkeys(samples, 0)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for iteration in range(
+                options["warmup"] + options["iterations"]
+            ):
+                for scenario in scenarios:
+                    started = time.perf_counter()
+                    batch = self.run_batch(
+                        executor, scenario, context, concurrency
+                    )
+                    if iteration >= options["warmup"]:
+                        samples[scenario[0]].extend(batch)
+                        durations[scenario[0]] += (
+                            time.perf_counter() - started
+                        )
+        return {
+            name: self.summarize(scenario_samples, durations[name])
+            for name, scenario_samples in samples.items()
+        }
+
+    def finish(self, results, options):
+        concurrency = options["concurrency"]
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                baseline = json.load(file)["results"]
+        self.print_table(results, baseline)
+
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "meta": {
+                            "created": timezone.now().isoformat(),
+                            "commit": self.git_commit(),
+                            "target": self.base_url or "client",
+                            "iterations": options["iterations"],
+                            "concurrency": concurrency,
+                        },
+                        "results": results,
+                    },
+                    file,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+            self.stdout.write(self.style.SUCCESS(
+                f"Результаты сохранены в {options['output']}"
+            ))
+
+    def get_context(self, email):
+        if email:
+            user = User.objects.filter(email=email).first()
+        else:
+            user_id = Subscription.objects.order_by("user_id").values_list(
+                "user_id", flat=True
+            ).first()
+            user = User.objects.filter(pk=user_id).first() or (
+                User.objects.order_by("pk").first()
+            )
+        recipe = Recipe.objects.order_by("-favorites_count", "-pk").first()
+        ingredient = Ingredient.objects.order_by("pk").first()
+        if not (user and recipe and ingredient):
+            raise CommandError("Нет данных: запустите seed_fake_data")
+        free_recipe = (
+            Recipe.objects.exclude(favorites__user=user)
+            .exclude(shoppingcarts__user=user)
+            .order_by("pk")
+            .first()
+        )
+        free_author = (
+            User.objects.exclude(pk=user.pk)
+            .exclude(following__user=user)
+            .order_by("pk")
+            .first()
+        )
+        return {
+            "user": user,
+            "ingredient": ingredient.pk,
+            "recipe": recipe.pk,
+            "short_code": recipe.ensure_short_code(),
+            "author": recipe.author_id,
+            "free_recipe": free_recipe.pk if free_recipe else recipe.pk,
+            "free_author": free_author.pk if free_author else user.pk,
+        }
+
+    def create_login_users(self, count):
+        """Пользователи с известным паролем для сценария входа"""
+        emails = []
+        for number in range(count):
+            user = User.objects.get_or_create(
+                email=BENCHMARK_EMAIL.format(f"login-{number}"),
+                defaults={
+                    "username": f"benchmark-login-{number}",
+                    "first_name": "Бенчмарк",
+                    "last_name": "Бенчмарк",
+                },
+            )[0]
+            user.set_password(BENCHMARK_PASSWORD)
+            user.save(update_fields=["password"])
+            emails.append(user.email)
+        return emails
+
+    def generated(self, key, method):
+        if key == "created_recipe":
+            return self.take("recipe", remove=method == "DELETE")
+        if key == "new_email":
+            return BENCHMARK_EMAIL.format(f"signup-{uuid.uuid4().hex}")
+        if key == "new_username":
+            return f"benchmark-{uuid.uuid4().hex}"
+        if key == "login_email":
+            return self.login_emails[
+                next(self.sequence) % len(self.login_emails)
+            ]
+        raise KeyError(key)
+
+    def take(self, queue, remove=False):
+        with self.created_lock:
+            items = self.created[queue]
+            if not items:
+                raise CommandError(
+                    f"Нет созданных объектов «{queue}»: сценарий, который "
+                    "их создает, должен идти раньше"
+                )
+            return items.popleft() if remove else items[-1]
+
+    def capture(self, name, content, status):
+        if name not in CAPTURES or status not in (200, 201):
+            return
+        queue, field = CAPTURES[name]
+        with self.created_lock:
+            self.created[queue].append(json.loads(content)[field])
+
+    def cleanup(self):
+        """Удаляет рецепты и пользователей, созданных бенчмарком"""
+        Recipe.objects.filter(pk__in=self.created["recipe"]).delete()
+        prefix, suffix = BENCHMARK_EMAIL.split("{}")
+        User.objects.filter(
+            email__startswith=prefix, email__endswith=suffix
+        ).delete()
+
+    @staticmethod
+    def routes(patterns):
+        """Пары (маршрут, метод) API"""
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                yield from Command.routes(pattern.url_patterns)
+                continue
+            callback = pattern.callback
+            if getattr(callback, "actions", None) is not None:
+                methods = callback.actions
+            elif hasattr(callback, "view_class"):
+                methods = [
+                    method for method in callback.view_class.http_method_names
+                    if method not in ("head", "options")
+                    and hasattr(callback.view_class, method)
+                ]
+            else:
+                continue
+            if pattern.name != "api-root":
+                for method in methods:
+                    yield f"api:{pattern.name}", method.upper()
+
+    def report_uncovered(self):
+        covered = {(scenario[2], scenario[1]) for scenario in SCENARIOS}
+        uncovered = sorted(set(self.routes(urls.urlpatterns)) - covered)
+        if uncovered:
+            self.stdout.write("Без сценариев: {}".format(", ".join(
+                f"{method} {route}" for route, method in uncovered
+            )))
+
+    def run_batch(self, executor, scenario, context, concurrency):
+        # Тестовый клиент и счетчик запросов привязаны к соединению потока
+        if concurrency == 1:
+            return [self.run(scenario, context)]
+        return list(executor.map(
+            lambda _: self.run(scenario, context), range(concurrency)
+        ))
+
+    def run(self, scenario, context):
+        name, method, url_name, kwargs, params, body, auth = scenario
+        context = ScenarioContext(self, method, context)
+        path = reverse(url_name, kwargs=fill(kwargs, context))
+        params = fill(params, context)
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        body = json.dumps(fill(body, context)) if body else None
+        headers = {}
+        if auth == "metrics":
+            headers["Authorization"] = f"Bearer {settings.METRICS_TOKEN}"
+        elif auth == "login":
+            headers["Authorization"] = (
+                f"Token {self.take('token', remove=True)}"
+            )
+        elif auth:
+            headers.update(self.headers)
+        request = self.request_server if self.base_url else (
+            self.request_client
+        )
+        elapsed, queries, content, status = request(
+            method, path, body, headers
+        )
+        self.capture(name, content, status)
+        return elapsed, queries, len(content), status
+
+    def request_client(self, method, path, body, headers):
+        headers = {
+            f"HTTP_{header.upper()}": value
+            for header, value in headers.items()
+        }
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.client.generic(
+                method,
+                path,
+                body or "",
+                content_type="application/json",
+                **headers,
+            )
+            content = (
+                b"".join(response.streaming_content)
+                if response.streaming else response.content
+            )
+            elapsed = time.perf_counter() - started
+        return elapsed, len(queries), content, response.status_code
+
+    def request_server(self, method, path, body, headers):
+        request = Request(
+            self.base_url.rstrip("/") + path,
+            data=body.encode() if body else None,
+            headers={"Content-Type": "application/json", **headers},
+            method=method,
+        )
+        started = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                content, status = response.read(), response.status
+        except HTTPError as error:
+            content, status = error.read(), error.code
+        elapsed = time.perf_counter() - started
+        return elapsed, None, content, status
+
+    @staticmethod
+    def summarize(samples, duration):
+        latencies = [elapsed * 1000 for elapsed, _, _, _ in samples]
+        queries = [count for _, count, _, _ in samples if count is not None]
+        return {
+            "requests": len(samples),
+            "statuses": sorted({status for _, _, _, status in samples}),
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "rps": round(len(samples) / duration, 1) if duration else None,
+            "queries": max(queries) if queries else None,
+            "bytes": max(size for _, _, size, _ in samples),
+        }
+
+    def print_table(self, results, baseline=None):
+        self.stdout.write(
+            f"{'сценарий':<36}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}"
+            f"{'запросы':>9}{'байты':>10}  статусы"
+        )
+        for name, result in results.items():
+            line = (
+                f"{name:<36}{result['p50_ms']:>9.2f}{result['p95_ms']:>9.2f}"
+                f"{result['p99_ms']:>9.2f}{str(result.get('rps')):>9}"
+                f"{str(result['queries']):>9}"
+                f"{result['bytes']:>10}  {result['statuses']}"
+            )
+            before = (baseline or {}).get(name)
+            if before:
+                line += "  | было p95 {:.2f} ({:+.0f}%), запросов {}".format(
+                    before["p95_ms"],
+                    (result["p95_ms"] / before["p95_ms"] - 1) * 100
+                    if before["p95_ms"] else 0,
+                    before["queries"],
+                )
+            self.stdout.write(line)
+
+    @staticmethod
+    def git_commit():
+        try:
+            return subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"],
+                capture_output=True,
+                check=True,
+                cwd=settings.BASE_DIR,
+                text=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from .benchmark_api import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагружает запущенный сервер быстрыми клиентами на фоне медленных "
+        "соединений, которые передают запрос по нескольку байт, и считает "
+        "пропускную способность и задержки быстрых запросов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--base-url",
+            required=True,
+            help="Адрес сервера, например http://localhost:8000",
+        )
+        parser.add_argument(
+            "--path",
+            default="/api/recipes/?limit=6",
+            help="Запрашиваемый путь",
+        )
+        parser.add_argument(
+            "--token",
+            help="Токен, с которым идут запросы быстрых клиентов",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Число быстрых клиентов",
+        )
+        parser.add_argument(
+            "--slow-clients",
+            type=int,
+            default=100,
+            help="Число медленных соединений",
+        )
+        parser.add_argument(
+            "--slow-interval",
+            type=float,
+            default=0.5,
+            help="Пауза между порциями запроса медленного клиента, с",
+        )
+        parser.add_argument(
+            "--duration",
+            type=float,
+            default=20,
+            help="Длительность замера, с",
+        )
+        parser.add_argument("--output", help="Сохранить результаты в JSON")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options["base_url"])
+        if url.scheme != "http" or not url.hostname:
+            raise CommandError("Нужен адрес вида http://host:port")
+        self.host = url.hostname
+        self.port = url.port or 80
+        headers = [f"Host: {url.netloc}", "Connection: close"]
+        if options["token"]:
+            headers.append(f"Authorization: Token {options['token']}")
+        self.request = "\r\n".join(
+            [f"GET {options['path']} HTTP/1.1", *headers, "", ""]
+        ).encode()
+
+        result = asyncio.run(self.run(options))
+        self.stdout.write(
+            f"Быстрых запросов: {result['requests']} "
+            f"({result['rps']} в секунду), ошибок: {result['errors']}, "
+            f"статусы: {result['statuses']}\n"
+            f"p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, "
+            f"p99 {result['p99_ms']} мс\n"
+            f"Медленных запросов обслужено: {result['slow_requests']}"
+        )
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(
+                    {
+                        "meta": {
+                            "created": timezone.now().isoformat(),
+                            "target": options["base_url"],
+                            "path": options["path"],
+                            "concurrency": options["concurrency"],
+                            "slow_clients": options["slow_clients"],
+                            "slow_interval": options["slow_interval"],
+                            "duration": options["duration"],
+                        },
+                        "result": result,
+                    },
+                    file,
+                    ensure_ascii=False,
+                    indent=2,
+                )
+
+    async def run(self, options):
+        deadline = time.monotonic() + options["duration"]
+        latencies, statuses, errors, slow = [], {}, [0], [0]
+        started = time.monotonic()
+        await asyncio.gather(
+            *(
+                self.slow_client(deadline, options["slow_interval"], slow)
+                for _ in range(options["slow_clients"])
+            ),
+            *(
+                self.fast_client(deadline, latencies, statuses, errors)
+                for _ in range(options["concurrency"])
+            ),
+        )
+        elapsed = time.monotonic() - started
+        latencies = [latency * 1000 for latency in latencies] or [0]
+        return {
+            "requests": sum(statuses.values()),
+            "rps": round(sum(statuses.values()) / elapsed, 1),
+            "errors": errors[0],
+            "statuses": statuses,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+            "slow_requests": slow[0],
+        }
+
+    async def fetch(self, chunk_size=None, interval=0):
+        """Отправляет запрос (порциями по chunk_size байт) и читает ответ"""
+        reader, writer = await asyncio.open_connection(self.host, self.port)
+        try:
+            step = chunk_size or len(self.request)
+            for start in range(0, len(self.request), step):
+                writer.write(self.request[start:start + step])
+                await writer.drain()
+                if interval:
+                    await asyncio.sleep(interval)
+            status_line = await reader.readline()
+            await reader.read()
+        finally:
+            writer.close()
+        return int(status_line.split()[1])
+
+    async def fast_client(self, deadline, latencies, statuses, errors):
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            try:
+                status = await asyncio.wait_for(
+                    self.fetch(), deadline - started + 1
+                )
+            except (OSError, IndexError, ValueError, asyncio.TimeoutError):
+                errors[0] += 1
+                await asyncio.sleep(0.1)
+                continue
+            if time.monotonic() <= deadline:
+                latencies.append(time.monotonic() - started)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    async def slow_client(self, deadline, interval, served):
+        while time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(
+                    self.fetch(chunk_size=8, interval=interval),
+                    deadline - time.monotonic() + 1,
+                )
+                served[0] += 1
+            except (OSError, IndexError, ValueError, asyncio.TimeoutError):
+                await asyncio.sleep(interval)
@@ -0,0 +1,429 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from glob import glob
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.db import connections
+
+from .db_pool import pools
+
+# ключ состояния -> (имя метрики, описание, метки)
+COUNTERS = {
+    "requests": (
+        "foodgram_http_requests_total",
+        "Число обработанных запросов",
+        ("view", "method", "status"),
+    ),
+    "query_seconds": (
+        "foodgram_db_query_seconds_total",
+        "Суммарное время запросов к базе",
+        ("view", "method"),
+    ),
+}
+# ключ состояния -> (имя метрики, описание, границы корзин)
+HISTOGRAMS = {
+    "latency": (
+        "foodgram_http_request_duration_seconds",
+        "Время обработки запроса",
+        settings.METRICS_LATENCY_BUCKETS,
+    ),
+    "queries": (
+        "foodgram_db_queries_per_request",
+        "Число запросов к базе на один запрос",
+        (0, 1, 2, 3, 5, 10, 20, 50, 100),
+    ),
+    "size": (
+        "foodgram_http_response_size_bytes",
+        "Размер тела ответа",
+        (256, 1024, 10_240, 102_400, 1_048_576, 10_485_760),
+    ),
+}
+HISTOGRAM_LABELS = ("view", "method")
+# Файл, в который сворачиваются счетчики завершившихся воркеров
+EXITED_FILE = "metrics-exited.json"
+# статистика пула соединений -> (имя метрики, тип, описание)
+POOL_METRICS = {
+    "checkouts": (
+        "foodgram_db_pool_checkouts_total", "counter",
+        "Выдано соединений из пула",
+    ),
+    "waits": (
+        "foodgram_db_pool_waits_total", "counter",
+        "Ожиданий свободного соединения",
+    ),
+    "wait_seconds": (
+        "foodgram_db_pool_wait_seconds_total", "counter",
+        "Суммарное время ожидания соединения",
+    ),
+    "timeouts": (
+        "foodgram_db_pool_timeouts_total", "counter",
+        "Соединение не дождались за таймаут",
+    ),
+    "connects": (
+        "foodgram_db_pool_connects_total", "counter",
+        "Открыто новых соединений",
+    ),
+    "reconnects": (
+        "foodgram_db_pool_reconnects_total", "counter",
+        "Неисправных соединений заменено",
+    ),
+    "in_use": (
+        "foodgram_db_pool_connections_in_use", "gauge",
+        "Выданные соединения",
+    ),
+    "idle": (
+        "foodgram_db_pool_connections_idle", "gauge",
+        "Свободные соединения в пуле",
+    ),
+    "size": (
+        "foodgram_db_pool_size", "gauge",
+        "Наибольшее число соединений",
+    ),
+}
+
+
+class QueryTimer:
+    """Обертка execute_wrapper: считает запросы к базе и их время"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsRegistry:
+    """
+    Метрики запросов, собранные в памяти процесса.
+
+    Если задан METRICS_MULTIPROCESS_DIR, каждый процесс раз в
+    METRICS_FLUSH_INTERVAL секунд сбрасывает свое состояние в отдельный
+    файл, а при выдаче метрик файлы всех воркеров суммируются. Файлы
+    завершившегося воркера сворачиваются в EXITED_FILE без показателей
+    состояния (gauge), см. process_exited
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.state = self.empty()
+        self.path = None
+        self.pid = None
+
+    @staticmethod
+    def empty():
+        return {key: {} for key in (*COUNTERS, *HISTOGRAMS)}
+
+    def observe(self, view, method, status, duration, queries,
+                query_seconds, size=None):
+        labels = f"{view}|{method}"
+        with self.lock:
+            requests = self.state["requests"]
+            key = f"{labels}|{status}"
+            requests[key] = requests.get(key, 0) + 1
+            totals = self.state["query_seconds"]
+            totals[labels] = totals.get(labels, 0) + query_seconds
+            self._observe("latency", labels, duration)
+            self._observe("queries", labels, queries)
+            if size is not None:
+                self._observe("size", labels, size)
+        if self.directory and self.pid != os.getpid():
+            self._start_flushing()
+
+    def _observe(self, key, labels, value):
+        buckets = HISTOGRAMS[key][2]
+        histogram = self.state[key].setdefault(
+            labels, {"buckets": [0] * len(buckets), "sum": 0, "count": 0}
+        )
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["buckets"][index] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def _start_flushing(self):
+        # После fork состояние и поток родителя не наследуются
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            if self.pid is not None:
+                self.state = self.empty()
+            self.pid = os.getpid()
+            self.path = os.path.join(
+                self.directory,
+                f"metrics-{self.pid}-{uuid.uuid4().hex[:8]}.json",
+            )
+        threading.Thread(target=self._flush_forever, daemon=True).start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(settings.METRICS_FLUSH_INTERVAL)
+            self.flush()
+
+    def flush(self):
+        if self.path is None:
+            return
+        with self.lock:
+            data = json.dumps({**self.state, "pool": pools.stats()})
+        os.makedirs(self.directory, exist_ok=True)
+        self._write(self.path, data)
+
+    def collect(self):
+        if not self.directory:
+            with self.lock:
+                state = json.loads(json.dumps(self.state))
+            state["pool"] = pools.stats()
+            return state
+        self.flush()
+        merged = {**self.empty(), "pool": {}}
+        for path in glob(os.path.join(self.directory, "metrics-*.json")):
+            source = self._read(path)
+            if source is None:
+                continue
+            pid = self._pid(path)
+            if pid is not None and not is_alive(pid):
+                # Воркер упал, а child_exit не успел убрать его файл
+                source = without_gauges(source)
+            self.merge(merged, source)
+        return merged
+
+    def process_exited(self, pid):
+        """
+        Для child_exit gunicorn: добавляет счетчики и гистограммы воркера
+        pid в EXITED_FILE и удаляет его файлы. Суммы не убывают, а число
+        файлов не растет с каждым перезапуском воркеров
+        """
+        if not self.directory:
+            return
+        paths = glob(os.path.join(self.directory, f"metrics-{pid}-*.json"))
+        if not paths:
+            return
+        exited_path = os.path.join(self.directory, EXITED_FILE)
+        exited = self._read(exited_path) or {**self.empty(), "pool": {}}
+        for path in paths:
+            source = self._read(path)
+            if source is not None:
+                self.merge(exited, without_gauges(source))
+        self._write(exited_path, json.dumps(exited))
+        for path in paths:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def _write(path, data):
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as file:
+            file.write(data)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _pid(path):
+        """pid из имени файла metrics-<pid>-<суффикс>.json"""
+        parts = os.path.basename(path).split("-")
+        return int(parts[1]) if parts[1].isdigit() else None
+
+    @staticmethod
+    def merge(target, source):
+        for key in COUNTERS:
+            for labels, value in source.get(key, {}).items():
+                target[key][labels] = target[key].get(labels, 0) + value
+        for key in HISTOGRAMS:
+            for labels, histogram in source.get(key, {}).items():
+                current = target[key].get(labels)
+                if current is None:
+                    target[key][labels] = histogram
+                    continue
+                current["buckets"] = [
+                    left + right for left, right
+                    in zip(current["buckets"], histogram["buckets"])
+                ]
+                current["sum"] += histogram["sum"]
+                current["count"] += histogram["count"]
+        for alias, stats in source.get("pool", {}).items():
+            current = target.setdefault("pool", {}).setdefault(alias, {})
+            for key, value in stats.items():
+                current[key] = current.get(key, 0) + value
+
+    def render(self):
+        """Метрики в текстовом формате Prometheus"""
+        state = self.collect()
+        lines = []
+        for key, (name, description, label_names) in COUNTERS.items():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+            for labels, value in sorted(state[key].items()):
+                lines.append(
+                    f"{name}{{{format_labels(label_names, labels)}}} {value}"
+                )
+        for key, (name, description, buckets) in HISTOGRAMS.items():
+            lines += [
+                f"# HELP {name} {description}", f"# TYPE {name} histogram"
+            ]
+            for labels, histogram in sorted(state[key].items()):
+                labels = format_labels(HISTOGRAM_LABELS, labels)
+                for bound, count in zip(buckets, histogram["buckets"]):
+                    lines.append(
+                        f'{name}_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines += [
+                    f'{name}_bucket{{{labels},le="+Inf"}} '
+                    f'{histogram["count"]}',
+                    f"{name}_sum{{{labels}}} {histogram['sum']}",
+                    f"{name}_count{{{labels}}} {histogram['count']}",
+                ]
+        pool = sorted(state.get("pool", {}).items())
+        for key, (name, kind, description) in POOL_METRICS.items():
+            if not pool:
+                break
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            for alias, stats in pool:
+                lines.append(
+                    f"{name}{{{format_labels(('alias',), alias)}}} "
+                    f"{stats.get(key, 0)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def without_gauges(state):
+    """Состояние без показателей пула, которые имеют смысл у живого воркера"""
+    pool = {
+        alias: {
+            key: value for key, value in stats.items()
+            if POOL_METRICS.get(key, (None, "counter"))[1] != "gauge"
+        }
+        for alias, stats in state.get("pool", {}).items()
+    }
+    return {**state, "pool": pool}
+
+
+def format_labels(names, values):
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values.split("|"))
+    )
+
+
+def resolve_view(request):
+    """Класс вьюхи и действие вьюсета (или None) для запроса"""
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return None, None
+    view = getattr(match.func, "cls", None)
+    actions = getattr(match.func, "actions", None)
+    if view is None or not actions:
+        return view, None
+    method = request.method.lower()
+    return view, actions.get(method, method)
+
+
+def view_label(request):
+    """Вьюсет и действие (RecipeViewSet.list) или имя маршрута"""
+    view, action = resolve_view(request)
+    if view is not None:
+        return f"{view.__name__}.{action}" if action else view.__name__
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unresolved"
+    return match.view_name or match.func.__name__
+
+
+def wrap_connections(stack, wrapper):
+    """Ставит execute_wrapper на соединения текущего потока"""
+    for alias in settings.DATABASES:
+        stack.enter_context(connections[alias].execute_wrapper(wrapper))
+
+
+class MetricsMiddleware:
+    """
+    Замеряет для каждого вьюсета и действия время ответа, число и время
+    запросов к базе, размер ответа и статус
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            wrap_connections(stack, timer)
+            response = self.get_response(request)
+        self.observe(request, response, timer, started)
+        return response
+
+    async def __acall__(self, request):
+        # Асинхронный ORM ходит в базу из потока sync_to_async этого
+        # запроса, поэтому обертки ставятся на его соединения
+        timer = QueryTimer()
+        started = time.perf_counter()
+        stack = ExitStack()
+        await sync_to_async(wrap_connections)(stack, timer)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        self.observe(request, response, timer, started)
+        return response
+
+    @staticmethod
+    def observe(request, response, timer, started):
+        duration = time.perf_counter() - started
+        if response.streaming:
+            size = response.get("Content-Length")
+            size = int(size) if size else None
+        else:
+            size = len(response.content)
+        metrics.observe(
+            view_label(request),
+            request.method,
+            response.status_code,
+            duration,
+            timer.count,
+            timer.duration,
+            size,
+        )
+
+
+metrics = MetricsRegistry(settings.METRICS_MULTIPROCESS_DIR)
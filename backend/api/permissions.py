@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.utils.crypto import constant_time_compare
 from rest_framework.permissions import SAFE_METHODS, BasePermission
 
 
@@ -12,3 +14,18 @@ class IsAuthorOrReadOnly(BasePermission):
 
     def has_object_permission(self, request, view, obj):
         return request.method in SAFE_METHODS or obj.author == request.user
+
+
+class CanViewMetrics(BasePermission):
+    """
+    Метрики доступны администраторам и сборщику метрик
+    с METRICS_TOKEN в заголовке Authorization: Bearer
+    """
+
+    def has_permission(self, request, view):
+        if request.user.is_staff:
+            return True
+        return bool(settings.METRICS_TOKEN) and constant_time_compare(
+            request.headers.get("Authorization", ""),
+            f"Bearer {settings.METRICS_TOKEN}",
+        )
@@ -0,0 +1,28 @@
+from django.db.backends.postgresql import base
+
+from ..db_pool import pools
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL с пулом соединений процесса: закрытие соединения в конце
+    запроса возвращает его в пул, а не разрывает
+    """
+
+    @property
+    def connection_pool(self):
+        return pools.get(self.alias, self.settings_dict)
+
+    def get_new_connection(self, conn_params):
+        return self.connection_pool.acquire(
+            lambda: base.DatabaseWrapper.get_new_connection(self, conn_params)
+        )
+
+    def _close(self):
+        if self.connection is None:
+            return
+        # Закрытое внутри транзакции соединение Django еще считает своим
+        with self.wrap_database_errors:
+            self.connection_pool.release(
+                self.connection, reusable=not self.in_atomic_block
+            )
@@ -0,0 +1,182 @@
+import logging
+import os
+import re
+import sys
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from rest_framework.serializers import Serializer
+
+from .metrics import resolve_view, view_label, wrap_connections
+
+logger = logging.getLogger(__name__)
+
+STRING = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+\b")
+IN_LIST = re.compile(r"\bIN \((?:%s, )*%s\)", re.IGNORECASE)
+SPACES = re.compile(r"\s+")
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Действие выполнило больше запросов, чем заявлено в query_budgets"""
+
+
+def fingerprint(sql):
+    """Форма запроса: без литералов и с одинаковыми списками IN"""
+    sql = SPACES.sub(" ", sql)
+    sql = NUMBER.sub("?", STRING.sub("?", sql))
+    return IN_LIST.sub("IN (...)", sql).strip()
+
+
+def call_site():
+    """
+    Откуда пришел запрос: поле сериализатора, которое сейчас
+    сериализуется, и ближайшая к запросу строка кода проекта
+    """
+    base_dir = str(settings.BASE_DIR)
+    project = field = None
+    frame = sys._getframe(2)
+    while frame is not None and field is None:
+        code = frame.f_code
+        serializer = frame.f_locals.get("self")
+        if (code.co_name == "to_representation"
+                and isinstance(serializer, Serializer)
+                and "field" in frame.f_locals):
+            field = (
+                f"{type(serializer).__name__}."
+                f"{frame.f_locals['field'].field_name}"
+            )
+        elif (project is None and code.co_filename.startswith(base_dir)
+                and "site-packages" not in code.co_filename
+                and code.co_filename != __file__):
+            path = os.path.relpath(code.co_filename, base_dir)
+            project = f"{path}:{frame.f_lineno} ({code.co_name})"
+        frame = frame.f_back
+    return ", ".join(filter(None, (field, project))) or None
+
+
+class QueryInspector:
+    """
+    Обертка execute_wrapper: считает запросы, группирует их по форме
+    и запоминает, откуда пришел первый повтор
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.shapes = Counter()
+        self.sites = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        shape = fingerprint(sql)
+        self.shapes[shape] += 1
+        if self.shapes[shape] == 2:
+            self.sites[shape] = call_site()
+        return execute(sql, params, many, context)
+
+    def repeated(self, threshold):
+        """Формы, повторившиеся больше threshold раз: (форма, число, место)"""
+        return [
+            (shape, count, self.sites.get(shape))
+            for shape, count in self.shapes.most_common()
+            if count > threshold
+        ]
+
+    def report(self):
+        return "\n".join(
+            f"  {count} x {shape}\n    из {site}"
+            for shape, count, site
+            in self.repeated(settings.NPLUSONE_THRESHOLD)
+        )
+
+
+@contextmanager
+def inspect_queries():
+    inspector = QueryInspector()
+    with ExitStack() as stack:
+        wrap_connections(stack, inspector)
+        yield inspector
+
+
+def check_budget(label, budget, inspector):
+    if budget is None or inspector.count <= budget:
+        return
+    message = f"{label}: {inspector.count} запросов при бюджете {budget}"
+    report = inspector.report()
+    if report:
+        message = f"{message}\n{report}"
+    raise QueryBudgetExceeded(message)
+
+
+@contextmanager
+def query_budget(view, action):
+    """
+    Для тестов: падает с QueryBudgetExceeded, если код внутри блока
+    выполнил больше запросов, чем view.query_budgets[action]
+    """
+    with inspect_queries() as inspector:
+        yield inspector
+    check_budget(
+        f"{view.__name__}.{action}", view.query_budgets[action], inspector
+    )
+
+
+class QueryBudgetMiddleware:
+    """
+    При QUERY_INSPECTION ищет N+1 — одинаковые по форме запросы, число
+    которых больше NPLUSONE_THRESHOLD, — и сверяет число запросов
+    с query_budgets вьюсета. Нарушения пишутся в лог, а при
+    QUERY_BUDGET_RAISE превышение бюджета поднимает исключение
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not settings.QUERY_INSPECTION:
+            return self.get_response(request)
+        with inspect_queries() as inspector:
+            response = self.get_response(request)
+        self.check(request, inspector)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.QUERY_INSPECTION:
+            return await self.get_response(request)
+        inspection = inspect_queries()
+        inspector = await sync_to_async(inspection.__enter__)()
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(inspection.__exit__)(None, None, None)
+        self.check(request, inspector)
+        return response
+
+    @staticmethod
+    def check(request, inspector):
+        label = view_label(request)
+        for shape, count, site in inspector.repeated(
+            settings.NPLUSONE_THRESHOLD
+        ):
+            logger.warning(
+                "Возможный N+1 в %s: %d одинаковых запросов из %s: %s",
+                label, count, site, shape,
+            )
+        view, action = resolve_view(request)
+        budget = getattr(view, "query_budgets", {}).get(action)
+        try:
+            check_budget(label, budget, inspector)
+        except QueryBudgetExceeded as error:
+            if settings.QUERY_BUDGET_RAISE:
+                raise
+            logger.warning("%s", error)
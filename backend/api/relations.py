@@ -0,0 +1,234 @@
+import bisect
+import secrets
+import threading
+from array import array
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from recipes.models import Favorite, ShoppingCart
+from users.models import Subscription
+
+from .lru import LRUCache
+from .shared_cache import shared_cache
+
+VERSION_KEY = "user-relations:{}"
+# Вид связи: модель и поле с id рецепта или автора
+RELATIONS = {
+    "favorites": (Favorite, "recipe_id"),
+    "cart": (ShoppingCart, "recipe_id"),
+    "following": (Subscription, "author_id"),
+}
+KINDS = {model: kind for kind, (model, _) in RELATIONS.items()}
+
+
+def related_id(instance):
+    """id рецепта или автора, с которым связан пользователь"""
+    _, field = RELATIONS[KINDS[type(instance)]]
+    return getattr(instance, field)
+
+
+class RelationSets:
+    """
+    Отсортированные id избранного, списка покупок и авторов
+    пользователя. None вместо набора — набор больше
+    USER_RELATIONS_MAX_IDS и не хранится
+    """
+
+    __slots__ = ("version", "sets")
+
+    def __init__(self, version, sets=None):
+        self.version = version
+        self.sets = {} if sets is None else sets
+
+    def has(self, kind, value):
+        ids = self.sets.get(kind)
+        if not ids:
+            return False
+        position = bisect.bisect_left(ids, value)
+        return position < len(ids) and ids[position] == value
+
+    def changed(self, version, kind, ids, added, max_ids):
+        """Копия с примененным изменением набора kind"""
+        sets = dict(self.sets)
+        current = sets.pop(kind, None)
+        if current is not None:
+            values = set(current)
+            if added:
+                values.update(ids)
+            else:
+                values.difference_update(ids)
+            if len(values) <= max_ids:
+                sets[kind] = array("q", sorted(values))
+        return RelationSets(version, sets)
+
+
+EMPTY = RelationSets(None)
+
+
+class UserRelationCache:
+    """
+    Наборы связей пользователей в LRU процесса: флаги is_favorited,
+    is_in_shopping_cart и is_subscribed проверяются в памяти.
+
+    Записи помечены версией пользователя из общего кеша
+    USER_RELATIONS_CACHE_ALIAS. Запись атомарно увеличивает версию,
+    процесс записи применяет изменение к своей копии, остальные процессы
+    загружают наборы заново. Без общего кеша флаги страницы проверяются
+    запросами к базе в каждом запросе
+    """
+
+    def __init__(self, maxsize, max_ids, ttl):
+        self.max_ids = max_ids
+        self.ttl = ttl
+        self.local = LRUCache(maxsize, ttl)
+        self.lock = threading.Lock()
+
+    def get(self, user, needed):
+        """
+        Наборы пользователя для проверки id из needed ({вид: id}).
+        Вместо переполненного набора — его пересечение с этими id
+        """
+        if not user.is_authenticated:
+            return EMPTY
+        shared = self.shared
+        if shared is None:
+            return self._narrowed(EMPTY, {
+                kind: list(self._page(user.pk, kind, ids))
+                for kind, ids in needed.items()
+            })
+        version = shared.get_or_set(
+            VERSION_KEY.format(user.pk), self._initial_version(), self.ttl
+        )
+        entry = self._entry(user.pk, version)
+        for kind in self._missing(entry, needed):
+            entry.sets[kind] = self._loaded(
+                list(self._load(user.pk, kind))
+            )
+        return self._narrowed(entry, {
+            kind: list(self._page(user.pk, kind, needed[kind]))
+            for kind in self._overflowed(entry, needed)
+        })
+
+    async def aget(self, user, needed):
+        if not user.is_authenticated:
+            return EMPTY
+        shared = self.shared
+        if shared is None:
+            return self._narrowed(EMPTY, {
+                kind: [
+                    value async for value in self._page(user.pk, kind, ids)
+                ]
+                for kind, ids in needed.items()
+            })
+        version = await shared.aget_or_set(
+            VERSION_KEY.format(user.pk), self._initial_version(), self.ttl
+        )
+        entry = self._entry(user.pk, version)
+        for kind in self._missing(entry, needed):
+            entry.sets[kind] = self._loaded(
+                [value async for value in self._load(user.pk, kind)]
+            )
+        return self._narrowed(entry, {
+            kind: [
+                value async for value
+                in self._page(user.pk, kind, needed[kind])
+            ]
+            for kind in self._overflowed(entry, needed)
+        })
+
+    @property
+    def shared(self):
+        return shared_cache(settings.USER_RELATIONS_CACHE_ALIAS)
+
+    @staticmethod
+    def _initial_version():
+        # Случайное начало: после вытеснения ключа счет не повторится
+        # и старые копии в процессах не совпадут с новой версией
+        return secrets.randbits(62)
+
+    def _entry(self, user_id, version):
+        entry = self.local.get(user_id)
+        if entry is None or entry.version != version:
+            entry = RelationSets(version)
+            self.local.set(user_id, entry)
+        return entry
+
+    @staticmethod
+    def _missing(entry, needed):
+        return [kind for kind in needed if kind not in entry.sets]
+
+    @staticmethod
+    def _overflowed(entry, needed):
+        return [kind for kind in needed if entry.sets[kind] is None]
+
+    def _load(self, user_id, kind):
+        # Наборы читаются с основной базы: отставшая реплика не должна
+        # попасть в кеш под свежей версией
+        model, field = RELATIONS[kind]
+        return (
+            model.objects.using(DEFAULT_DB_ALIAS)
+            .filter(user_id=user_id)
+            .order_by(field)
+            .values_list(field, flat=True)[:self.max_ids + 1]
+        )
+
+    @staticmethod
+    def _page(user_id, kind, ids):
+        model, field = RELATIONS[kind]
+        return model.objects.filter(
+            user_id=user_id, **{f"{field}__in": set(ids)}
+        ).values_list(field, flat=True)
+
+    def _loaded(self, values):
+        if len(values) > self.max_ids:
+            return None
+        return array("q", values)
+
+    @staticmethod
+    def _narrowed(entry, pages):
+        if not pages:
+            return entry
+        sets = dict(entry.sets)
+        for kind, values in pages.items():
+            sets[kind] = array("q", sorted(values))
+        return RelationSets(entry.version, sets)
+
+    def changed(self, model, user_id, ids, added):
+        """Применяет добавление или удаление связей после коммита"""
+        if self.shared is None:
+            return
+        kind, ids = KINDS[model], list(ids)
+        transaction.on_commit(
+            lambda: self.apply(user_id, kind, ids, added)
+        )
+
+    def apply(self, user_id, kind, ids, added):
+        shared = self.shared
+        if shared is None:
+            return
+        key = VERSION_KEY.format(user_id)
+        with self.lock:
+            try:
+                # incr атомарен: из одновременных записей в разных
+                # процессах копию дополняет только та, что увеличила
+                # версию, под которой эта копия загружена
+                version = shared.incr(key)
+            except ValueError:
+                self.local.pop(user_id)
+                return
+            entry = self.local.get(user_id)
+            if entry is None or entry.version != version - 1:
+                # Копия устарела раньше: наборы загрузятся заново
+                self.local.pop(user_id)
+                return
+            self.local.set(
+                user_id,
+                entry.changed(version, kind, ids, added, self.max_ids),
+            )
+
+
+user_relations = UserRelationCache(
+    settings.USER_RELATIONS_CACHE_SIZE,
+    settings.USER_RELATIONS_MAX_IDS,
+    settings.USER_RELATIONS_TTL,
+)
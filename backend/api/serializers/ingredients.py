@@ -14,12 +14,48 @@ class IngredientSerializer(serializers.ModelSerializer):
         fields = ("id", "name", "measurement_unit")
 
 
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    Берет объекты из заранее загруженного словаря preloaded,
+    а не запрашивает каждый по отдельности
+    """
+
+    preloaded = None
+
+    def to_internal_value(self, data):
+        if self.preloaded is not None:
+            try:
+                return self.preloaded[int(data)]
+            except (KeyError, TypeError, ValueError):
+                pass
+        return super().to_internal_value(data)
+
+
+class IngredientInRecipeListSerializer(serializers.ListSerializer):
+    """
+    Загружает ингредиенты всего списка одним запросом
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            ids = set()
+            for item in data:
+                try:
+                    ids.add(int(item["id"]))
+                except (KeyError, TypeError, ValueError):
+                    continue
+            self.child.fields["id"].preloaded = (
+                Ingredient.objects.in_bulk(ids)
+            )
+        return super().to_internal_value(data)
+
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     """
     Сериализатор для связи ингредиента с рецептом
     """
 
-    id = serializers.PrimaryKeyRelatedField(
+    id = PreloadedPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(), source="ingredient"
     )
     name = serializers.ReadOnlyField(source="ingredient.name")
@@ -40,3 +76,4 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
     class Meta:
         model = IngredientInRecipe
         fields = ("id", "name", "measurement_unit", "amount")
+        list_serializer_class = IngredientInRecipeListSerializer
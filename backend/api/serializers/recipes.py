@@ -1,11 +1,17 @@
+import json
+
 from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from recipes.models import IngredientInRecipe, Recipe
+from django.db import transaction
+from recipes.models import (IngredientInRecipe, Recipe, ShoppingCart,
+                            ShoppingCartTotal)
 from rest_framework import serializers
+from rest_framework.utils import html
 
-from ..utils import Base64ImageField
+from ..relations import user_relations
+from ..utils import Base64ImageField, ImageVariantsField
 from .ingredients import IngredientInRecipeSerializer
-from .users import CustomUserSerializer
+from .users import AuthorFragmentSerializer, CustomUserSerializer
 
 
 class RecipeListSerializer(serializers.ModelSerializer):
@@ -20,6 +26,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField("image", "image_variants")
 
     class Meta:
         model = Recipe
@@ -27,6 +34,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
             "id",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
             "author",
@@ -36,20 +44,21 @@ class RecipeListSerializer(serializers.ModelSerializer):
         )
 
     def get_is_favorited(self, obj):
-        request = self.context.get("request")
-        if not request:
-            return False
-        if not request.user.is_authenticated:
-            return False
-        return obj.favorites.filter(user=request.user).exists()
+        if hasattr(obj, "is_favorited"):
+            return obj.is_favorited
+        return self._has_relation("favorites", obj.id)
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, "is_in_shopping_cart"):
+            return obj.is_in_shopping_cart
+        return self._has_relation("cart", obj.id)
+
+    def _has_relation(self, kind, value):
         request = self.context.get("request")
         if not request:
             return False
-        if not request.user.is_authenticated:
-            return False
-        return obj.shoppingcarts.filter(user=request.user).exists()
+        relations = user_relations.get(request.user, {kind: [value]})
+        return relations.has(kind, value)
 
     def get_image(self, obj):
         request = self.context.get("request")
@@ -60,6 +69,34 @@ class RecipeListSerializer(serializers.ModelSerializer):
         return request.build_absolute_uri(obj.image.url)
 
 
+class RecipeFragmentSerializer(RecipeListSerializer):
+    """
+    Сериализатор общей для всех пользователей части рецепта,
+    которая хранится в кеше (ссылки на файлы — относительные)
+    """
+
+    author = AuthorFragmentSerializer(read_only=True)
+    is_favorited = None
+    is_in_shopping_cart = None
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = (
+            "id",
+            "name",
+            "image",
+            "image_variants",
+            "text",
+            "cooking_time",
+            "author",
+            "ingredients",
+        )
+
+    def get_image(self, obj):
+        if not obj.image:
+            return None
+        return obj.image.url
+
+
 class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
     """
     Сериализатор для создания и изменения рецептов
@@ -91,6 +128,19 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             "author",
         )
 
+    def to_internal_value(self, data):
+        if html.is_html_input(data) and isinstance(
+            data.get("ingredients"), str
+        ):
+            data = data.dict()
+            try:
+                data["ingredients"] = json.loads(data["ingredients"])
+            except ValueError:
+                raise serializers.ValidationError(
+                    {"ingredients": "Ожидается список ингредиентов в JSON"}
+                )
+        return super().to_internal_value(data)
+
     def validate_ingredients(self, value):
         if not value:
             raise serializers.ValidationError(
@@ -133,15 +183,54 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         self._create_ingredients(recipe, ingredients_data)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         if "ingredients" in validated_data:
             ingredients_data = validated_data.pop("ingredients")
-            instance.ingredients.clear()
+            cart_users = list(
+                ShoppingCart.objects.filter(recipe=instance)
+                .values_list("user_id", flat=True)
+            )
+            ShoppingCartTotal.objects.remove_recipe(instance.id, cart_users)
+            IngredientInRecipe.objects.filter(recipe=instance).delete()
             self._create_ingredients(instance, ingredients_data)
+            ShoppingCartTotal.objects.add_recipe(instance.id, cart_users)
         return super().update(instance, validated_data)
 
     def to_representation(self, instance):
+        request = self.context.get("request")
+        if request is not None:
+            instance = Recipe.objects.with_details().with_user_flags(
+                request.user
+            ).get(pk=instance.pk)
+            instance.author.is_subscribed = instance.author_is_subscribed
         serializer = RecipeListSerializer(
-            instance, context={"request": self.context.get("request")}
+            instance, context={"request": request}
         )
         return serializer.data
+
+
+class RecipeIdsSerializer(serializers.Serializer):
+    """
+    Сериализатор списка id рецептов для массовых действий
+    """
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.MAX_BULK_RECIPES,
+    )
+
+    def validate_recipes(self, value):
+        recipe_ids = list(dict.fromkeys(value))
+        recipes = Recipe.objects.only(
+            "id", "name", "image", "image_variants", "cooking_time"
+        ).in_bulk(recipe_ids)
+        missing = [
+            recipe_id for recipe_id in recipe_ids if recipe_id not in recipes
+        ]
+        if missing:
+            raise serializers.ValidationError(
+                f"Рецепты не найдены: {', '.join(map(str, missing))}"
+            )
+        return [recipes[recipe_id] for recipe_id in recipe_ids]
@@ -4,7 +4,8 @@ from djoser.serializers import UserCreateSerializer, UserSerializer
 from recipes.models import Recipe
 from rest_framework import serializers
 
-from ..utils import Base64ImageField
+from ..relations import user_relations
+from ..utils import Base64ImageField, ImageVariantsField
 
 User = get_user_model()
 
@@ -24,10 +25,11 @@ class RecipeMinifiedSerializer(serializers.ModelSerializer):
     """
 
     image = serializers.SerializerMethodField()
+    image_variants = ImageVariantsField("image", "image_variants")
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
 
     def get_image(self, obj):
         request = self.context.get("request")
@@ -43,12 +45,14 @@ class CustomUserSerializer(UserSerializer):
 
     is_subscribed = serializers.SerializerMethodField()
     avatar = Base64ImageField(required=False)
+    avatar_variants = ImageVariantsField("avatar", "avatar_variants")
 
     class Meta:
         model = User
         fields = (
             "id",
             "avatar",
+            "avatar_variants",
             "email",
             "username",
             "first_name",
@@ -57,12 +61,45 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, "is_subscribed"):
+            return obj.is_subscribed
         request = self.context.get("request")
         if not request:
             return False
-        if not request.user.is_authenticated:
-            return False
-        return obj.following.filter(user=request.user).exists()
+        return self.following(request.user, obj).has("following", obj.pk)
+
+    def following(self, user, obj):
+        """
+        Подписки пользователя: в списке проверяются сразу для всей
+        страницы, иначе без общего кеша каждый автор — отдельный запрос
+        """
+        parent = self.parent
+        if not isinstance(parent, serializers.ListSerializer) or (
+            parent.instance is None
+        ):
+            return user_relations.get(user, {"following": [obj.pk]})
+        if getattr(self, "_following", None) is None:
+            self._following = user_relations.get(
+                user, {"following": [author.pk for author in parent.instance]}
+            )
+        return self._following
+
+
+class AuthorFragmentSerializer(CustomUserSerializer):
+    """Сериализатор автора без флага подписки для кеша рецептов"""
+
+    is_subscribed = None
+
+    class Meta(CustomUserSerializer.Meta):
+        fields = (
+            "id",
+            "avatar",
+            "avatar_variants",
+            "email",
+            "username",
+            "first_name",
+            "last_name",
+        )
 
 
 class UserWithRecipesSerializer(CustomUserSerializer):
@@ -78,6 +115,7 @@ class UserWithRecipesSerializer(CustomUserSerializer):
         fields = (
             "id",
             "avatar",
+            "avatar_variants",
             "username",
             "first_name",
             "last_name",
@@ -88,6 +126,12 @@ class UserWithRecipesSerializer(CustomUserSerializer):
         )
 
     def get_recipes(self, obj):
+        if hasattr(obj, "limited_recipes"):
+            return RecipeMinifiedSerializer(
+                obj.limited_recipes, many=True, context={
+                    "request": self.context.get("request")
+                }
+            ).data
         recipes = obj.recipes.all()
         limit = self.context.get("recipes_limit", settings.RECIPES_LIMIT)
         if limit:
@@ -105,7 +149,7 @@ class UserWithRecipesSerializer(CustomUserSerializer):
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class SetPasswordSerializer(serializers.Serializer):
@@ -141,7 +185,7 @@ class SubscriptionSerializer(CustomUserSerializer):
         ))
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
     def get_recipes(self, obj):
         request = self.context.get("request")
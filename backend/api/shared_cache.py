@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.cache import caches
+
+# Бэкенды, у которых каждый процесс видит только свои записи
+PROCESS_LOCAL_BACKENDS = ("LocMemCache", "DummyCache")
+
+
+def shared_cache(alias):
+    """
+    Кеш alias, если его записи видны всем воркерам (Redis, memcached,
+    база, файлы), иначе None
+    """
+    if not alias or alias not in settings.CACHES:
+        return None
+    backend = settings.CACHES[alias]["BACKEND"].rsplit(".", 1)[-1]
+    if backend in PROCESS_LOCAL_BACKENDS:
+        return None
+    return caches[alias]
@@ -0,0 +1,161 @@
+import csv
+import io
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, StreamingHttpResponse
+from recipes.models import ShoppingCartTotal, get_cart_version
+
+from .ingredient_index import get_catalog_version
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+RENDERED_KEY = "shopping-list:{user_id}:{cart}:{catalog}:{file_format}"
+CHUNK_SIZE = 64 * 1024
+
+
+def register_pdf_font():
+    """Шрифт с кириллицей для PDF; Helvetica, если файла шрифта нет"""
+    if canvas is None:
+        return None
+    try:
+        pdfmetrics.registerFont(
+            TTFont("ShoppingList", settings.SHOPPING_LIST_PDF_FONT)
+        )
+    except Exception:
+        return "Helvetica"
+    return "ShoppingList"
+
+
+PDF_FONT = register_pdf_font()
+
+
+class _Echo:
+    """Псевдофайл для csv.writer, возвращающий записанную строку"""
+
+    def write(self, value):
+        return value
+
+
+def iter_items(user):
+    return (
+        ShoppingCartTotal.objects.filter(user=user)
+        .values_list(
+            "ingredient__name", "ingredient__measurement_unit", "amount"
+        )
+        .order_by("ingredient__name")
+        .iterator(chunk_size=500)
+    )
+
+
+def render_txt(items):
+    yield "Список покупок:\n\n"
+    for name, unit, amount in items:
+        yield f"- {name} ({unit}) - {amount}\n"
+
+
+def render_csv(items):
+    writer = csv.writer(_Echo())
+    yield "\ufeff" + writer.writerow(
+        ("Ингредиент", "Единица измерения", "Количество")
+    )
+    for row in items:
+        yield writer.writerow(row)
+
+
+def render_pdf(items):
+    """
+    PDF собирается в памяти целиком (таблица ссылок пишется в конце
+    файла), но отдается частями
+    """
+    font = PDF_FONT
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top, bottom, left, line_height = height - 50, 50, 50, 18
+    pdf.setFont(font, 16)
+    pdf.drawString(left, top, "Список покупок")
+    y = top - 2 * line_height
+    pdf.setFont(font, 12)
+    for name, unit, amount in items:
+        if y < bottom:
+            pdf.showPage()
+            pdf.setFont(font, 12)
+            y = top
+        pdf.drawString(left, y, f"- {name} ({unit}) - {amount}")
+        y -= line_height
+    pdf.save()
+    buffer.seek(0)
+    while chunk := buffer.read(CHUNK_SIZE):
+        yield chunk
+
+
+FORMATS = {
+    "txt": ("text/plain; charset=utf-8", render_txt),
+    "csv": ("text/csv; charset=utf-8", render_csv),
+    "pdf": ("application/pdf", render_pdf),
+}
+
+
+def available_formats():
+    return [
+        file_format for file_format in FORMATS
+        if file_format != "pdf" or canvas is not None
+    ]
+
+
+def _encode(chunks):
+    for chunk in chunks:
+        yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+
+
+def _cache_on_finish(chunks, key):
+    """
+    Отдает части ответа и сохраняет результат в кеш, если он дошел
+    до конца и не превысил SHOPPING_LIST_CACHE_MAX_BYTES
+    """
+    rendered, size = [], 0
+    for chunk in chunks:
+        if rendered is not None:
+            size += len(chunk)
+            if size > settings.SHOPPING_LIST_CACHE_MAX_BYTES:
+                rendered = None
+            else:
+                rendered.append(chunk)
+        yield chunk
+    if rendered is not None:
+        cache.set(key, b"".join(rendered), settings.SHOPPING_LIST_CACHE_TTL)
+
+
+def shopping_list_response(user, file_format):
+    """
+    Потоковый ответ со списком покупок; повторная выгрузка без изменений
+    списка отдается из кеша
+    """
+    content_type, render = FORMATS[file_format]
+    # Версия читается до итогов и с той же базы: итоги не старее версии,
+    # под которой попадут в кеш
+    key = RENDERED_KEY.format(
+        user_id=user.id,
+        cart=get_cart_version(user.id),
+        catalog=get_catalog_version(),
+        file_format=file_format,
+    )
+    rendered = cache.get(key)
+    if rendered is not None:
+        response = HttpResponse(rendered, content_type=content_type)
+    else:
+        response = StreamingHttpResponse(
+            _cache_on_finish(_encode(render(iter_items(user))), key),
+            content_type=content_type,
+        )
+    response["Content-Disposition"] = (
+        f'attachment; filename="shopping_list.{file_format}"'
+    )
+    return response
@@ -0,0 +1,50 @@
+from django.conf import settings
+from recipes.models import SHORT_CODE_PATTERN, Recipe
+
+from .lru import LRUCache
+
+
+class ShortLinkResolver:
+    """
+    Разрешает коды коротких ссылок в id рецептов через LRU в памяти
+    воркера: популярные ссылки на прогретом кэше не доходят до базы
+    """
+
+    def __init__(self, maxsize):
+        self.cache = LRUCache(maxsize)
+
+    def resolve(self, code):
+        if not SHORT_CODE_PATTERN.fullmatch(code):
+            return None
+        recipe_id = self.cache.get(code)
+        if recipe_id is None:
+            recipe_id = self._lookup(code).first()
+            if recipe_id is not None:
+                self.cache.set(code, recipe_id)
+        return recipe_id
+
+    async def aresolve(self, code):
+        if not SHORT_CODE_PATTERN.fullmatch(code):
+            return None
+        recipe_id = self.cache.get(code)
+        if recipe_id is None:
+            recipe_id = await self._lookup(code).afirst()
+            if recipe_id is not None:
+                self.cache.set(code, recipe_id)
+        return recipe_id
+
+    @staticmethod
+    def _lookup(code):
+        return Recipe.objects.filter(short_code=code).values_list(
+            "id", flat=True
+        )
+
+    def forget(self, code):
+        """
+        Убирает код из кэша текущего воркера. Остальные воркеры отдадут
+        редирект на удаленный рецепт, пока код не вытеснится
+        """
+        self.cache.pop(code)
+
+
+short_links = ShortLinkResolver(settings.SHORT_LINK_CACHE_SIZE)
@@ -0,0 +1,124 @@
+import weakref
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart)
+from rest_framework.authtoken.models import Token
+from users.models import Subscription
+
+from .authentication import token_users
+from .ingredient_index import bump_catalog_version
+from .relations import related_id, user_relations
+from .short_links import short_links
+
+User = get_user_model()
+
+# Рецепты, версии которых уже подняты удалением через QuerySet.delete()
+BUMPED_RECIPES = weakref.WeakKeyDictionary()
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(sender, instance, created, update_fields=None,
+                      **kwargs):
+    if created or update_fields and set(update_fields) <= {"short_code"}:
+        return
+    Recipe.objects.filter(pk=instance.pk).bump_fragment_versions()
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    if instance.short_code:
+        transaction.on_commit(lambda: short_links.forget(instance.short_code))
+
+
+@receiver(post_save, sender=IngredientInRecipe)
+@receiver(post_delete, sender=IngredientInRecipe)
+def invalidate_recipe_ingredient(sender, instance, origin=None, **kwargs):
+    if isinstance(origin, Recipe) or getattr(origin, "model", None) is Recipe:
+        # Ингредиенты удаляются вместе с рецептом: фрагмент не нужен
+        return
+    if isinstance(origin, QuerySet):
+        # QuerySet.delete() поднимает версию каждого рецепта один раз
+        bumped = BUMPED_RECIPES.setdefault(origin, set())
+        if instance.recipe_id in bumped:
+            return
+        bumped.add(instance.recipe_id)
+    Recipe.objects.filter(pk=instance.recipe_id).bump_fragment_versions()
+
+
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def invalidate_recipe_ingredients(sender, instance, action, reverse, pk_set,
+                                  **kwargs):
+    if action not in ("post_add", "post_remove", "pre_clear"):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(pk=instance.pk)
+    elif pk_set:
+        recipes = Recipe.objects.filter(pk__in=pk_set)
+    else:
+        recipes = Recipe.objects.filter(ingredients=instance)
+    recipes.bump_fragment_versions()
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredient_catalog(sender, **kwargs):
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver(post_save, sender=Ingredient)
+def invalidate_ingredient(sender, instance, **kwargs):
+    Recipe.objects.filter(
+        id__in=IngredientInRecipe.objects.filter(ingredient=instance)
+        .values("recipe_id")
+    ).bump_fragment_versions()
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    Recipe.objects.filter(author=instance).bump_fragment_versions()
+
+
+@receiver(post_delete, sender=Token)
+def forget_token(sender, instance, **kwargs):
+    # delete() обнуляет первичный ключ экземпляра, а это и есть ключ токена
+    keys = [instance.key]
+    transaction.on_commit(lambda: token_users.invalidate(keys))
+
+
+@receiver(post_save, sender=User)
+def forget_user_tokens(sender, instance, update_fields=None, **kwargs):
+    # Смена пароля, блокировка и правки профиля видны в request.user сразу
+    if update_fields and set(update_fields) <= {"last_login"}:
+        return
+    keys = list(
+        Token.objects.filter(user_id=instance.pk)
+        .values_list("key", flat=True)
+    )
+    if keys:
+        transaction.on_commit(lambda: token_users.invalidate(keys))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def add_user_relation(sender, instance, created, **kwargs):
+    if created:
+        user_relations.changed(
+            sender, instance.user_id, [related_id(instance)], True
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def remove_user_relation(sender, instance, **kwargs):
+    user_relations.changed(
+        sender, instance.user_id, [related_id(instance)], False
+    )
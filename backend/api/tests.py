@@ -0,0 +1,838 @@
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+from unittest import addModuleCleanup, mock, skipUnless
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.cache import caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from recipes.management.commands import init_backend
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingCartTotal,
+                            get_cart_version)
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from users.models import Subscription, User
+
+from .authentication import token_users
+from .cache import recipe_fragments
+from .db_router import ReplicaPool, replicas
+from .metrics import EXITED_FILE, MetricsRegistry
+from .query_budget import query_budget
+from .relations import VERSION_KEY, user_relations
+from .utils import format_size
+from .views.recipes import RecipeViewSet
+from .views.users import CustomUserViewSet
+
+IMAGE = (
+    "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABAQMAAAAl21bKAAAAA1"
+    "BMVEUAAACnej3aAAAAAXRSTlMAQObYZgAAAApJREFUCNdjYAAAAAIAAeIhvDMAAAAASUVO"
+    "RK5CYII="
+)
+FIXTURE_IMAGE = "recipes/image.png"
+
+
+def setUpModule():
+    """Изображение рецептов фикстур во временном MEDIA_ROOT"""
+    media = tempfile.mkdtemp()
+    addModuleCleanup(shutil.rmtree, media, ignore_errors=True)
+    override = override_settings(MEDIA_ROOT=media)
+    override.enable()
+    addModuleCleanup(override.disable)
+    os.makedirs(os.path.join(media, "recipes"))
+    with open(os.path.join(media, FIXTURE_IMAGE), "wb") as file:
+        file.write(base64.b64decode(IMAGE.split(",", 1)[1]))
+
+
+def clear_caches():
+    """Сбрасывает кеши, чтобы считать запросы на холодном старте"""
+    for alias in caches:
+        caches[alias].clear()
+    user_relations.local.clear()
+    token_users.local.clear()
+
+
+def cache_alias(setting, backend, location=""):
+    """Направляет setting на отдельный кеш с бэкендом backend"""
+    return override_settings(
+        CACHES={
+            **settings.CACHES,
+            "test": {
+                "BACKEND": f"django.core.cache.backends.{backend}",
+                "LOCATION": location,
+            },
+        },
+        **{setting: "test"},
+    )
+
+
+class FixturesMixin:
+    """Пользователи, ингредиенты и рецепты для тестов API"""
+
+    # Зеркало реплики не видит незакоммиченных данных TestCase, поэтому
+    # по умолчанию чтение идет с основной базы
+    read_from_replicas = False
+
+    def setUp(self):
+        clear_caches()
+        if not self.read_from_replicas:
+            patcher = mock.patch.object(replicas, "choose", return_value=None)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.users = [
+            User.objects.create_user(
+                username=f"user{index}",
+                email=f"user{index}@example.com",
+                password="password",
+                first_name="Имя",
+                last_name="Фамилия",
+            )
+            for index in range(3)
+        ]
+        self.user = self.users[0]
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f"Ингредиент {index}", measurement_unit="г"
+            )
+            for index in range(10)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def create_recipes(self, count, author=None, ingredients=3):
+        recipes = []
+        for index in range(count):
+            recipe = Recipe.objects.create(
+                author=author or self.users[index % len(self.users)],
+                name=f"Рецепт {index}",
+                text="Описание",
+                cooking_time=10,
+                image=FIXTURE_IMAGE,
+            )
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=index + 1
+                )
+                for ingredient in self.ingredients[:ingredients]
+            )
+            recipes.append(recipe)
+        return recipes
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(context)
+
+
+class RecipeQueryCountTests(FixturesMixin, TestCase):
+    """Число запросов списка и рецепта не зависит от размера страницы"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipes = self.create_recipes(30)
+        Favorite.objects.create(user=self.user, recipe=self.recipes[0])
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[1])
+        Subscription.objects.create(user=self.user, author=self.users[1])
+
+    def assert_same_queries(self, small_url, large_url):
+        clear_caches()
+        expected = self.count_queries(small_url)
+        clear_caches()
+        with self.assertNumQueries(expected):
+            response = self.client.get(large_url)
+        self.assertEqual(response.status_code, 200)
+        # Прогретые кеши: размер страницы тоже не важен
+        self.count_queries(small_url)
+        expected = self.count_queries(small_url)
+        self.count_queries(large_url)
+        with self.assertNumQueries(expected):
+            self.client.get(large_url)
+
+    def test_list(self):
+        self.assert_same_queries(
+            "/api/recipes/?limit=2", "/api/recipes/?limit=25"
+        )
+
+    def test_list_anonymous(self):
+        self.client.force_authenticate(None)
+        self.assert_same_queries(
+            "/api/recipes/?limit=2", "/api/recipes/?limit=25"
+        )
+
+    def test_retrieve(self):
+        few, many = self.create_recipes(1, ingredients=1) + (
+            self.create_recipes(1, ingredients=10)
+        )
+        self.assert_same_queries(
+            f"/api/recipes/{few.id}/", f"/api/recipes/{many.id}/"
+        )
+
+    def test_flags(self):
+        response = self.client.get("/api/recipes/?limit=30")
+        recipes = {
+            recipe["id"]: recipe for recipe in response.json()["results"]
+        }
+        self.assertTrue(recipes[self.recipes[0].id]["is_favorited"])
+        self.assertFalse(recipes[self.recipes[0].id]["is_in_shopping_cart"])
+        self.assertTrue(recipes[self.recipes[1].id]["is_in_shopping_cart"])
+        self.assertTrue(recipes[self.recipes[1].id]["author"]["is_subscribed"])
+        self.assertFalse(
+            recipes[self.recipes[2].id]["author"]["is_subscribed"]
+        )
+
+
+class KeysetCursorTests(FixturesMixin, TestCase):
+    """Подделанный курсор дает 404, а не ошибку сервера"""
+
+    @staticmethod
+    def cursor(value):
+        return base64.urlsafe_b64encode(json.dumps(value).encode()).decode()
+
+    def test_next_page(self):
+        self.create_recipes(3)
+        response = self.client.get("/api/recipes/?limit=2&cursor=")
+        response = self.client.get(response.json()["next"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 1)
+
+    def test_crafted_cursor(self):
+        for value in (
+            {"p": [None, None]},
+            {"p": [{}, 1]},
+            {"p": ["2024-01-01T00:00:00+00:00", True]},
+            {"p": "ab"},
+            [1, 2],
+        ):
+            with self.subTest(value=value):
+                response = self.client.get(
+                    f"/api/recipes/?cursor={self.cursor(value)}"
+                )
+                self.assertEqual(response.status_code, 404)
+
+
+class QueryBudgetTests(FixturesMixin, TestCase):
+    """Каждое действие укладывается в query_budgets своего вьюсета"""
+
+    def setUp(self):
+        super().setUp()
+        recipes = self.create_recipes(12)
+        # Изменяемые рецепты лежат в чужом избранном и списке покупок
+        self.own, self.deleted = self.create_recipes(2, author=self.user)
+        for recipe in (self.own, self.deleted):
+            Favorite.objects.create(user=self.users[1], recipe=recipe)
+            ShoppingCart.objects.create(user=self.users[1], recipe=recipe)
+        self.recipe = recipes[1]
+        Favorite.objects.create(user=self.user, recipe=recipes[4])
+        ShoppingCart.objects.create(user=self.user, recipe=recipes[4])
+        Subscription.objects.create(user=self.user, author=self.users[1])
+        token = Token.objects.create(user=self.user)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {token.key}")
+
+    def requests(self):
+        """Вьюсет -> [(действие, метод, адрес, тело)]"""
+        recipe = {
+            "name": "Рецепт",
+            "text": "Описание",
+            "cooking_time": 5,
+            "image": IMAGE,
+            "ingredients": [
+                {"id": ingredient.id, "amount": 10}
+                for ingredient in self.ingredients[:5]
+            ],
+        }
+        bulk = {"recipes": [self.recipe.id, self.own.id]}
+        author = self.users[2].id
+        return {
+            RecipeViewSet: [
+                ("list", "get", "/api/recipes/?limit=6", None),
+                ("retrieve", "get", f"/api/recipes/{self.recipe.id}/", None),
+                ("create", "post", "/api/recipes/", recipe),
+                ("update", "put", f"/api/recipes/{self.own.id}/", recipe),
+                ("partial_update", "patch", f"/api/recipes/{self.own.id}/",
+                 recipe),
+                ("destroy", "delete", f"/api/recipes/{self.deleted.id}/",
+                 None),
+                ("get_link", "get",
+                 f"/api/recipes/{self.recipe.id}/get-link/", None),
+                ("feed", "get", "/api/recipes/feed/?limit=6", None),
+                ("download_shopping_cart", "get",
+                 "/api/recipes/download_shopping_cart/", None),
+                ("favorite", "post",
+                 f"/api/recipes/{self.recipe.id}/favorite/", None),
+                ("favorite", "delete",
+                 f"/api/recipes/{self.recipe.id}/favorite/", None),
+                ("shopping_cart", "post",
+                 f"/api/recipes/{self.recipe.id}/shopping_cart/", None),
+                ("shopping_cart", "delete",
+                 f"/api/recipes/{self.recipe.id}/shopping_cart/", None),
+                ("favorite_bulk", "post", "/api/recipes/favorite/", bulk),
+                ("favorite_bulk", "delete", "/api/recipes/favorite/", bulk),
+                ("shopping_cart_bulk", "post", "/api/recipes/shopping_cart/",
+                 bulk),
+                ("shopping_cart_bulk", "delete",
+                 "/api/recipes/shopping_cart/", bulk),
+            ],
+            CustomUserViewSet: [
+                ("list", "get", "/api/users/?limit=6", None),
+                ("retrieve", "get", f"/api/users/{author}/", None),
+                ("me", "get", "/api/users/me/", None),
+                ("avatar", "put", "/api/users/me/avatar/", {"avatar": IMAGE}),
+                ("avatar", "delete", "/api/users/me/avatar/", None),
+                ("subscriptions", "get",
+                 "/api/users/subscriptions/?recipes_limit=3", None),
+                ("subscribe", "post", f"/api/users/{author}/subscribe/",
+                 None),
+                ("subscribe", "delete", f"/api/users/{author}/subscribe/",
+                 None),
+            ],
+        }
+
+    def test_budgets(self):
+        for view, requests in self.requests().items():
+            self.assertEqual(
+                {action for action, _, _, _ in requests},
+                set(view.query_budgets),
+            )
+            for action, method, url, data in requests:
+                with self.subTest(view=view.__name__, action=action,
+                                  method=method):
+                    # Холодные кеши — худший случай для бюджета
+                    clear_caches()
+                    with query_budget(view, action):
+                        response = getattr(self.client, method)(
+                            url, data, format="json"
+                        )
+                    self.assertLess(
+                        response.status_code, 300, response.getvalue()
+                    )
+
+
+class RecipeFragmentCacheTests(FixturesMixin, TestCase):
+    """Фрагменты рецептов читаются только под текущей версией рецепта"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipes(1)[0]
+        self.url = f"/api/recipes/{self.recipe.id}/"
+
+    def get(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_recipe_change(self):
+        self.get()
+        self.recipe.name = "Новое название"
+        self.recipe.save()
+        self.assertEqual(self.get()["name"], "Новое название")
+
+    def test_author_change(self):
+        self.get()
+        author = self.recipe.author
+        author.first_name = "Другое"
+        author.save()
+        self.assertEqual(self.get()["author"]["first_name"], "Другое")
+
+    def test_ingredient_change(self):
+        self.get()
+        ingredient = self.ingredients[0]
+        ingredient.name = "Переименованный"
+        ingredient.save()
+        names = [item["name"] for item in self.get()["ingredients"]]
+        self.assertIn("Переименованный", names)
+
+    def test_stale_fill_is_not_served(self):
+        """Чтение, начатое до изменения, пишет фрагмент под старой версией"""
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        stale_fragment = {**self.get(), "name": "Устаревшее"}
+        self.recipe.name = "Новое название"
+        self.recipe.save()
+        recipe_fragments.cache.set(
+            recipe_fragments.key(stale.id, stale.fragment_version),
+            stale_fragment,
+        )
+        self.assertEqual(self.get()["name"], "Новое название")
+
+
+class CartAdminTests(FixturesMixin, TestCase):
+    """Правки в админке сохраняют итоги списков покупок верными"""
+
+    def setUp(self):
+        super().setUp()
+        admin_user = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password"
+        )
+        self.admin_client = Client()
+        self.admin_client.force_login(admin_user)
+
+    def assert_totals(self):
+        totals = {
+            (row.user_id, row.ingredient_id): row.amount
+            for row in ShoppingCartTotal.objects.all()
+        }
+        self.assertEqual(totals, ShoppingCartTotal.objects.calculate())
+
+    def post(self, url, data):
+        response = self.admin_client.post(f"/admin/recipes/{url}", data)
+        self.assertEqual(response.status_code, 302)
+
+    def test_cart_admin(self):
+        first, second, third = self.create_recipes(3)
+        self.post("shoppingcart/add/", {
+            "user": self.user.id, "recipe": first.id
+        })
+        self.assert_totals()
+        cart = ShoppingCart.objects.get(user=self.user)
+        self.post(f"shoppingcart/{cart.id}/change/", {
+            "user": self.users[1].id, "recipe": second.id
+        })
+        self.assert_totals()
+        self.post(f"shoppingcart/{cart.id}/delete/", {"post": "yes"})
+        self.assert_totals()
+        ShoppingCart.objects.create(user=self.user, recipe=first)
+        ShoppingCart.objects.create(user=self.user, recipe=third)
+        ShoppingCartTotal.objects.rebuild()
+        self.post("shoppingcart/", {
+            "action": "delete_selected",
+            "_selected_action": list(
+                ShoppingCart.objects.values_list("id", flat=True)
+            ),
+            "post": "yes",
+        })
+        self.assertFalse(ShoppingCartTotal.objects.exists())
+
+    def test_ingredient_admin(self):
+        recipe, other = self.create_recipes(2)
+        for user in self.users[:2]:
+            ShoppingCart.objects.create(user=user, recipe=recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=other)
+        ShoppingCartTotal.objects.rebuild()
+        row = IngredientInRecipe.objects.filter(recipe=recipe).first()
+        self.post(f"ingredientinrecipe/{row.id}/change/", {
+            "recipe": recipe.id,
+            "ingredient": self.ingredients[-1].id,
+            "amount": 7,
+        })
+        self.assert_totals()
+        self.post(f"ingredientinrecipe/{row.id}/delete/", {"post": "yes"})
+        self.assert_totals()
+        self.post("ingredientinrecipe/", {
+            "action": "delete_selected",
+            "_selected_action": list(
+                IngredientInRecipe.objects.filter(recipe=recipe)
+                .values_list("id", flat=True)
+            ),
+            "post": "yes",
+        })
+        self.assert_totals()
+
+    def test_totals_are_read_only(self):
+        request = RequestFactory().get("/admin/")
+        request.user = User.objects.get(username="admin")
+        model_admin = admin.site._registry[ShoppingCartTotal]
+        self.assertFalse(model_admin.has_add_permission(request))
+        self.assertFalse(model_admin.has_change_permission(request))
+        self.assertFalse(model_admin.has_delete_permission(request))
+        self.assertTrue(model_admin.has_view_permission(request))
+
+
+class ShoppingListCacheTests(FixturesMixin, TestCase):
+    """Выгрузка списка покупок меняется вместе с корзиной"""
+
+    def download(self):
+        response = self.client.get("/api/recipes/download_shopping_cart/")
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response).decode()
+
+    def test_cart_change_is_downloaded(self):
+        first, second = self.create_recipes(2, ingredients=1)
+        self.client.post(f"/api/recipes/{first.id}/shopping_cart/")
+        self.assertIn(" - 1\n", self.download())
+        version = get_cart_version(self.user.id)
+        self.client.post(f"/api/recipes/{second.id}/shopping_cart/")
+        self.assertNotEqual(get_cart_version(self.user.id), version)
+        self.assertIn(" - 3\n", self.download())
+
+
+@override_settings(FEED_FANOUT_LIMIT=1, IMAGE_PROCESSING_SYNC=True)
+class FeedFanOutTests(FixturesMixin, TestCase):
+    """Рецепт остается в ленте, когда автор переходит через порог"""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.users[2]
+        self.follow(self.users[0])
+
+    def follow(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.post(f"/api/users/{self.author.id}/subscribe/")
+        self.assertEqual(response.status_code, 201)
+
+    def publish(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.create_recipes(1, author=self.author)[0]
+
+    def feed(self, user):
+        self.client.force_authenticate(user)
+        response = self.client.get("/api/recipes/feed/")
+        self.assertEqual(response.status_code, 200)
+        return {recipe["id"] for recipe in response.json()["results"]}
+
+    def test_author_drops_below_limit(self):
+        self.follow(self.users[1])
+        popular = self.publish()
+        self.assertFalse(Recipe.objects.get(pk=popular.pk).fanned_out)
+        self.client.delete(f"/api/users/{self.author.id}/subscribe/")
+        self.assertIn(popular.id, self.feed(self.users[0]))
+
+    def test_author_rises_above_limit(self):
+        fanned_out = self.publish()
+        self.assertTrue(Recipe.objects.get(pk=fanned_out.pk).fanned_out)
+        self.follow(self.users[1])
+        popular = self.publish()
+        for user in self.users[:2]:
+            self.assertEqual(self.feed(user), {fanned_out.id, popular.id})
+
+
+class BulkRelationTests(FixturesMixin, TestCase):
+    """Пакетное удаление не зависит от числа рецептов по запросам"""
+
+    url = "/api/recipes/shopping_cart/"
+
+    def bulk(self, method, recipes):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                self.url,
+                {"recipes": [recipe.id for recipe in recipes]},
+                format="json",
+            )
+        self.assertIn(response.status_code, (201, 204), response.content)
+
+    def delete_queries(self, recipes):
+        self.bulk("post", recipes)
+        with CaptureQueriesContext(connection) as context:
+            self.bulk("delete", recipes)
+        return len(context)
+
+    def test_delete(self):
+        recipes = self.create_recipes(6)
+        self.assertEqual(
+            self.delete_queries(recipes[:1]), self.delete_queries(recipes)
+        )
+        self.assertFalse(ShoppingCart.objects.exists())
+        self.assertFalse(ShoppingCartTotal.objects.exists())
+        self.assertFalse(
+            Recipe.objects.filter(shopping_cart_count__gt=0).exists()
+        )
+        response = self.client.get("/api/recipes/?is_in_shopping_cart=1")
+        self.assertEqual(response.json()["count"], 0)
+
+    def assert_totals(self):
+        self.assertEqual(
+            {
+                (total.user_id, total.ingredient_id): total.amount
+                for total in ShoppingCartTotal.objects.all()
+            },
+            ShoppingCartTotal.objects.calculate(),
+        )
+
+    def test_totals_change_by_delta(self):
+        recipes = self.create_recipes(3)
+        self.bulk("post", recipes[:1])
+        self.bulk("post", recipes)
+        self.assert_totals()
+        self.bulk("delete", recipes[1:])
+        self.assert_totals()
+        self.assertEqual(
+            list(
+                Recipe.objects.order_by("id")
+                .values_list("shopping_cart_count", flat=True)
+            ),
+            [1, 0, 0],
+        )
+
+
+class ImageVariantsCommandTests(FixturesMixin, TestCase):
+    """Потерянные задания на варианты изображений достраиваются"""
+
+    def test_outdated_variants_are_built(self):
+        recipes = self.create_recipes(2)
+        Recipe.objects.filter(pk=recipes[0].pk).update(
+            image_variants={"source": FIXTURE_IMAGE}
+        )
+        output = io.StringIO()
+        call_command("rebuild_image_variants", stdout=output)
+        self.assertIn("перестроено 1, с ошибками 0", output.getvalue())
+        variants = Recipe.objects.get(pk=recipes[1].pk).image_variants
+        self.assertEqual(variants["source"], FIXTURE_IMAGE)
+        self.assertEqual(set(variants), {"source", *settings.IMAGE_VARIANTS})
+
+
+class InitBackendTests(TestCase):
+    """Шаги инициализации пропускаются, когда делать нечего"""
+
+    def test_existing_superuser_is_skipped(self):
+        command = init_backend.Command()
+        command.force = False
+        self.assertTrue(command.create_super_user())
+        self.assertTrue(User.objects.get(username="admin").is_superuser)
+        with CaptureQueriesContext(connection) as context:
+            self.assertFalse(command.create_super_user())
+        self.assertEqual(len(context), 1)
+
+
+@override_settings(MAX_IMAGE_UPLOAD_SIZE=512)
+class ImageSizeLimitTests(FixturesMixin, TestCase):
+    """Слишком большое изображение отклоняется с понятной ошибкой"""
+
+    url = "/api/users/me/avatar/"
+    message = "Размер изображения не должен превышать 512 Б"
+
+    def test_multipart(self):
+        upload = SimpleUploadedFile("avatar.png", b"0" * 1024, "image/png")
+        response = self.client.put(
+            self.url, {"avatar": upload}, format="multipart"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"avatar": [self.message]})
+
+    def test_admin_upload_is_not_limited_by_api_handler(self):
+        admin_user = User.objects.create_superuser(
+            username="admin", email="admin@example.com", password="password"
+        )
+        client = Client()
+        client.force_login(admin_user)
+        upload = SimpleUploadedFile("recipe.png", b"0" * 1024, "image/png")
+        response = client.post("/admin/recipes/recipe/add/", {"image": upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["adminform"].form.errors)
+
+    def test_base64(self):
+        image = base64.b64encode(b"0" * 1024).decode()
+        response = self.client.put(
+            self.url, {"avatar": f"data:image/png;base64,{image}"},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"avatar": [self.message]})
+
+    def test_format_size(self):
+        self.assertEqual(format_size(10 * 1024 * 1024), "10 МБ")
+        self.assertEqual(format_size(1536 * 1024), "1,5 МБ")
+        self.assertEqual(format_size(512 * 1024), "512 КБ")
+        self.assertEqual(format_size(300), "300 Б")
+
+
+class TokenCacheTests(FixturesMixin, TestCase):
+    """Пользователи токенов кешируются без пароля и личных данных"""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=self.user)
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+
+    def me(self):
+        return self.client.get("/api/users/me/")
+
+    def token_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(self.me().status_code, 200)
+        return [
+            query for query in context.captured_queries
+            if "authtoken_token" in query["sql"]
+        ]
+
+    def test_process_local_cache(self):
+        with cache_alias("AUTH_TOKEN_CACHE_ALIAS", "locmem.LocMemCache"):
+            self.me()
+            self.assertIsNone(token_users.shared)
+            self.assertEqual(self.token_queries(), [])
+            self.assertEqual(self.me().json()["username"], "user0")
+            with self.captureOnCommitCallbacks(execute=True):
+                self.token.delete()
+            self.assertEqual(self.me().status_code, 401)
+
+    def test_shared_cache(self):
+        with tempfile.TemporaryDirectory() as location, cache_alias(
+            "AUTH_TOKEN_CACHE_ALIAS", "filebased.FileBasedCache", location
+        ):
+            self.me()
+            # Свежая запись LRU не сверяется с общим кешем
+            with mock.patch.object(
+                token_users.shared, "get_many", side_effect=AssertionError
+            ):
+                self.assertEqual(self.token_queries(), [])
+            token_users.local.clear()
+            self.assertEqual(self.token_queries(), [])
+            digest = token_users.digest(self.token.key)
+            entry = token_users.local.get(digest)
+            self.assertEqual(entry, token_users.shared.get(
+                f"auth-token:{digest}"
+            ))
+            self.assertEqual(entry[1], (self.user.id, True, False, False))
+            with self.captureOnCommitCallbacks(execute=True):
+                self.token.delete()
+            # Запись другого воркера после срока сверки отсекает новая
+            # эпоха токена
+            token_users.local.clear()
+            self.assertEqual(self.me().status_code, 401)
+
+    def test_cached_user_changes_password(self):
+        with cache_alias("AUTH_TOKEN_CACHE_ALIAS", "locmem.LocMemCache"):
+            self.me()
+            response = self.client.post("/api/users/set_password/", {
+                "current_password": "password",
+                "new_password": "new-password-123",
+            })
+            self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("new-password-123"))
+        self.assertEqual(self.user.username, "user0")
+
+
+class UserRelationCacheTests(FixturesMixin, TestCase):
+    """Флаги не устаревают, когда связи меняет другой процесс"""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.create_recipes(1)[0]
+        self.needed = {"favorites": [self.recipe.id]}
+
+    def is_favorited(self):
+        return user_relations.get(self.user, self.needed).has(
+            "favorites", self.recipe.id
+        )
+
+    def test_without_shared_cache(self):
+        with cache_alias("USER_RELATIONS_CACHE_ALIAS", "locmem.LocMemCache"):
+            self.assertFalse(self.is_favorited())
+            # on_commit не выполняется: версии нет, флаг читается из базы
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+            self.assertTrue(self.is_favorited())
+            self.assertEqual(len(user_relations.local), 0)
+
+    def test_concurrent_writers(self):
+        with tempfile.TemporaryDirectory() as location, cache_alias(
+            "USER_RELATIONS_CACHE_ALIAS", "filebased.FileBasedCache", location
+        ):
+            self.assertFalse(self.is_favorited())
+            other = self.create_recipes(1)[0]
+            # Другой процесс добавил рецепт и увеличил версию раньше
+            Favorite.objects.create(user=self.user, recipe=other)
+            user_relations.shared.incr(VERSION_KEY.format(self.user.pk))
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+            user_relations.apply(
+                self.user.pk, "favorites", [self.recipe.id], True
+            )
+            self.needed = {"favorites": [self.recipe.id, other.id]}
+            relations = user_relations.get(self.user, self.needed)
+            self.assertTrue(relations.has("favorites", self.recipe.id))
+            self.assertTrue(relations.has("favorites", other.id))
+
+
+@skipUnless(connection.vendor == "postgresql", "Нужен PostgreSQL")
+class ReplicaCheckTests(TestCase):
+    """Проверка отставания на основной базе: WAL не принимается"""
+
+    def test_primary_has_no_lag(self):
+        self.assertTrue(ReplicaPool.check(DEFAULT_DB_ALIAS))
+        with override_settings(REPLICA_MAX_LAG=-1):
+            self.assertFalse(ReplicaPool.check(DEFAULT_DB_ALIAS))
+
+
+@skipUnless("replica_0" in settings.DATABASES, "DB_REPLICA_HOSTS не задан")
+@override_settings(IMAGE_PROCESSING_SYNC=True)
+class ReplicaRoutingTests(FixturesMixin, TransactionTestCase):
+    """
+    Реплика в тестах — зеркало основной базы (TEST MIRROR): данные
+    коммитятся, чтобы быть видны через ее соединение
+    """
+
+    databases = set(settings.DATABASES)
+    read_from_replicas = True
+
+    def setUp(self):
+        super().setUp()
+        replicas.checked.clear()
+        self.recipe = self.create_recipes(1)[0]
+
+    def replica_queries(self, method, url):
+        with CaptureQueriesContext(connections["replica_0"]) as context:
+            response = getattr(self.client, method)(url)
+        self.assertLess(response.status_code, 400, response.content)
+        return len(context)
+
+    def test_replica_is_healthy(self):
+        self.assertTrue(ReplicaPool.check("replica_0"))
+        self.assertEqual(replicas.choose(), "replica_0")
+
+    def test_reads_go_to_replica(self):
+        url = f"/api/recipes/{self.recipe.id}/"
+        self.assertGreater(self.replica_queries("get", url), 0)
+
+    def test_writes_pin_reads_to_primary(self):
+        url = f"/api/recipes/{self.recipe.id}/favorite/"
+        self.assertEqual(self.replica_queries("post", url), 0)
+        self.assertEqual(self.replica_queries("get", "/api/recipes/"), 0)
+
+
+class MetricsFilesTests(SimpleTestCase):
+    """Файлы метрик завершившихся воркеров"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.registry = MetricsRegistry(directory.name)
+        self.dead_pid = self.exited_process()
+        for pid in (os.getpid(), self.dead_pid):
+            self.write(pid, {
+                "requests": {"RecipeViewSet.list|GET|200": 2},
+                "pool": {"default": {"checkouts": 3, "in_use": 1}},
+            })
+
+    @staticmethod
+    def exited_process():
+        process = subprocess.Popen([sys.executable, "-c", ""])
+        process.wait()
+        return process.pid
+
+    def write(self, pid, state):
+        path = os.path.join(
+            self.registry.directory, f"metrics-{pid}-test.json"
+        )
+        with open(path, "w") as file:
+            json.dump({**MetricsRegistry.empty(), **state}, file)
+
+    def test_dead_worker_gauges_are_skipped(self):
+        state = self.registry.collect()
+        self.assertEqual(state["requests"]["RecipeViewSet.list|GET|200"], 4)
+        self.assertEqual(
+            state["pool"]["default"], {"checkouts": 6, "in_use": 1}
+        )
+
+    def test_process_exited(self):
+        self.registry.process_exited(self.dead_pid)
+        self.assertEqual(
+            set(os.listdir(self.registry.directory)),
+            {EXITED_FILE, f"metrics-{os.getpid()}-test.json"},
+        )
+        self.registry.process_exited(self.exited_process())
+        state = self.registry.collect()
+        self.assertEqual(state["requests"]["RecipeViewSet.list|GET|200"], 4)
+        self.assertEqual(
+            state["pool"]["default"], {"checkouts": 6, "in_use": 1}
+        )
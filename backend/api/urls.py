@@ -1,6 +1,9 @@
+from api.views import async_reads
 from api.views.ingredients import IngredientViewSet
+from api.views.metrics import MetricsView
 from api.views.recipes import RecipeViewSet
 from api.views.users import CustomUserViewSet
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
@@ -13,5 +16,31 @@ router.register("users", CustomUserViewSet, basename="users")
 
 urlpatterns = [
     path("", include(router.urls)),
+    path("metrics", MetricsView.as_view(), name="metrics"),
     path("auth/", include("djoser.urls.authtoken")),
 ]
+
+if settings.ASYNC_READS:
+    # Под ASGI чтение горячих эндпоинтов идет мимо синхронных вьюсетов
+    urlpatterns = [
+        path(
+            "recipes/",
+            async_reads.recipes_list,
+            name="recipes-list-async",
+        ),
+        path(
+            "recipes/<int:pk>/",
+            async_reads.recipes_detail,
+            name="recipes-detail-async",
+        ),
+        path(
+            "ingredients/",
+            async_reads.ingredients_list,
+            name="ingredients-list-async",
+        ),
+        path(
+            "ingredients/<int:pk>/",
+            async_reads.ingredients_detail,
+            name="ingredients-detail-async",
+        ),
+    ] + urlpatterns
@@ -1,24 +1,159 @@
 import base64
+import binascii
+import json
 import uuid
 
-from django.core.files.base import ContentFile
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.core.paginator import InvalidPage
+from django.db.models import Q
 from django_filters import rest_framework as filters
+from recipes.images import VARIANT_FORMATS
 from recipes.models import Ingredient, Recipe
 from rest_framework import serializers
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination, PageNumberPagination,
+                                       replace_query_param)
+from rest_framework.parsers import MultiPartParser
+from rest_framework.response import Response
+
+
+def format_size(size):
+    """Размер в МБ или КБ с точностью до десятых: 10 МБ, 1,5 МБ, 512 КБ"""
+    for unit, factor in (("МБ", 1024 * 1024), ("КБ", 1024)):
+        if size >= factor:
+            value = f"{size / factor:.1f}".rstrip("0").rstrip(".")
+            return f"{value.replace('.', ',')} {unit}"
+    return f"{size} Б"
+
+
+def image_too_large_message():
+    return (
+        "Размер изображения не должен превышать "
+        f"{format_size(settings.MAX_IMAGE_UPLOAD_SIZE)}"
+    )
+
+
+class DecodedImageFile(TemporaryUploadedFile):
+    """
+    Временный файл с декодированным base64. В отличие от файлов запроса
+    Django его не закрывает, поэтому закрываем при сборке мусора
+    (файл к этому моменту уже может быть перемещён в хранилище)
+    """
+
+    def __del__(self):
+        self.close()
 
 
 class Base64ImageField(serializers.ImageField):
-    """Поле для работы с изображениями в формате base64"""
+    """
+    Поле для работы с изображениями в формате base64 или файлом
+    из multipart/form-data.
+
+    base64 декодируется частями во временный файл, размер проверяется
+    до декодирования
+    """
+
+    decode_chunk_size = 64 * 1024
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith("data:image"):
-            format, imgstr = data.split(";base64,")
+            format, _, imgstr = data.partition(";base64,")
+            if not imgstr:
+                self.fail("invalid_image")
+            if len(imgstr) * 3 // 4 > settings.MAX_IMAGE_UPLOAD_SIZE:
+                self.fail_too_large()
             ext = format.split("/")[-1]
             id = uuid.uuid4()
-            data = ContentFile(base64.b64decode(imgstr), name=f"{id}.{ext}")
+            data = self.decode(imgstr, f"{id}.{ext}", format[len("data:"):])
+        elif getattr(data, "size", 0) > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.fail_too_large()
         return super().to_internal_value(data)
 
+    def decode(self, imgstr, name, content_type):
+        file = DecodedImageFile(name, content_type, 0, None)
+        try:
+            for start in range(0, len(imgstr), self.decode_chunk_size):
+                file.write(base64.b64decode(
+                    imgstr[start:start + self.decode_chunk_size],
+                    validate=True,
+                ))
+        except (binascii.Error, ValueError):
+            file.close()
+            self.fail("invalid_image")
+        file.size = file.tell()
+        file.seek(0)
+        return file
+
+    def fail_too_large(self):
+        raise serializers.ValidationError(image_too_large_message())
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Пишет загружаемые файлы сразу во временный файл на диске
+    и прерывает загрузку файла больше MAX_IMAGE_UPLOAD_SIZE ошибкой
+    валидации для его поля. Ставится только парсером API
+    """
+
+    def receive_data_chunk(self, raw_data, start):
+        if start + len(raw_data) > settings.MAX_IMAGE_UPLOAD_SIZE:
+            self.file.close()
+            raise serializers.ValidationError(
+                {self.field_name: [image_too_large_message()]}
+            )
+        return super().receive_data_chunk(raw_data, start)
+
+
+class LimitedMultiPartParser(MultiPartParser):
+    """
+    multipart/form-data с LimitedTemporaryFileUploadHandler. Вне DRF
+    (админка) ошибка валидации обработчика стала бы ответом 500, поэтому
+    он ставится на запрос здесь, а не в FILE_UPLOAD_HANDLERS
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        request = parser_context["request"]
+        request.upload_handlers = [LimitedTemporaryFileUploadHandler(request)]
+        return super().parse(stream, media_type, parser_context)
+
+
+class ImageVariantsField(serializers.Field):
+    """
+    Карта уменьшенных вариантов изображения {имя: {формат: ссылка}},
+    пока вариант не построен — ссылка на оригинал
+    """
+
+    def __init__(self, image_field, variants_field, **kwargs):
+        self.image_field = image_field
+        self.variants_field = variants_field
+        kwargs["source"] = "*"
+        kwargs["read_only"] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, obj):
+        image = getattr(obj, self.image_field)
+        if not image:
+            return None
+        variants = getattr(obj, self.variants_field) or {}
+        if variants.get("source") != image.name:
+            variants = {}
+        request = self.context.get("request")
+
+        def url(path):
+            url = image.storage.url(path) if path else image.url
+            return request.build_absolute_uri(url) if request else url
+
+        return {
+            name: {
+                extension: url(variants.get(name, {}).get(extension))
+                for extension in VARIANT_FORMATS
+            }
+            for name in settings.IMAGE_VARIANTS
+        }
+
 
 class CustomPagination(PageNumberPagination):
     """Кастомный класс пагинации"""
@@ -27,6 +162,227 @@ class CustomPagination(PageNumberPagination):
     page_size_query_param = "limit"
 
 
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу без COUNT и OFFSET.
+
+    Порядок задается атрибутом cursor_ordering у вьюшки, курсор хранит
+    значения полей порядка у последней (или первой) записи страницы.
+    """
+
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = "limit"
+    max_page_size = settings.MAX_PAGE_SIZE
+    cursor_query_param = "cursor"
+    ordering = ("-pub_date", "-id")
+    invalid_cursor_message = "Неверный курсор"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        def fetch(ordering, position, size):
+            return list(self._slice(queryset, ordering, position, size))
+
+        return self.paginate(fetch, queryset.model, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        async def fetch(ordering, position, size):
+            return [
+                obj async for obj
+                in self._slice(queryset, ordering, position, size)
+            ]
+
+        return await self.apaginate(fetch, queryset.model, request, view)
+
+    def _slice(self, queryset, ordering, position, size):
+        page = queryset.order_by(*ordering)
+        if position is not None:
+            page = page.filter(self._after(ordering, position))
+        return page[:size]
+
+    def paginate(self, fetch, model, request, view=None):
+        """
+        Пагинация произвольного источника: fetch(ordering, position, size)
+        возвращает до size объектов строго после position в порядке
+        ordering
+        """
+        ordering, position, reverse = self._start(request, model, view)
+        results = fetch(ordering, position, self.page_size + 1)
+        return self._finish(results, position, reverse)
+
+    async def apaginate(self, fetch, model, request, view=None):
+        """То же для асинхронного fetch"""
+        ordering, position, reverse = self._start(request, model, view)
+        results = await fetch(ordering, position, self.page_size + 1)
+        return self._finish(results, position, reverse)
+
+    def _start(self, request, model, view):
+        self.request = request
+        self.ordering = getattr(view, "cursor_ordering", self.ordering)
+        self.page_size = self.get_page_size(request)
+        position, reverse = self.decode_cursor(request, model)
+        ordering = self.ordering
+        if reverse:
+            ordering = tuple(self._invert(field) for field in ordering)
+        return ordering, position, reverse
+
+    def _finish(self, results, position, reverse):
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        self.page = results
+        return results
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def get_paginated_response(self, data):
+        return Response({
+            "next": self.get_next_link(),
+            "previous": self.get_previous_link(),
+            "results": data,
+        })
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, obj, reverse):
+        position = [
+            self._serialize(getattr(obj, field.lstrip("-")))
+            for field in self.ordering
+        ]
+        token = base64.urlsafe_b64encode(
+            json.dumps({"p": position, "r": reverse}).encode()
+        ).decode()
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.cursor_query_param,
+            token,
+        )
+
+    def decode_cursor(self, request, model):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(token.encode()))
+            values = cursor["p"]
+            if not isinstance(values, list) or (
+                len(values) != len(self.ordering)
+            ):
+                raise ValueError
+            position = [
+                self._position_value(model, field, value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return position, bool(cursor.get("r"))
+        except (TypeError, ValueError, KeyError, binascii.Error,
+                ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    @staticmethod
+    def _position_value(model, field, value):
+        """Значение поля порядка из курсора: только строка или число"""
+        if isinstance(value, bool) or not isinstance(value, (str, int)):
+            raise ValueError
+        value = model._meta.get_field(field.lstrip("-")).to_python(value)
+        if value is None:
+            raise ValueError
+        return value
+
+    @staticmethod
+    def _serialize(value):
+        if hasattr(value, "isoformat"):
+            return value.isoformat()
+        return value
+
+    @staticmethod
+    def _invert(field):
+        return field[1:] if field.startswith("-") else f"-{field}"
+
+    @staticmethod
+    def _after(ordering, position):
+        """Условие "строго после позиции" для составного ключа"""
+        condition = Q()
+        for index, field in enumerate(ordering):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{name}__{lookup}": position[index]})
+            for prev_field, value in zip(ordering[:index], position):
+                step &= Q(**{prev_field.lstrip("-"): value})
+            condition |= step
+        return condition
+
+
+class OptionalCursorPagination(CustomPagination):
+    """
+    Постраничная пагинация по умолчанию, курсорная — если в запросе
+    передан параметр cursor (для первой страницы — пустой)
+    """
+
+    cursor_pagination_class = KeysetPagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.keyset = self.cursor_pagination_class()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """
+        То же на асинхронном ORM; страницы без курсора отдаются всегда,
+        как при заданном PAGE_SIZE
+        """
+        self.keyset = None
+        if self.cursor_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.keyset = self.cursor_pagination_class()
+            return await self.keyset.apaginate_queryset(
+                queryset, request, view
+            )
+        self.request = request
+        paginator = self.django_paginator_class(
+            queryset, self.get_page_size(request)
+        )
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            self.page = paginator.page(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)
+            ))
+        self.page.object_list = [
+            obj async for obj in self.page.object_list
+        ]
+        return list(self.page)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
 class CustomIngredientFilter(filters.FilterSet):
     """Кастомный фильтр для ингредиентов"""
 
@@ -0,0 +1,179 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.utils.cache import patch_vary_headers
+from rest_framework import exceptions
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from ..authentication import CachedTokenAuthentication
+from ..cache import recipe_fragments
+from ..ingredient_index import ingredient_index
+from ..short_links import short_links
+from ..utils import OptionalCursorPagination
+from .ingredients import IngredientViewSet
+from .recipes import RecipeViewSet
+
+READ_METHODS = ("GET", "HEAD")
+
+
+async def authenticate(request):
+    """Асинхронный аналог аутентификации DRF по токену"""
+    result = await CachedTokenAuthentication().aauthenticate(request)
+    return result[0] if result else AnonymousUser()
+
+
+def json_response(data, status=200):
+    response = HttpResponse(
+        JSONRenderer().render(data),
+        content_type="application/json",
+        status=status,
+    )
+    patch_vary_headers(response, ("Accept",))
+    return response
+
+
+def error_response(error):
+    """Ответ на исключение DRF в том же виде, что у exception_handler"""
+    detail = error.detail
+    if not isinstance(detail, (list, dict)):
+        detail = {"detail": detail}
+    response = json_response(detail, error.status_code)
+    if isinstance(error, exceptions.AuthenticationFailed):
+        response["WWW-Authenticate"] = "Token"
+    return response
+
+
+def wants_browsable_api(request):
+    return "format" in request.GET or (
+        "text/html" in request.headers.get("Accept", "")
+    )
+
+
+def read_view(viewset, actions, handler, **initkwargs):
+    """
+    Вьюха для ASGI: GET и HEAD обслуживает handler на асинхронном ORM,
+    остальные методы и Browsable API — синхронный вьюсет
+    """
+    sync_view = viewset.as_view(actions, **initkwargs)
+
+    async def view(request, *args, **kwargs):
+        if request.method not in READ_METHODS or wants_browsable_api(request):
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+        request = Request(request)
+        try:
+            request.user = await authenticate(request)
+            data = await handler(request, *args, **kwargs)
+        except exceptions.APIException as error:
+            return error_response(error)
+        if isinstance(data, HttpResponse):
+            return data
+        return json_response(data)
+
+    view.csrf_exempt = True
+    # Метрики и бюджеты запросов видят действия вьюсета
+    view.cls = sync_view.cls
+    view.initkwargs = sync_view.initkwargs
+    view.actions = sync_view.actions
+    return view
+
+
+def viewset_for(viewset, request, action, **kwargs):
+    """Экземпляр вьюсета для его фильтров и настроек без dispatch"""
+    return viewset(
+        request=request,
+        args=(),
+        kwargs=kwargs,
+        action=action,
+        format_kwarg=None,
+    )
+
+
+async def filtered_recipes(request, action, **kwargs):
+    view = viewset_for(RecipeViewSet, request, action, **kwargs)
+    # django-filter проверяет автора запросом к базе при валидации
+    return await sync_to_async(view.filter_queryset)(view.get_queryset())
+
+
+async def recipe_list(request):
+    queryset = await filtered_recipes(request, "list")
+    paginator = OptionalCursorPagination()
+    page = await paginator.apaginate_queryset(
+        queryset, request, RecipeViewSet
+    )
+    return paginator.get_paginated_response(
+        await recipe_fragments.arender(page, request)
+    ).data
+
+
+async def recipe_detail(request, pk):
+    queryset = await filtered_recipes(request, "retrieve", pk=pk)
+    recipe = await queryset.filter(pk=pk).afirst()
+    if recipe is None:
+        raise exceptions.NotFound
+    return (await recipe_fragments.arender([recipe], request))[0]
+
+
+async def ingredient_list(request):
+    name = request.query_params.get("name")
+    if name:
+        view = viewset_for(IngredientViewSet, request, "list")
+        return await ingredient_index.asearch(name, view.get_search_limit())
+    return IngredientViewSet.catalog_response(
+        request, await ingredient_index.acatalog()
+    )
+
+
+async def ingredient_detail(request, pk):
+    ingredient = await ingredient_index.aget(pk)
+    if ingredient is None:
+        raise exceptions.NotFound
+    return ingredient
+
+
+recipes_list = read_view(
+    RecipeViewSet,
+    {"get": "list", "post": "create"},
+    recipe_list,
+    basename="recipes",
+    detail=False,
+)
+recipes_detail = read_view(
+    RecipeViewSet,
+    {
+        "get": "retrieve",
+        "put": "update",
+        "patch": "partial_update",
+        "delete": "destroy",
+    },
+    recipe_detail,
+    basename="recipes",
+    detail=True,
+)
+ingredients_list = read_view(
+    IngredientViewSet,
+    {"get": "list"},
+    ingredient_list,
+    basename="ingredients",
+    detail=False,
+)
+ingredients_detail = read_view(
+    IngredientViewSet,
+    {"get": "retrieve"},
+    ingredient_detail,
+    basename="ingredients",
+    detail=True,
+)
+
+
+async def short_link_redirect(request, code):
+    """
+    Перенаправляет короткую ссылку на страницу рецепта
+    """
+    recipe_id = await short_links.aresolve(code)
+    if recipe_id is None:
+        raise Http404
+    return HttpResponseRedirect(
+        settings.RECIPE_FRONTEND_URL.format(id=recipe_id)
+    )
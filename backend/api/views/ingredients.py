@@ -1,16 +1,27 @@
+from django.conf import settings
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from recipes.models import Ingredient
 from rest_framework import viewsets
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
 
+from ..ingredient_index import ingredient_index
 from ..serializers.ingredients import IngredientSerializer
 from ..utils import CustomIngredientFilter
 
+CATALOG_ENCODINGS = ("br", "gzip")
+
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """
     Вьюшка для работы с ингредиентами
+
+    Список, поиск по префиксу и получение по id обслуживаются
+    из индекса ингредиентов в памяти процесса
     """
 
     queryset = Ingredient.objects.all()
@@ -21,6 +32,7 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     search_fields = ["^name"]
     pagination_class = None
     permission_classes = [AllowAny]
+    query_budgets = {"list": 1, "retrieve": 1}
 
     def get_object(self):
         ingredients = self.get_queryset()
@@ -28,3 +40,79 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
         ingredient = get_object_or_404(ingredients, id=ingredient_id)
         self.check_object_permissions(self.request, ingredient)
         return ingredient
+
+    def get_search_limit(self):
+        limit = settings.INGREDIENT_SEARCH_LIMIT
+        try:
+            requested = int(self.request.query_params["limit"])
+        except (KeyError, ValueError):
+            return limit
+        if requested <= 0:
+            return limit
+        return min(requested, limit)
+
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get("name")
+        if name:
+            return Response(
+                ingredient_index.search(name, self.get_search_limit())
+            )
+        if request.accepted_renderer.format != "json":
+            return Response(ingredient_index.all())
+        return self.catalog_response(request, ingredient_index.catalog())
+
+    @classmethod
+    def catalog_response(cls, request, catalog):
+        """
+        Отдает заранее собранный и сжатый справочник с ETag,
+        чтобы клиенты и nginx могли перепроверять его через 304
+        """
+        encoding = cls.get_catalog_encoding(request, catalog["variants"])
+        etag = catalog["etag"]
+        if encoding != "identity":
+            etag = f"{etag}-{encoding}"
+        etag = f'"{etag}"'
+
+        if_none_match = request.META.get("HTTP_IF_NONE_MATCH", "")
+        if etag in (tag.strip() for tag in if_none_match.split(",")):
+            response = HttpResponse(status=304)
+        else:
+            response = HttpResponse(
+                catalog["variants"][encoding],
+                content_type="application/json",
+            )
+            if encoding != "identity":
+                response["Content-Encoding"] = encoding
+        response["ETag"] = etag
+        response["Cache-Control"] = settings.INGREDIENT_CATALOG_CACHE_CONTROL
+        patch_vary_headers(response, ("Accept", "Accept-Encoding"))
+        return response
+
+    @staticmethod
+    def get_catalog_encoding(request, variants):
+        accepted = {}
+        header = request.META.get("HTTP_ACCEPT_ENCODING", "")
+        for item in header.split(","):
+            coding, _, params = item.strip().partition(";")
+            quality = 1.0
+            params = params.strip()
+            if params.startswith("q="):
+                try:
+                    quality = float(params[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip().lower()] = quality
+        for encoding in CATALOG_ENCODINGS:
+            quality = accepted.get(encoding, accepted.get("*", 0.0))
+            if encoding in variants and quality > 0:
+                return encoding
+        return "identity"
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            ingredient = ingredient_index.get(int(self.kwargs["pk"]))
+        except ValueError:
+            ingredient = None
+        if ingredient is None:
+            raise NotFound
+        return Response(ingredient)
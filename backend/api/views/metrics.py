@@ -0,0 +1,20 @@
+from django.http import HttpResponse
+from rest_framework.views import APIView
+
+from ..metrics import metrics
+from ..permissions import CanViewMetrics
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class MetricsView(APIView):
+    """
+    Метрики запросов в текстовом формате Prometheus
+    """
+
+    permission_classes = (CanViewMetrics,)
+
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE
+        )
@@ -1,21 +1,30 @@
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import Http404, HttpResponseRedirect
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart)
+from recipes.models import (Favorite, FeedEntry, Ingredient, Recipe,
+                            ShoppingCart, ShoppingCartTotal)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from ..cache import recipe_fragments
 from ..permissions import IsAuthorOrReadOnly
+from ..relations import user_relations
 from ..serializers.ingredients import IngredientSerializer
 from ..serializers.recipes import (RecipeCreateUpdateSerializer,
-                                   RecipeListSerializer)
+                                   RecipeIdsSerializer, RecipeListSerializer)
 from ..serializers.users import RecipeMinifiedSerializer
-from ..utils import (CustomIngredientFilter, CustomPagination,
-                     CustomRecipeFilter)
+from ..shopping_list import available_formats, shopping_list_response
+from ..short_links import short_links
+from ..utils import (CustomIngredientFilter, CustomRecipeFilter,
+                     KeysetPagination, LimitedMultiPartParser,
+                     OptionalCursorPagination)
+
+BULK_INSERT_ATTEMPTS = 3
 
 
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
@@ -42,11 +51,49 @@ class RecipeViewSet(viewsets.ModelViewSet):
     Вьюшка для работы с рецептами
     """
 
-    queryset = Recipe.objects.all().select_related("author")
+    queryset = Recipe.objects.all()
     serializer_class = RecipeListSerializer
+    parser_classes = (JSONParser, LimitedMultiPartParser)
     permission_classes = (IsAuthorOrReadOnly,)
-    pagination_class = CustomPagination
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ("-pub_date", "-id")
     filterset_class = CustomRecipeFilter
+    query_budgets = {
+        "list": 9,
+        "retrieve": 7,
+        "create": 19,
+        "update": 23,
+        "partial_update": 23,
+        "destroy": 19,
+        "get_link": 4,
+        "feed": 9,
+        "download_shopping_cart": 3,
+        "favorite": 6,
+        "shopping_cart": 10,
+        "favorite_bulk": 7,
+        "shopping_cart_bulk": 13,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ("list", "retrieve"):
+            return queryset.only(
+                "id", "author_id", "pub_date", "fragment_version"
+            )
+        return queryset
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(
+                recipe_fragments.render(page, request)
+            )
+        return Response(recipe_fragments.render(queryset, request))
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        return Response(recipe_fragments.render([recipe], request)[0])
 
     def get_permissions(self):
         if self.action in ["list", "retrieve", "get_link"]:
@@ -80,35 +127,124 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return False
         return obj.shopping_carts.filter(user=request.user).exists()
 
+    @staticmethod
+    def _add_missing(model_class, user_id, recipe_ids):
+        """
+        Добавляет отсутствующие рецепты и возвращает их id. Если строку
+        между чтением и вставкой добавил параллельный запрос, вставка
+        падает на уникальности и повторяется с новым чтением
+        """
+        for attempt in range(BULK_INSERT_ATTEMPTS):
+            existing = set(
+                model_class.objects.filter(
+                    user_id=user_id, recipe_id__in=recipe_ids
+                ).values_list("recipe_id", flat=True)
+            )
+            missing = [
+                recipe_id for recipe_id in recipe_ids
+                if recipe_id not in existing
+            ]
+            try:
+                with transaction.atomic():
+                    model_class.objects.bulk_create(
+                        model_class(user_id=user_id, recipe_id=recipe_id)
+                        for recipe_id in missing
+                    )
+                return missing
+            except IntegrityError:
+                if attempt == BULK_INSERT_ATTEMPTS - 1:
+                    raise
+
     def _handle_m2m_action(self, request, pk, model_class, error_message):
-        recipe = get_object_or_404(Recipe, id=pk)
         if request.method == "POST":
-            if (model_class.objects.filter(
-                    user=request.user,
-                    recipe=recipe)
-                    .exists()):
+            recipe = get_object_or_404(Recipe, id=pk)
+            try:
+                with transaction.atomic():
+                    model_class.objects.create(
+                        user=request.user, recipe=recipe
+                    )
+                    if model_class is ShoppingCart:
+                        ShoppingCartTotal.objects.add_recipe(
+                            recipe.id, [request.user.id]
+                        )
+            except IntegrityError:
                 return Response(
                     {"errors": error_message},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            model_class.objects.create(user=request.user, recipe=recipe)
             serializer = RecipeMinifiedSerializer(
                 recipe,
                 context={"request": request}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        obj = model_class.objects.filter(
-            user=request.user,
-            recipe=recipe
-        ).first()
-        if not obj:
+        with transaction.atomic():
+            deleted, _ = model_class.objects.filter(
+                user=request.user,
+                recipe_id=pk
+            ).delete()
+            if deleted and model_class is ShoppingCart:
+                ShoppingCartTotal.objects.remove_recipe(pk, [request.user.id])
+        if not deleted:
+            get_object_or_404(Recipe, id=pk)
             return Response(
                 {"errors": "Рецепт не найден в списке"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        obj.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _handle_bulk_m2m_action(self, request, model_class):
+        """
+        Добавление или удаление сразу нескольких рецептов: один INSERT
+        и один DELETE. Итоги списка покупок меняются только на рецепты,
+        которые действительно добавлены или удалены
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.validated_data["recipes"]
+        recipe_ids = [recipe.id for recipe in recipes]
+        added = request.method == "POST"
+        user_id = request.user.id
+        with transaction.atomic():
+            if added and model_class is ShoppingCart:
+                added_ids = self._add_missing(model_class, user_id, recipe_ids)
+                ShoppingCartTotal.objects.add_recipes(added_ids, [user_id])
+            elif added:
+                model_class.objects.bulk_create(
+                    (
+                        model_class(user_id=user_id, recipe_id=recipe_id)
+                        for recipe_id in recipe_ids
+                    ),
+                    ignore_conflicts=True,
+                )
+                added_ids = recipe_ids
+            else:
+                rows = model_class.objects.filter(
+                    user_id=user_id, recipe_id__in=recipe_ids
+                )
+                if model_class is ShoppingCart:
+                    # Блокировка строк: из параллельных удалений итоги
+                    # уменьшит только то, что удалило строку
+                    ShoppingCartTotal.objects.remove_recipes(
+                        list(
+                            rows.select_for_update()
+                            .values_list("recipe_id", flat=True)
+                        ),
+                        [user_id],
+                    )
+                # Счетчики и наборы связей обновляют сигналы удаления
+                rows.delete()
+            if added:
+                # bulk_create не отправляет post_save: счетчики и наборы
+                # связей обновляются один раз
+                Recipe.objects.filter(id__in=added_ids).refresh_counters()
+                user_relations.changed(model_class, user_id, added_ids, True)
+        if not added:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        serializer = RecipeMinifiedSerializer(
+            recipes, many=True, context={"request": request}
+        )
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
     @action(
         detail=True,
         methods=["POST", "DELETE"],
@@ -129,42 +265,117 @@ class RecipeViewSet(viewsets.ModelViewSet):
             request, pk, ShoppingCart, "Рецепт уже добавлен в список покупок"
         )
 
+    @action(
+        detail=False,
+        methods=["POST", "DELETE"],
+        permission_classes=[IsAuthenticated],
+        url_path="favorite",
+        url_name="favorite-bulk",
+    )
+    def favorite_bulk(self, request):
+        return self._handle_bulk_m2m_action(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=["POST", "DELETE"],
+        permission_classes=[IsAuthenticated],
+        url_path="shopping_cart",
+        url_name="shopping-cart-bulk",
+    )
+    def shopping_cart_bulk(self, request):
+        return self._handle_bulk_m2m_action(request, ShoppingCart)
+
     @action(
         detail=False,
         methods=["GET"],
         permission_classes=[IsAuthenticated]
     )
     def download_shopping_cart(self, request):
-        ingredients = (
-            IngredientInRecipe.objects.filter(
-                recipe__shoppingcarts__user=request.user
+        file_format = request.query_params.get("file_format", "txt")
+        if file_format not in available_formats():
+            return Response(
+                {"file_format": [
+                    "Доступные форматы: " + ", ".join(available_formats())
+                ]},
+                status=status.HTTP_400_BAD_REQUEST,
             )
-            .values("ingredient__name", "ingredient__measurement_unit")
-            .annotate(total_amount=Sum("amount"))
-            .order_by("ingredient__name")
+        return shopping_list_response(request.user, file_format)
+
+    @action(
+        detail=False,
+        methods=["GET"],
+        permission_classes=[IsAuthenticated]
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь,
+        с курсорной пагинацией
+        """
+        paginator = KeysetPagination()
+        page = paginator.paginate(self._feed_page, Recipe, request, self)
+        return paginator.get_paginated_response(
+            recipe_fragments.render(page, request)
         )
 
-        shopping_list = ["Список покупок:\n\n"]
-        for item in ingredients:
-            shopping_list.append(
-                f'- {item["ingredient__name"]} '
-                f'({item["ingredient__measurement_unit"]}) '
-                f'- {item["total_amount"]}\n'
+    def _feed_page(self, ordering, position, size):
+        """
+        Берет страницу из таблицы ленты и подмешивает рецепты, которые
+        не были разосланы подписчикам при публикации
+        """
+        user = self.request.user
+        entry_ordering = tuple(
+            field.replace("id", "recipe_id")
+            if field.lstrip("-") == "id" else field
+            for field in ordering
+        )
+        entries = FeedEntry.objects.filter(user=user)
+        popular = Recipe.objects.filter(
+            fanned_out=False,
+            author__in=user.subscriptions.values("author"),
+        )
+        if position is not None:
+            entries = entries.filter(
+                KeysetPagination._after(entry_ordering, position)
             )
-
-        response = HttpResponse(
-            "".join(shopping_list),
-            content_type="text/plain; charset=utf-8"
+            popular = popular.filter(
+                KeysetPagination._after(ordering, position)
+            )
+        keys = set(
+            entries.order_by(*entry_ordering)
+            .values_list("pub_date", "recipe_id")[:size]
         )
-        response["Content-Disposition"] = (
-            'attachment; filename="shopping_list.txt"'
+        keys.update(
+            popular.order_by(*ordering).values_list("pub_date", "id")[:size]
         )
-        return response
+        descending = ordering[0].startswith("-")
+        recipe_ids = [
+            recipe_id for _, recipe_id
+            in sorted(keys, reverse=descending)[:size]
+        ]
+        recipes = Recipe.objects.filter(id__in=recipe_ids).only(
+            "id", "author_id", "pub_date", "fragment_version"
+        ).in_bulk()
+        return [
+            recipes[recipe_id] for recipe_id in recipe_ids
+            if recipe_id in recipes
+        ]
 
     @action(detail=True, methods=["GET"], url_path="get-link")
     def get_link(self, request, pk=None):
         recipe = self.get_object()
         url = request.build_absolute_uri(
-            reverse('api:recipes-detail', args=[recipe.id])
+            reverse("short-link", args=[recipe.ensure_short_code()])
         )
         return Response({"short-link": url})
+
+
+def short_link_redirect(request, code):
+    """
+    Перенаправляет короткую ссылку на страницу рецепта
+    """
+    recipe_id = short_links.resolve(code)
+    if recipe_id is None:
+        raise Http404
+    return HttpResponseRedirect(
+        settings.RECIPE_FRONTEND_URL.format(id=recipe_id)
+    )
@@ -1,8 +1,13 @@
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Prefetch, Window
+from django.db.models.functions import RowNumber
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet
+from recipes.models import FeedEntry, Recipe
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from users.models import User
@@ -10,7 +15,7 @@ from users.models import User
 from ..serializers.users import (CustomUserSerializer, SetAvatarSerializer,
                                  SetPasswordSerializer,
                                  UserWithRecipesSerializer)
-from ..utils import CustomPagination
+from ..utils import LimitedMultiPartParser, OptionalCursorPagination
 
 
 class CustomUserViewSet(UserViewSet):
@@ -19,7 +24,16 @@ class CustomUserViewSet(UserViewSet):
     """
 
     serializer_class = CustomUserSerializer
-    pagination_class = CustomPagination
+    pagination_class = OptionalCursorPagination
+    cursor_ordering = ("email", "id")
+    query_budgets = {
+        "list": 4,
+        "retrieve": 4,
+        "me": 3,
+        "avatar": 7,
+        "subscriptions": 5,
+        "subscribe": 12,
+    }
 
     def get_permissions(self):
         if self.action == "me":
@@ -28,6 +42,10 @@ class CustomUserViewSet(UserViewSet):
             return [AllowAny()]
         return super().get_permissions()
 
+    def get_instance(self):
+        # Пользователь из кеша токенов несет только id и флаги доступа
+        return User.objects.get(pk=self.request.user.pk)
+
     @action(
         detail=False,
         methods=["POST"],
@@ -46,15 +64,49 @@ class CustomUserViewSet(UserViewSet):
         user.save()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def get_recipes_limit(self):
+        recipes_limit = self.request.query_params.get(
+            "recipes_limit", settings.RECIPES_LIMIT
+        )
+        try:
+            recipes_limit = int(recipes_limit)
+        except (ValueError, TypeError):
+            return None
+        return recipes_limit if recipes_limit > 0 else None
+
+    def with_recipes(self, authors):
+        """
+        Подгружает по recipes_limit последних рецептов каждого автора
+        одним запросом
+        """
+        recipes = Recipe.objects.only(
+            "id", "name", "image", "image_variants", "cooking_time",
+            "author_id", "pub_date"
+        )
+        recipes_limit = self.get_recipes_limit()
+        if recipes_limit:
+            recipes = recipes.annotate(
+                position=Window(
+                    expression=RowNumber(),
+                    partition_by=F("author_id"),
+                    order_by=(F("pub_date").desc(), F("id").desc()),
+                )
+            ).filter(position__lte=recipes_limit)
+        return authors.prefetch_related(
+            Prefetch(
+                "recipes",
+                queryset=recipes.order_by("-pub_date", "-id"),
+                to_attr="limited_recipes",
+            )
+        )
+
     @action(
         detail=False, methods=["GET"],
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        queryset = (request.user.subscriptions.select_related('author')
-                    .values('author')
-                    .order_by("id"))
-        authors = User.objects.filter(id__in=queryset)
+        queryset = request.user.subscriptions.values("author")
+        authors = self.with_recipes(User.objects.filter(id__in=queryset))
         page = self.paginate_queryset(authors)
         if page is not None:
             recipes_limit = request.query_params.get(
@@ -88,12 +140,14 @@ class CustomUserViewSet(UserViewSet):
                     {"errors": "Вы уже подписаны на этого автора"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-            subscription = request.user.subscriptions.create(author=author)
+            with transaction.atomic():
+                request.user.subscriptions.create(author=author)
+                FeedEntry.objects.backfill(request.user.id, author.id)
             recipes_limit = request.query_params.get(
                 "recipes_limit", settings.RECIPES_LIMIT
             )
             serializer = UserWithRecipesSerializer(
-                subscription.author,
+                self.with_recipes(User.objects.filter(id=author.id)).get(),
                 context={"request": request, "recipes_limit": recipes_limit},
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -104,19 +158,25 @@ class CustomUserViewSet(UserViewSet):
                 {"errors": "Вы не подписаны на этого автора"},
                 status=status.HTTP_400_BAD_REQUEST,
             )
-        subscription.delete()
+        with transaction.atomic():
+            subscription.delete()
+            FeedEntry.objects.filter(
+                user=request.user, author=author
+            ).delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         detail=False,
         methods=["PUT", "DELETE"],
         permission_classes=[IsAuthenticated],
+        parser_classes=[JSONParser, LimitedMultiPartParser],
         url_path="me/avatar",
     )
     def avatar(self, request):
+        user = self.get_instance()
         if request.method == "DELETE":
-            request.user.avatar = None
-            request.user.save()
+            user.avatar = None
+            user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
         if not request.data:
@@ -126,7 +186,7 @@ class CustomUserViewSet(UserViewSet):
             )
 
         serializer = SetAvatarSerializer(
-            request.user,
+            user,
             data=request.data,
             partial=True
         )
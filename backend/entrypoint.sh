@@ -2,15 +2,12 @@
 
 set -e
 
-python manage.py makemigrations --noinput
-python manage.py migrate --noinput
-
-python manage.py add_ingredients
-
-python manage.py create_super_user
-
 mkdir -p /app/static /app/media
-python manage.py collectstatic --noinput
+if [ -n "$METRICS_MULTIPROCESS_DIR" ]; then
+    rm -rf "$METRICS_MULTIPROCESS_DIR"
+    mkdir -p "$METRICS_MULTIPROCESS_DIR"
+fi
+python manage.py init_backend
 
 chmod -R 755 /app/static /app/media
 
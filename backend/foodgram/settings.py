@@ -42,6 +42,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.MetricsMiddleware',
+    'api.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -49,6 +51,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.query_budget.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -90,9 +93,92 @@ DATABASES = {
         'PASSWORD': DB_PASSWORD,
         'HOST': DB_HOST,
         'PORT': DB_PORT,
+        'CONN_MAX_AGE': int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Пул соединений процесса, общий для потоков gthread-воркера:
+# DB_POOL_SIZE=0 — у каждого потока свое соединение на DB_CONN_MAX_AGE
+# секунд (0 — новое соединение на каждый запрос)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "0"))
+if DB_POOL_SIZE and DB_ENGINE == "django.db.backends.postgresql":
+    DATABASES["default"].update({
+        "ENGINE": "api.postgresql_pool",
+        # соединение возвращается в пул в конце каждого запроса
+        "CONN_MAX_AGE": 0,
+        "POOL": {
+            "SIZE": DB_POOL_SIZE,
+            "TIMEOUT": int(os.getenv("DB_POOL_TIMEOUT", "10")),
+            "MAX_LIFETIME": int(os.getenv("DB_POOL_MAX_LIFETIME", "1800")),
+            "CHECK_AFTER": int(os.getenv("DB_POOL_CHECK_AFTER", "30")),
+        },
+    })
+
+# ASGI-режим: рецепты, ингредиенты и короткие ссылки читаются
+# асинхронными вьюхами (см. api/views/async_reads.py)
+ASYNC_READS = os.getenv("ASYNC_READS", "False") == "True"
+if ASYNC_READS and not DB_POOL_SIZE:
+    # Потоки sync_to_async не держат соединения между запросами
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+
+# Реплики для чтения: DB_REPLICA_HOSTS=replica1,replica2
+DB_REPLICA_HOSTS = [
+    host for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host
+]
+for index, host in enumerate(DB_REPLICA_HOSTS):
+    DATABASES[f"replica_{index}"] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["api.db_router.PrimaryReplicaRouter"]
+REPLICA_PIN_SECONDS = int(os.getenv("REPLICA_PIN_SECONDS", "5"))
+REPLICA_CHECK_INTERVAL = 10
+REPLICA_MAX_LAG = int(os.getenv("REPLICA_MAX_LAG", "5"))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+# Воркеры gunicorn делят кеш только через Redis или memcached
+# (CACHE_BACKEND=django.core.cache.backends.redis.RedisCache,
+# CACHE_LOCATION=redis://redis:6379/0), LocMemCache у каждого процесса свой
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            "CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        'LOCATION': os.getenv("CACHE_LOCATION", "default"),
+    },
+    'recipes': {
+        'BACKEND': os.getenv(
+            "RECIPE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        'LOCATION': os.getenv("RECIPE_CACHE_LOCATION", "recipes"),
+        'TIMEOUT': int(os.getenv("RECIPE_CACHE_TIMEOUT", "86400")),
+    },
+}
+if CACHES['recipes']['BACKEND'].endswith("LocMemCache"):
+    # Клиенты Redis и memcached не принимают MAX_ENTRIES, размер
+    # ограничивает сам сервер (maxmemory)
+    CACHES['recipes']['OPTIONS'] = {
+        'MAX_ENTRIES': int(os.getenv("RECIPE_CACHE_MAX_ENTRIES", "10000")),
+    }
+
+RECIPE_CACHE_ALIAS = "recipes"
+INGREDIENT_INDEX_TTL = int(os.getenv("INGREDIENT_INDEX_TTL", "300"))
+INGREDIENT_SEARCH_LIMIT = int(os.getenv("INGREDIENT_SEARCH_LIMIT", "50"))
+INGREDIENT_CATALOG_CACHE_CONTROL = "public, no-cache"
+SHOPPING_LIST_CACHE_TTL = 60 * 60
+SHOPPING_LIST_CACHE_MAX_BYTES = 1024 * 1024
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    "SHOPPING_LIST_PDF_FONT",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -134,6 +220,28 @@ STATIC_ROOT = BASE_DIR / "static"
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+INGREDIENT_DATA_FILES = [
+    BASE_DIR / "data" / "ingredients.csv",
+    BASE_DIR / "data" / "ingredients.json",
+]
+
+# Уменьшенные варианты изображений: имя -> наибольшая сторона в пикселях
+IMAGE_VARIANTS = {
+    "thumbnail": 160,
+    "card": 480,
+    "full": 1600,
+}
+IMAGE_MAX_PIXELS = 50_000_000
+MAX_IMAGE_UPLOAD_SIZE = int(
+    os.getenv("MAX_IMAGE_UPLOAD_SIZE", str(10 * 1024 * 1024))
+)
+# Файлы из multipart/form-data API пишутся на диск, а не в память
+# воркера (api.utils.LimitedMultiPartParser); тело JSON должно вмещать
+# изображение в base64
+DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_IMAGE_UPLOAD_SIZE * 4 // 3 + 1024 * 1024
+IMAGE_PROCESSING_WORKERS = int(os.getenv("IMAGE_PROCESSING_WORKERS", "2"))
+IMAGE_PROCESSING_SYNC = os.getenv("IMAGE_PROCESSING_SYNC", "False") == "True"
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
@@ -143,19 +251,68 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = "users.User"
 
 PAGE_SIZE = 6
+MAX_PAGE_SIZE = 100
 RECIPES_LIMIT = 3
+MAX_BULK_RECIPES = 100
+FEED_FANOUT_LIMIT = int(os.getenv("FEED_FANOUT_LIMIT", "1000"))
+FEED_BACKFILL_SIZE = 100
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# Каталог для метрик нескольких воркеров gunicorn, очищается при старте
+METRICS_MULTIPROCESS_DIR = os.getenv("METRICS_MULTIPROCESS_DIR")
+METRICS_FLUSH_INTERVAL = 5
+METRICS_LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+# Поиск N+1 и проверка query_budgets вьюсетов, по умолчанию в DEBUG
+QUERY_INSPECTION = os.getenv("QUERY_INSPECTION", str(DEBUG)) == "True"
+QUERY_BUDGET_RAISE = os.getenv("QUERY_BUDGET_RAISE", "False") == "True"
+NPLUSONE_THRESHOLD = 5
+
+SHORT_CODE_LENGTH = 6
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", "10000"))
+RECIPE_FRONTEND_URL = "/recipes/{id}"
+
+# Пользователи токенов: LRU процесса и общий кеш. Запись LRU живет
+# AUTH_TOKEN_EPOCH_CHECK_TTL секунд без сверки эпохи с общим кешем, это
+# предел задержки отзыва токена в других воркерах. Если алиас пуст или
+# кеш не общий (LocMemCache), работает только LRU
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv("AUTH_TOKEN_CACHE_SIZE", "10000"))
+AUTH_TOKEN_CACHE_TTL = int(os.getenv("AUTH_TOKEN_CACHE_TTL", "300"))
+AUTH_TOKEN_EPOCH_CHECK_TTL = int(
+    os.getenv("AUTH_TOKEN_EPOCH_CHECK_TTL", "5")
+)
+AUTH_TOKEN_CACHE_ALIAS = os.getenv("AUTH_TOKEN_CACHE_ALIAS", "default")
+
+# Избранное, список покупок и подписки пользователей в памяти процесса:
+# число пользователей и предел размера каждого набора. Версии наборов
+# хранятся в общем кеше, без него (LocMemCache) флаги проверяются в базе
+USER_RELATIONS_CACHE_ALIAS = os.getenv(
+    "USER_RELATIONS_CACHE_ALIAS", "default"
+)
+USER_RELATIONS_CACHE_SIZE = int(
+    os.getenv("USER_RELATIONS_CACHE_SIZE", "1000")
+)
+USER_RELATIONS_MAX_IDS = int(os.getenv("USER_RELATIONS_MAX_IDS", "2000"))
+USER_RELATIONS_TTL = 600
 
 REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.IsAuthenticatedOrReadOnly",
     ],
     "DEFAULT_AUTHENTICATION_CLASSES": [
-        "rest_framework.authentication.TokenAuthentication",
+        "api.authentication.CachedTokenAuthentication",
     ],
     "DEFAULT_FILTER_BACKENDS": [
         "django_filters.rest_framework.DjangoFilterBackend",
         "rest_framework.filters.SearchFilter",
     ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "api.utils.LimitedMultiPartParser",
+    ],
     "DEFAULT_PAGINATION_CLASS": "api.utils.CustomPagination",
     "PAGE_SIZE": PAGE_SIZE,
 }
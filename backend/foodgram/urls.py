@@ -13,6 +13,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from api.views import async_reads
+from api.views.recipes import short_link_redirect
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -22,6 +24,12 @@ from django.views.generic import TemplateView
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/", include("api.urls")),
+    path(
+        "s/<str:code>",
+        async_reads.short_link_redirect
+        if settings.ASYNC_READS else short_link_redirect,
+        name="short-link",
+    ),
     path(
         "api/docs/",
         TemplateView.as_view(
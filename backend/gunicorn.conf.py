@@ -0,0 +1,36 @@
+import multiprocessing
+import os
+
+bind = "0.0.0.0:8000"
+# Без общего кеша (CACHE_BACKEND) сброс кешей виден только одному
+# процессу, поэтому по умолчанию воркер один
+shared_cache = "locmem" not in os.getenv("CACHE_BACKEND", "locmem").lower()
+workers = int(
+    os.getenv(
+        "GUNICORN_WORKERS",
+        min(multiprocessing.cpu_count() * 2, 8) if shared_cache else 1,
+    )
+)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+if os.getenv("ASYNC_READS", "False") == "True":
+    # Горячие эндпоинты чтения обслуживаются асинхронно, остальные
+    # вьюхи — в потоках sync_to_async
+    wsgi_app = "foodgram.asgi:application"
+    worker_class = "uvicorn_worker.UvicornWorker"
+else:
+    # Потоки одного воркера делят пул соединений с базой (DB_POOL_SIZE),
+    # поэтому DB_POOL_SIZE не стоит делать больше GUNICORN_THREADS
+    wsgi_app = "foodgram.wsgi:application"
+    worker_class = "gthread"
+    threads = int(os.getenv("GUNICORN_THREADS", "4"))
+
+
+def child_exit(server, worker):
+    # Мастер не загружает Django: нужны только настройки и api.metrics
+    if not os.getenv("METRICS_MULTIPROCESS_DIR"):
+        return
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "foodgram.settings")
+    from api.metrics import metrics
+
+    metrics.process_exited(worker.pid)
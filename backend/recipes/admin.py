@@ -1,7 +1,36 @@
+from collections import defaultdict
+
 from django.contrib import admin
+from django.db import transaction
 
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart)
+                     ShoppingCart, ShoppingCartTotal)
+
+
+def change_recipe_totals(recipe_id, amounts, sign):
+    """
+    Меняет итоги всех пользователей, у которых рецепт в списке покупок,
+    amounts — словарь {id ингредиента: количество}
+    """
+    ShoppingCartTotal.objects.apply_amounts(
+        amounts,
+        ShoppingCart.objects.filter(recipe_id=recipe_id)
+        .values_list("user_id", flat=True),
+        sign,
+    )
+
+
+class ReadOnlyAdminMixin:
+    """Только просмотр: итоги считаются по спискам покупок"""
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(Recipe)
@@ -9,6 +38,9 @@ class RecipeAdmin(admin.ModelAdmin):
     list_display = ("id", "name", "author")
     list_filter = ("author", "name")
     search_fields = ("name", "author__username")
+    readonly_fields = (
+        "short_code", "favorites_count", "shopping_cart_count"
+    )
 
 
 @admin.register(Ingredient)
@@ -20,9 +52,39 @@ class IngredientAdmin(admin.ModelAdmin):
 
 @admin.register(IngredientInRecipe)
 class IngredientInRecipeAdmin(admin.ModelAdmin):
+    """Правки ингредиентов сразу переносятся в итоги списков покупок"""
+
     list_display = ("id", "recipe", "ingredient", "amount")
     list_filter = ("recipe", "ingredient")
 
+    @staticmethod
+    def _change_totals(row, sign):
+        change_recipe_totals(
+            row.recipe_id, {row.ingredient_id: row.amount}, sign
+        )
+
+    def save_model(self, request, obj, form, change):
+        if change and not form.has_changed():
+            return super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            if change:
+                self._change_totals(
+                    IngredientInRecipe.objects.get(pk=obj.pk), -1
+                )
+            super().save_model(request, obj, form, change)
+            self._change_totals(obj, 1)
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            self._change_totals(obj, -1)
+            super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            for row in queryset:
+                self._change_totals(row, -1)
+            super().delete_queryset(request, queryset)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -33,6 +95,46 @@ class FavoriteAdmin(admin.ModelAdmin):
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
+    """Правки списков покупок сразу переносятся в итоги"""
+
     list_display = ("id", "user", "recipe")
     list_filter = ("user", "recipe")
     search_fields = ("user__username", "recipe__name")
+
+    def save_model(self, request, obj, form, change):
+        if change and not form.has_changed():
+            return super().save_model(request, obj, form, change)
+        with transaction.atomic():
+            if change:
+                old = ShoppingCart.objects.get(pk=obj.pk)
+                ShoppingCartTotal.objects.remove_recipe(
+                    old.recipe_id, [old.user_id]
+                )
+            super().save_model(request, obj, form, change)
+            ShoppingCartTotal.objects.add_recipe(obj.recipe_id, [obj.user_id])
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            ShoppingCartTotal.objects.remove_recipe(
+                obj.recipe_id, [obj.user_id]
+            )
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            carts = defaultdict(list)
+            for user_id, recipe_id in queryset.values_list(
+                "user_id", "recipe_id"
+            ):
+                carts[user_id].append(recipe_id)
+            super().delete_queryset(request, queryset)
+            for user_id, recipe_ids in carts.items():
+                ShoppingCartTotal.objects.remove_recipes(
+                    recipe_ids, [user_id]
+                )
+
+
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(ReadOnlyAdminMixin, admin.ModelAdmin):
+    list_display = ("id", "user", "ingredient", "amount")
+    search_fields = ("user__username", "ingredient__name")
@@ -0,0 +1,131 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix="image-variants",
+        )
+    return _executor
+
+
+def variants_outdated(instance, image_field, variants_field):
+    """Варианты построены не для текущего файла изображения"""
+    image = getattr(instance, image_field)
+    variants = getattr(instance, variants_field) or {}
+    return (image.name or None) != variants.get("source")
+
+
+def schedule_variants(instance, image_field, variants_field):
+    """
+    Ставит в очередь построение вариантов изображения после коммита,
+    если исходный файл изменился
+    """
+    if not variants_outdated(instance, image_field, variants_field):
+        return
+    args = (type(instance), instance.pk, image_field, variants_field)
+    if settings.IMAGE_PROCESSING_SYNC:
+        transaction.on_commit(lambda: _build_safely(*args))
+    else:
+        transaction.on_commit(
+            lambda: _get_executor().submit(_run_in_thread, *args)
+        )
+
+
+def _build_safely(*args):
+    try:
+        build_variants(*args)
+    except Exception:
+        logger.exception("Не удалось обработать изображение %s", args)
+
+
+def _run_in_thread(*args):
+    try:
+        _build_safely(*args)
+    finally:
+        # Соединения потока пула не закрывает ни один запрос, а с
+        # CONN_MAX_AGE close_old_connections() оставил бы их открытыми
+        connections.close_all()
+
+
+def build_variants(model, pk, image_field, variants_field):
+    """
+    Строит уменьшенные варианты без метаданных и сохраняет их карту
+    в variants_field. Варианты, не успевшие построиться, клиенты
+    получают как ссылку на оригинал
+    """
+    instance = model.objects.filter(pk=pk).first()
+    if instance is None:
+        return
+    if not variants_outdated(instance, image_field, variants_field):
+        return
+    image = getattr(instance, image_field)
+    old_variants = getattr(instance, variants_field) or {}
+
+    variants = {"source": image.name or None}
+    if image:
+        with image.open("rb") as file:
+            source = Image.open(file)
+            if source.width * source.height > settings.IMAGE_MAX_PIXELS:
+                raise ValueError(f"Слишком большое изображение: {image.name}")
+            source = _flatten(ImageOps.exif_transpose(source))
+        stem = os.path.splitext(os.path.basename(image.name))[0]
+        directory = os.path.join(os.path.dirname(image.name), "variants")
+        for name, size in settings.IMAGE_VARIANTS.items():
+            resized = source.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            variants[name] = {}
+            for extension, (image_format, options) in VARIANT_FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, image_format, **options)
+                variants[name][extension] = image.storage.save(
+                    os.path.join(directory, f"{stem}_{name}.{extension}"),
+                    ContentFile(buffer.getvalue()),
+                )
+
+    current = model.objects.filter(pk=pk).values_list(
+        image_field, flat=True
+    ).first()
+    if (current or None) != variants["source"]:
+        delete_variants(image.storage, variants)
+        return
+    setattr(instance, variants_field, variants)
+    instance.save(update_fields=[variants_field])
+    delete_variants(image.storage, old_variants)
+
+
+def delete_variants(storage, variants):
+    for name, files in variants.items():
+        if name == "source":
+            continue
+        for path in files.values():
+            storage.delete(path)
+
+
+def _flatten(image):
+    """Приводит изображение к RGB, подкладывая белый фон под прозрачность"""
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
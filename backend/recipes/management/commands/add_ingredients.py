@@ -1,40 +1,120 @@
 import csv
+import io
+import json
 import os
+from itertools import islice
 
+from api.ingredient_index import bump_catalog_version
+from django.conf import settings
 from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.db import connection, transaction
+from recipes.models import (INGREDIENTS_CHECKSUM_KEY, DataChecksum,
+                            Ingredient)
 
 
 class Command(BaseCommand):
+    help = (
+        "Загружает ингредиенты из CSV и JSON. Повторный запуск с теми же "
+        "файлами ничего не делает"
+    )
 
-    def handle(self, *args, **options):
-        file_path = os.path.join(
-            os.path.dirname(
-                os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
-            ),
-            "data",
-            "ingredients.csv",
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "paths",
+            nargs="*",
+            default=list(map(str, settings.INGREDIENT_DATA_FILES)),
+            help="Файлы .csv или .json с ингредиентами",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько ингредиентов вставлять одним запросом",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Загрузить файлы, даже если они не изменились",
         )
 
-        if not os.path.exists(file_path):
-            self.stdout.write(self.style.ERROR(f"Файл {file_path} не найден!"))
+    def handle(self, *args, **options):
+        paths = [path for path in options["paths"] if os.path.exists(path)]
+        for path in set(options["paths"]) - set(paths):
+            self.stdout.write(self.style.ERROR(f"Файл {path} не найден!"))
+        if not paths:
             return
 
-        count = 0
+        checksum = DataChecksum.of_files(paths)
+        if not options["force"] and DataChecksum.matches(
+            INGREDIENTS_CHECKSUM_KEY, checksum
+        ):
+            self.stdout.write("Ингредиенты не изменились, пропускаю")
+            return
 
-        try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                csv_reader = csv.reader(file)
+        rows = {}
+        for path in paths:
+            rows.update(dict.fromkeys(self.read(path)))
 
-                for row in csv_reader:
-                    Ingredient.objects.get_or_create(
-                        name=row[0], measurement_unit=row[1]
-                    )
-                    count += 1
+        before = Ingredient.objects.count()
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                self.copy(rows)
+            else:
+                self.insert(rows, options["batch_size"])
+            DataChecksum.store(INGREDIENTS_CHECKSUM_KEY, checksum)
+        created = Ingredient.objects.count() - before
 
-            self.stdout.write(
-                self.style.SUCCESS(f"Успешно загружено {count} ингредиентов!")
-            )
+        if created:
+            bump_catalog_version()
+        self.stdout.write(self.style.SUCCESS(
+            f"Прочитано {len(rows)} ингредиентов, добавлено {created}"
+        ))
 
-        except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Произошла ошибка: {str(e)}"))
+    @staticmethod
+    def read(path):
+        """Пары (название, единица измерения) из файла"""
+        with open(path, encoding="utf-8-sig") as file:
+            if path.endswith(".json"):
+                items = (
+                    (item["name"], item["measurement_unit"])
+                    for item in json.load(file)
+                )
+            else:
+                items = (row[:2] for row in csv.reader(file) if row)
+            for name, measurement_unit in items:
+                yield name.strip(), measurement_unit.strip()
+
+    @staticmethod
+    def insert(rows, batch_size):
+        ingredients = (
+            Ingredient(name=name, measurement_unit=measurement_unit)
+            for name, measurement_unit in rows
+        )
+        while batch := list(islice(ingredients, batch_size)):
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+
+    @staticmethod
+    def copy(rows):
+        """
+        Загружает строки через COPY во временную таблицу и переносит
+        новые одним INSERT ... ON CONFLICT DO NOTHING
+        """
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE ingredient_staging "
+                "(name varchar(200), measurement_unit varchar(200)) "
+                "ON COMMIT DROP"
+            )
+            cursor.cursor.copy_expert(
+                "COPY ingredient_staging FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+            cursor.execute(
+                f"INSERT INTO {table} (name, measurement_unit) "
+                "SELECT name, measurement_unit FROM ingredient_staging "
+                "ON CONFLICT (name, measurement_unit) DO NOTHING"
+            )
@@ -0,0 +1,87 @@
+import gzip
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.core.serializers.json import DjangoJSONEncoder
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает рецепты с ингредиентами и ссылками на изображения "
+        "в NDJSON: одна строка — один рецепт"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            help="Файл для выгрузки (.ndjson или .ndjson.gz), - для stdout",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько рецептов читать из базы за раз",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if path == "-":
+            count = self.export(sys.stdout, options["batch_size"])
+            log = self.stderr
+        else:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "wt", encoding="utf-8") as file:
+                count = self.export(file, options["batch_size"])
+            log = self.stdout
+        log.write(self.style.SUCCESS(f"Выгружено рецептов: {count}"))
+
+    def export(self, file, batch_size):
+        count = 0
+        for batch in self.batches(batch_size):
+            file.writelines(
+                json.dumps(
+                    self.to_dict(recipe),
+                    ensure_ascii=False,
+                    cls=DjangoJSONEncoder,
+                ) + "\n"
+                for recipe in batch
+            )
+            count += len(batch)
+        return count
+
+    @staticmethod
+    def batches(batch_size):
+        last_pk = 0
+        while True:
+            batch = list(
+                Recipe.objects.with_details()
+                .filter(pk__gt=last_pk)
+                .order_by("pk")[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1].pk
+
+    @staticmethod
+    def to_dict(recipe):
+        return {
+            "author": recipe.author.email,
+            "name": recipe.name,
+            "text": recipe.text,
+            "cooking_time": recipe.cooking_time,
+            "pub_date": recipe.pub_date,
+            "image": recipe.image.name,
+            "image_variants": recipe.image_variants,
+            "short_code": recipe.short_code,
+            "ingredients": [
+                {
+                    "name": item.ingredient.name,
+                    "measurement_unit": item.ingredient.measurement_unit,
+                    "amount": item.amount,
+                }
+                for item in recipe.ingredientinrecipe_set.all()
+            ],
+        }
@@ -0,0 +1,169 @@
+import gzip
+import json
+import sys
+from itertools import islice
+
+from api.ingredient_index import bump_catalog_version
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+from recipes.models import (FeedEntry, Ingredient, IngredientInRecipe,
+                            Recipe, count_of, generate_short_code)
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        "Загружает рецепты из NDJSON, выгруженного export_recipes, "
+        "пачками в отдельных транзакциях"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path",
+            help="Файл выгрузки (.ndjson или .ndjson.gz), - для stdin",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько рецептов сохранять в одной транзакции",
+        )
+        parser.add_argument(
+            "--author",
+            help="Email автора для рецептов, чьих авторов нет в базе",
+        )
+
+    def handle(self, *args, **options):
+        self.authors = dict(User.objects.values_list("email", "id"))
+        self.default_author = None
+        if options["author"]:
+            self.default_author = self.authors.get(options["author"])
+            if self.default_author is None:
+                raise CommandError(
+                    f"Пользователь {options['author']} не найден"
+                )
+        self.ingredients = {
+            (name, measurement_unit): pk
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            )
+        }
+
+        path = options["path"]
+        if path == "-":
+            imported, author_ids = self.load(sys.stdin, options["batch_size"])
+        else:
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt", encoding="utf-8") as file:
+                imported, author_ids = self.load(file, options["batch_size"])
+
+        User.objects.filter(pk__in=author_ids).update(
+            recipes_count=count_of(Recipe, "author")
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Загружено рецептов: {imported}, пропущено: {self.skipped}"
+        ))
+
+    def load(self, file, batch_size):
+        self.skipped = 0
+        imported = 0
+        author_ids = set()
+        items = (json.loads(line) for line in file if line.strip())
+        while batch := list(islice(items, batch_size)):
+            with transaction.atomic():
+                recipes = self.import_batch(batch)
+            imported += len(recipes)
+            author_ids.update(recipe.author_id for recipe in recipes)
+            self.stdout.write(f"Загружено рецептов: {imported}")
+        return imported, author_ids
+
+    def import_batch(self, batch):
+        items = []
+        for item in batch:
+            author_id = self.authors.get(item["author"], self.default_author)
+            if author_id is None:
+                self.skipped += 1
+                continue
+            items.append((item, author_id))
+        self.add_missing_ingredients(item for item, _ in items)
+
+        codes = self.short_codes([item.get("short_code") for item, _ in items])
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author_id=author_id,
+                name=item["name"],
+                text=item["text"],
+                cooking_time=item["cooking_time"],
+                image=item["image"],
+                image_variants=item.get("image_variants") or {},
+                short_code=code,
+            )
+            for (item, author_id), code in zip(items, codes)
+        )
+        # auto_now_add перезаписывает дату при вставке
+        for recipe, (item, _) in zip(recipes, items):
+            if item.get("pub_date"):
+                recipe.pub_date = parse_datetime(item["pub_date"])
+        Recipe.objects.bulk_update(recipes, ["pub_date"])
+
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(
+                recipe_id=recipe.pk,
+                ingredient_id=self.ingredients[
+                    (ingredient["name"], ingredient["measurement_unit"])
+                ],
+                amount=ingredient["amount"],
+            )
+            for recipe, (item, _) in zip(recipes, items)
+            for ingredient in item["ingredients"]
+        )
+        FeedEntry.objects.fan_out_many(recipes)
+        return recipes
+
+    def add_missing_ingredients(self, items):
+        missing = {
+            (ingredient["name"], ingredient["measurement_unit"])
+            for item in items
+            for ingredient in item["ingredients"]
+        } - self.ingredients.keys()
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            (
+                Ingredient(name=name, measurement_unit=measurement_unit)
+                for name, measurement_unit in missing
+            ),
+            ignore_conflicts=True,
+        )
+        transaction.on_commit(bump_catalog_version)
+        for ingredient in Ingredient.objects.filter(
+            name__in={name for name, _ in missing}
+        ):
+            self.ingredients[
+                (ingredient.name, ingredient.measurement_unit)
+            ] = ingredient.pk
+
+    @staticmethod
+    def short_codes(codes):
+        """
+        Сохраняет коды из выгрузки, если они свободны, остальным
+        рецептам выдает новые
+        """
+        codes = [code or generate_short_code() for code in codes]
+        while True:
+            taken = set(
+                Recipe.objects.filter(short_code__in=codes)
+                .values_list("short_code", flat=True)
+            )
+            seen = set()
+            clashed = False
+            for index, code in enumerate(codes):
+                if code in taken or code in seen:
+                    codes[index] = code = generate_short_code()
+                    clashed = True
+                seen.add(code)
+            if not clashed:
+                return codes
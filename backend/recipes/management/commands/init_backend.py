@@ -0,0 +1,115 @@
+import hashlib
+import os
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles.finders import get_finders
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+from recipes.models import INGREDIENTS_CHECKSUM_KEY, DataChecksum
+from users.management.commands.create_super_user import SUPERUSER_USERNAME
+
+STATIC_FINGERPRINT = ".static-fingerprint"
+STATIC_IGNORE_PATTERNS = ["CVS", ".*", "*~"]
+
+
+class Command(BaseCommand):
+    help = (
+        "Готовит бэкенд к запуску в одном процессе: выполняет только те "
+        "шаги, входные данные которых изменились"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Выполнить все шаги без сверки отпечатков",
+        )
+
+    def handle(self, *args, **options):
+        self.force = options["force"]
+        steps = (
+            ("migrate", self.migrate),
+            ("add_ingredients", self.add_ingredients),
+            ("create_super_user", self.create_super_user),
+            ("collectstatic", self.collectstatic),
+            ("rebuild_image_variants", self.rebuild_image_variants),
+        )
+        started = time.perf_counter()
+        for name, step in steps:
+            step_started = time.perf_counter()
+            ran = step()
+            self.stdout.write(
+                f"{name}: {'выполнено' if ran else 'пропущено'} за "
+                f"{time.perf_counter() - step_started:.2f} с"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Инициализация заняла {time.perf_counter() - started:.2f} с"
+        ))
+
+    def migrate(self):
+        executor = MigrationExecutor(connections[DEFAULT_DB_ALIAS])
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if not plan and not self.force:
+            return False
+        call_command("migrate", interactive=False, stdout=self.stdout)
+        return True
+
+    def add_ingredients(self):
+        paths = [
+            path for path in settings.INGREDIENT_DATA_FILES
+            if os.path.exists(path)
+        ]
+        if not self.force and DataChecksum.matches(
+            INGREDIENTS_CHECKSUM_KEY, DataChecksum.of_files(paths)
+        ):
+            return False
+        call_command("add_ingredients", "--force", stdout=self.stdout)
+        return True
+
+    def create_super_user(self):
+        if not self.force and get_user_model().objects.filter(
+            username=SUPERUSER_USERNAME, is_superuser=True
+        ).exists():
+            return False
+        call_command("create_super_user")
+        return True
+
+    def collectstatic(self):
+        """
+        Отпечаток исходной статики хранится рядом с собранной, чтобы
+        пустой том со статикой всегда собирался заново
+        """
+        fingerprint = self.static_fingerprint()
+        marker = os.path.join(settings.STATIC_ROOT, STATIC_FINGERPRINT)
+        if not self.force and os.path.exists(marker):
+            with open(marker) as file:
+                if file.read() == fingerprint:
+                    return False
+        call_command("collectstatic", interactive=False, verbosity=0)
+        with open(marker, "w") as file:
+            file.write(fingerprint)
+        return True
+
+    def rebuild_image_variants(self):
+        """Задания прошлого запуска, не успевшие выполниться"""
+        call_command("rebuild_image_variants", stdout=self.stdout)
+        return True
+
+    @staticmethod
+    def static_fingerprint():
+        files = sorted(
+            (path, storage.path(path))
+            for finder in get_finders()
+            for path, storage in finder.list(STATIC_IGNORE_PATTERNS)
+        )
+        digest = hashlib.sha256()
+        for path, full_path in files:
+            stat = os.stat(full_path)
+            digest.update(
+                f"{path}:{stat.st_size}:{stat.st_mtime_ns}\n".encode()
+            )
+        return digest.hexdigest()
@@ -0,0 +1,50 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from recipes.images import build_variants, variants_outdated
+from recipes.models import Recipe
+
+User = get_user_model()
+
+# Модели с изображениями: (модель, поле изображения, поле вариантов)
+IMAGE_FIELDS = (
+    (Recipe, "image", "image_variants"),
+    (User, "avatar", "avatar_variants"),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Достраивает варианты изображений, задания на которые потерялись "
+        "(например, при перезапуске воркера)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только сообщить об устаревших вариантах, ничего не меняя",
+        )
+
+    def handle(self, *args, **options):
+        for model, image_field, variants_field in IMAGE_FIELDS:
+            outdated = [
+                instance.pk for instance in model.objects.only(
+                    "pk", image_field, variants_field
+                ).order_by("pk").iterator()
+                if variants_outdated(instance, image_field, variants_field)
+            ]
+            name = model._meta.verbose_name_plural
+            if options["verify"]:
+                self.stdout.write(f"{name}: устарели варианты {len(outdated)}")
+                continue
+            failed = 0
+            for pk in outdated:
+                try:
+                    build_variants(model, pk, image_field, variants_field)
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"{name} {pk}: {error}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{name}: перестроено {len(outdated) - failed}, "
+                f"с ошибками {failed}"
+            ))
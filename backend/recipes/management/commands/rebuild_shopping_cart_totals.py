@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import ShoppingCartTotal
+
+
+class Command(BaseCommand):
+    help = "Проверяет и пересобирает итоги списков покупок"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только сообщить о расхождениях, ничего не меняя",
+        )
+        parser.add_argument(
+            "--user",
+            type=int,
+            action="append",
+            dest="user_ids",
+            help="id пользователя (можно указать несколько раз)",
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options["user_ids"]
+        expected = ShoppingCartTotal.objects.calculate(user_ids)
+        stored = ShoppingCartTotal.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount in stored.values_list(
+                "user_id", "ingredient_id", "amount"
+            )
+        }
+        drift = {
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        }
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("Расхождений нет"))
+            return
+
+        for user_id, ingredient_id in sorted(drift):
+            self.stdout.write(
+                f"Пользователь {user_id}, ингредиент {ingredient_id}: "
+                f"хранится {stored.get((user_id, ingredient_id), 0)}, "
+                f"должно быть {expected.get((user_id, ingredient_id), 0)}"
+            )
+        if options["verify"]:
+            self.stdout.write(
+                self.style.ERROR(f"Найдено расхождений: {len(drift)}")
+            )
+            return
+
+        with transaction.atomic():
+            ShoppingCartTotal.objects.rebuild(
+                user_ids or sorted({user_id for user_id, _ in drift})
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f"Исправлено расхождений: {len(drift)}")
+        )
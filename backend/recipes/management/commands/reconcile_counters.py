@@ -0,0 +1,52 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe, count_of
+from users.models import Subscription
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает денормализованные счетчики пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Сколько записей пересчитывать в одной транзакции",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        self.reconcile(User, batch_size, lambda users: users.update(
+            recipes_count=count_of(Recipe, "author"),
+            followers_count=count_of(Subscription, "author"),
+        ))
+        self.reconcile(
+            Recipe, batch_size, lambda recipes: recipes.refresh_counters()
+        )
+
+    def reconcile(self, model, batch_size, refresh):
+        changed = 0
+        for batch in self.batches(model, batch_size):
+            with transaction.atomic():
+                changed += refresh(model.objects.filter(pk__in=batch))
+        self.stdout.write(self.style.SUCCESS(
+            f"{model._meta.verbose_name_plural}: пересчитано {changed}"
+        ))
+
+    @staticmethod
+    def batches(model, batch_size):
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:batch_size]
+            )
+            if not batch:
+                return
+            yield batch
+            last_pk = batch[-1]
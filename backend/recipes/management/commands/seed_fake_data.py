@@ -0,0 +1,222 @@
+import io
+import random
+from datetime import timedelta
+from itertools import accumulate, islice
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from PIL import Image
+from recipes.models import (Favorite, FeedEntry, Ingredient,
+                            IngredientInRecipe, Recipe, ShoppingCart,
+                            ShoppingCartTotal, count_of)
+from users.models import Subscription
+
+User = get_user_model()
+
+FAKE_DOMAIN = "fake.foodgram.local"
+FAKE_PASSWORD = "fake-password"
+WORDS = (
+    "суп", "салат", "пирог", "паста", "рагу", "запеканка", "каша",
+    "омлет", "плов", "борщ", "оладьи", "соус", "десерт", "жаркое",
+    "домашний", "быстрый", "летний", "острый", "сливочный", "овощной",
+    "бабушкин", "пряный", "легкий", "праздничный", "сырный", "грибной",
+)
+
+
+def zipf_weights(count, exponent=1.1):
+    """Накопленные веса распределения Ципфа: первые элементы популярнее"""
+    return list(accumulate(
+        1 / rank ** exponent for rank in range(1, count + 1)
+    ))
+
+
+class Command(BaseCommand):
+    help = (
+        "Детерминированно генерирует пользователей, рецепты, избранное, "
+        "списки покупок и подписки с перекосом популярности"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--recipes", type=int, default=10000)
+        parser.add_argument(
+            "--favorites",
+            type=int,
+            default=20,
+            help="Среднее число избранных рецептов на пользователя",
+        )
+        parser.add_argument(
+            "--cart",
+            type=int,
+            default=5,
+            help="Среднее число рецептов в списке покупок пользователя",
+        )
+        parser.add_argument(
+            "--subscriptions",
+            type=int,
+            default=10,
+            help="Среднее число подписок пользователя",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--clear",
+            action="store_true",
+            help="Удалить ранее сгенерированные данные перед генерацией",
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        fake_users = User.objects.filter(email__endswith=f"@{FAKE_DOMAIN}")
+        if options["clear"]:
+            fake_users.delete()
+        elif fake_users.exists():
+            raise CommandError(
+                "Сгенерированные данные уже есть, используйте --clear"
+            )
+        ingredient_ids = list(
+            Ingredient.objects.order_by("pk").values_list("pk", flat=True)
+        )
+        if not ingredient_ids:
+            raise CommandError(
+                "Сначала загрузите ингредиенты: add_ingredients"
+            )
+
+        with transaction.atomic():
+            user_ids = self.create_users(options["users"])
+            self.create_subscriptions(user_ids, options["subscriptions"])
+            recipe_ids = self.create_recipes(
+                user_ids, ingredient_ids, options["recipes"]
+            )
+            self.create_relations(
+                Favorite, user_ids, recipe_ids, options["favorites"]
+            )
+            self.create_relations(
+                ShoppingCart, user_ids, recipe_ids, options["cart"]
+            )
+            User.objects.filter(pk__in=user_ids).update(
+                recipes_count=count_of(Recipe, "author")
+            )
+            Recipe.objects.filter(pk__in=recipe_ids).refresh_counters()
+            ShoppingCartTotal.objects.rebuild(user_ids)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано пользователей: {len(user_ids)}, "
+            f"рецептов: {len(recipe_ids)}. Пароль: {FAKE_PASSWORD}"
+        ))
+
+    def batches(self, objects):
+        objects = iter(objects)
+        while batch := list(islice(objects, self.batch_size)):
+            yield batch
+
+    def create_users(self, count):
+        password = make_password(FAKE_PASSWORD)
+        users = User.objects.bulk_create(
+            (
+                User(
+                    username=f"fake_{index}",
+                    email=f"user{index}@{FAKE_DOMAIN}",
+                    first_name=f"Имя{index}",
+                    last_name=f"Фамилия{index}",
+                    password=password,
+                )
+                for index in range(count)
+            ),
+            batch_size=self.batch_size,
+        )
+        return [user.pk for user in users]
+
+    def sample(self, population, cum_weights, mean, exclude=None):
+        """Неповторяющаяся выборка со средним размером mean"""
+        size = min(int(self.rng.expovariate(1 / mean)), len(population) - 1)
+        picked = set(self.rng.choices(
+            population, cum_weights=cum_weights, k=size
+        ))
+        picked.discard(exclude)
+        return sorted(picked)
+
+    def create_subscriptions(self, user_ids, mean):
+        weights = zipf_weights(len(user_ids))
+        Subscription.objects.bulk_create(
+            (
+                Subscription(user_id=user_id, author_id=author_id)
+                for user_id in user_ids
+                for author_id in self.sample(
+                    user_ids, weights, mean, exclude=user_id
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        # Нужен до раздачи рецептов в ленты
+        User.objects.filter(pk__in=user_ids).update(
+            followers_count=count_of(Subscription, "author")
+        )
+
+    def create_recipes(self, user_ids, ingredient_ids, count):
+        image = self.save_image()
+        author_weights = zipf_weights(len(user_ids))
+        now = timezone.now()
+        recipe_ids = []
+        for numbers in self.batches(range(count)):
+            rows = []
+            for number in numbers:
+                name = " ".join(self.rng.sample(WORDS, 3)).capitalize()
+                rows.append((
+                    Recipe(
+                        author_id=self.rng.choices(
+                            user_ids, cum_weights=author_weights
+                        )[0],
+                        name=f"{name} №{number}",
+                        text=" ".join(self.rng.choices(WORDS, k=40)),
+                        cooking_time=self.rng.randint(5, 180),
+                        image=image,
+                    ),
+                    now - timedelta(minutes=self.rng.randint(0, 525_600)),
+                    self.rng.sample(
+                        ingredient_ids,
+                        min(self.rng.randint(3, 12), len(ingredient_ids)),
+                    ),
+                ))
+            recipes = Recipe.objects.bulk_create(
+                recipe for recipe, _, _ in rows
+            )
+            for recipe, pub_date, _ in rows:
+                recipe.pub_date = pub_date
+            Recipe.objects.bulk_update(recipes, ["pub_date"])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe_id=recipe.pk,
+                    ingredient_id=ingredient_id,
+                    amount=self.rng.randint(1, 500),
+                )
+                for recipe, _, ingredients in rows
+                for ingredient_id in ingredients
+            )
+            FeedEntry.objects.fan_out_many(recipes)
+            recipe_ids.extend(recipe.pk for recipe in recipes)
+        return recipe_ids
+
+    def create_relations(self, model, user_ids, recipe_ids, mean):
+        # Популярность рецептов не зависит от порядка их создания
+        popular = self.rng.sample(recipe_ids, len(recipe_ids))
+        weights = zipf_weights(len(popular))
+        for users in self.batches(user_ids):
+            model.objects.bulk_create(
+                model(user_id=user_id, recipe_id=recipe_id)
+                for user_id in users
+                for recipe_id in self.sample(popular, weights, mean)
+            )
+
+    def save_image(self):
+        buffer = io.BytesIO()
+        Image.new("RGB", (640, 480), (200, 120, 60)).save(buffer, "JPEG")
+        return default_storage.save(
+            "recipes/fake.jpg", ContentFile(buffer.getvalue())
+        )
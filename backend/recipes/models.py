@@ -1,10 +1,62 @@
+import hashlib
+import os
+import re
+import secrets
+import string
+
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import (Case, Count, Exists, F, IntegerField,
+                              OuterRef, Prefetch, Subquery, Sum, Value, When)
+from django.db.models.functions import Coalesce
+from users.models import ManagedFieldsMixin, Subscription
 
 User = get_user_model()
 
+SHORT_CODE_ALPHABET = string.digits + string.ascii_letters
+SHORT_CODE_PATTERN = re.compile(r"[0-9A-Za-z]{1,16}")
+SHORT_CODE_ATTEMPTS = 5
+INGREDIENTS_CHECKSUM_KEY = "ingredients"
+
+
+def get_cart_version(user_id):
+    """Версия итогов списка покупок пользователя"""
+    return User.objects.filter(pk=user_id).values_list(
+        "shopping_cart_version", flat=True
+    ).first()
+
+
+def count_of(model, field):
+    """Подзапрос с числом строк model, ссылающихся на внешнюю запись"""
+    counts = (
+        model.objects.filter(**{field: OuterRef("pk")})
+        .order_by()
+        .values(field)
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def generate_short_code():
+    """Случайный код короткой ссылки в base62"""
+    return "".join(
+        secrets.choice(SHORT_CODE_ALPHABET)
+        for _ in range(settings.SHORT_CODE_LENGTH)
+    )
+
+
+def bump_cart_versions(user_ids):
+    """
+    Меняет версии списков покупок в той же транзакции, что и итоги:
+    версия из базы одинакова во всех процессах
+    """
+    User.objects.filter(pk__in=list(user_ids)).update(
+        shopping_cart_version=F("shopping_cart_version") + 1
+    )
+
 
 class Ingredient(models.Model):
     name = models.CharField("Название", max_length=200)
@@ -14,12 +66,67 @@ class Ingredient(models.Model):
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
         ordering = ["name"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["name", "measurement_unit"], name="unique_ingredient"
+            )
+        ]
 
     def __str__(self):
         return f"{self.name}, {self.measurement_unit}"
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """
+        Аннотирует рецепты флагами текущего пользователя: в избранном,
+        в списке покупок, подписан ли он на автора
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+                author_is_subscribed=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef("pk"))
+            ),
+            author_is_subscribed=Exists(
+                Subscription.objects.filter(
+                    user=user, author=OuterRef("author")
+                )
+            ),
+        )
+
+    def refresh_counters(self):
+        """Пересчитывает счетчики избранного и списков покупок"""
+        return self.update(
+            favorites_count=count_of(Favorite, "recipe"),
+            shopping_cart_count=count_of(ShoppingCart, "recipe"),
+        )
+
+    def bump_fragment_versions(self):
+        """Делает устаревшими закешированные представления рецептов"""
+        return self.update(fragment_version=F("fragment_version") + 1)
+
+    def with_details(self):
+        """Подгружает автора и ингредиенты фиксированным числом запросов"""
+        return self.select_related("author").prefetch_related(
+            Prefetch(
+                "ingredientinrecipe_set",
+                queryset=IngredientInRecipe.objects.select_related(
+                    "ingredient"
+                ),
+            )
+        )
+
+
+class Recipe(ManagedFieldsMixin, models.Model):
     author = models.ForeignKey(
         User, on_delete=models.CASCADE,
         related_name="recipes",
@@ -27,6 +134,9 @@ class Recipe(models.Model):
     )
     name = models.CharField("Название", max_length=200)
     image = models.ImageField("Фото", upload_to="recipes/")
+    image_variants = models.JSONField(
+        "Варианты фото", default=dict, blank=True
+    )
     text = models.TextField("Описание")
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -47,14 +157,75 @@ class Recipe(models.Model):
         db_index=True
     )
 
+    short_code = models.CharField(
+        "Код короткой ссылки",
+        max_length=16,
+        unique=True,
+        null=True,
+        blank=True,
+        editable=False,
+    )
+
+    favorites_count = models.PositiveIntegerField(
+        "Добавлений в избранное", default=0
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        "Добавлений в список покупок", default=0
+    )
+    fragment_version = models.PositiveIntegerField(
+        "Версия кешированного представления", default=0, editable=False
+    )
+    fanned_out = models.BooleanField(
+        "Разослан в ленты подписчиков", default=False, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+    managed_fields = (
+        "favorites_count", "shopping_cart_count", "image_variants",
+        "fragment_version", "fanned_out",
+    )
+
     class Meta:
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
         ordering = ["-pub_date"]
+        indexes = [
+            models.Index(
+                fields=["-pub_date", "-id"], name="recipe_pub_date_id_idx"
+            ),
+            # Рецепты, которые подмешиваются в ленту при чтении
+            models.Index(
+                fields=["author", "-pub_date", "-id"],
+                condition=models.Q(fanned_out=False),
+                name="recipe_live_feed_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if self.short_code or (
+            update_fields is not None and "short_code" not in update_fields
+        ):
+            return super().save(*args, **kwargs)
+        for attempt in range(SHORT_CODE_ATTEMPTS):
+            self.short_code = generate_short_code()
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                self.short_code = None
+                if attempt == SHORT_CODE_ATTEMPTS - 1:
+                    raise
+
+    def ensure_short_code(self):
+        """Выдает код рецептам, созданным до появления коротких ссылок"""
+        if not self.short_code:
+            self.save(update_fields=["short_code"])
+        return self.short_code
+
 
 class IngredientInRecipe(models.Model):
     recipe = models.ForeignKey(
@@ -121,3 +292,300 @@ class ShoppingCart(RecipeUserBaseModel):
 
     def __str__(self):
         return f"{self.user.username} - {self.recipe.name}"
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+
+    def add_recipe(self, recipe_id, user_ids):
+        """Прибавляет ингредиенты рецепта к итогам пользователей"""
+        self.add_recipes([recipe_id], user_ids)
+
+    def remove_recipe(self, recipe_id, user_ids):
+        """Вычитает ингредиенты рецепта из итогов пользователей"""
+        self.remove_recipes([recipe_id], user_ids)
+
+    def add_recipes(self, recipe_ids, user_ids):
+        """Прибавляет ингредиенты рецептов к итогам пользователей"""
+        self.apply_amounts(self._recipe_amounts(recipe_ids), user_ids, 1)
+
+    def remove_recipes(self, recipe_ids, user_ids):
+        """Вычитает ингредиенты рецептов из итогов пользователей"""
+        self.apply_amounts(self._recipe_amounts(recipe_ids), user_ids, -1)
+
+    @staticmethod
+    def _recipe_amounts(recipe_ids):
+        if not recipe_ids:
+            return {}
+        return dict(
+            IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .order_by()
+            .values("ingredient_id")
+            .annotate(total=Sum("amount"))
+            .values_list("ingredient_id", "total")
+        )
+
+    def apply_amounts(self, amounts, user_ids, sign):
+        """
+        Изменяет итоги одним UPDATE на каждую пачку пользователей,
+        amounts — словарь {id ингредиента: количество}
+        """
+        user_ids = list(user_ids)
+        if not amounts or not user_ids:
+            return
+        if sign > 0:
+            self.bulk_create(
+                (
+                    ShoppingCartTotal(
+                        user_id=user_id, ingredient_id=ingredient_id, amount=0
+                    )
+                    for user_id in user_ids
+                    for ingredient_id in amounts
+                ),
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        rows.update(
+            amount=F("amount") + Case(
+                *(
+                    When(ingredient_id=pk, then=Value(sign * amount))
+                    for pk, amount in amounts.items()
+                ),
+                default=Value(0),
+            )
+        )
+        if sign < 0:
+            rows.filter(amount__lte=0).delete()
+        bump_cart_versions(user_ids)
+
+    def calculate(self, user_ids=None):
+        """Итоги, посчитанные заново по спискам покупок"""
+        lookup = {"recipe__shoppingcarts__isnull": False}
+        if user_ids is not None:
+            lookup = {"recipe__shoppingcarts__user_id__in": user_ids}
+        rows = (
+            IngredientInRecipe.objects.filter(**lookup)
+            .values("recipe__shoppingcarts__user", "ingredient")
+            .annotate(total=Sum("amount"))
+            .order_by()
+        )
+        return {
+            (row["recipe__shoppingcarts__user"], row["ingredient"]):
+                row["total"]
+            for row in rows
+        }
+
+    def rebuild(self, user_ids=None):
+        """Пересобирает итоги пользователей (или всех) с нуля"""
+        totals = self.calculate(user_ids)
+        stale = self.all()
+        if user_ids is not None:
+            stale = stale.filter(user_id__in=user_ids)
+        else:
+            user_ids = set(
+                stale.values_list("user_id", flat=True).distinct()
+            ) | {user_id for user_id, _ in totals}
+        stale.delete()
+        self.bulk_create(
+            (
+                ShoppingCartTotal(
+                    user_id=user_id, ingredient_id=ingredient_id, amount=total
+                )
+                for (user_id, ingredient_id), total in totals.items()
+            ),
+            batch_size=1000,
+        )
+        bump_cart_versions(user_ids)
+        return len(totals)
+
+
+class ShoppingCartTotal(models.Model):
+    """Суммарное количество ингредиента в списке покупок пользователя"""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="shopping_cart_totals",
+        verbose_name="Пользователь",
+    )
+    ingredient = models.ForeignKey(
+        Ingredient, on_delete=models.CASCADE, verbose_name="Ингредиент"
+    )
+    amount = models.IntegerField("Количество")
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Итог списка покупок"
+        verbose_name_plural = "Итоги списков покупок"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "ingredient"],
+                name="unique_shopping_cart_total"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.ingredient}: {self.amount}"
+
+
+class FeedEntryQuerySet(models.QuerySet):
+
+    def fan_out(self, recipe):
+        """Добавляет рецепт в ленты всех подписчиков автора"""
+        followers = Subscription.objects.filter(
+            author_id=recipe.author_id
+        ).values_list("user_id", flat=True)
+        self.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe.pk,
+                    author_id=recipe.author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for user_id in followers.iterator()
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def fan_out_many(self, recipes):
+        """
+        Раздает пачку рецептов подписчикам их авторов, кроме авторов
+        с числом подписчиков больше FEED_FANOUT_LIMIT, и помечает
+        разосланные рецепты
+        """
+        by_author = {}
+        for recipe in recipes:
+            by_author.setdefault(recipe.author_id, []).append(recipe)
+        Recipe.objects.filter(
+            pk__in=[recipe.pk for recipe in recipes],
+            author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+        ).update(fanned_out=True)
+        followers = Subscription.objects.filter(
+            author_id__in=by_author,
+            author__followers_count__lte=settings.FEED_FANOUT_LIMIT,
+        ).values_list("author_id", "user_id")
+        self.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe.pk,
+                    author_id=author_id,
+                    pub_date=recipe.pub_date,
+                )
+                for author_id, user_id in followers.iterator()
+                for recipe in by_author[author_id]
+            ),
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+    def backfill(self, user_id, author_id):
+        """
+        Добавляет в ленту подписчика последние разосланные рецепты
+        автора, остальные подмешиваются при чтении
+        """
+        recipes = (
+            Recipe.objects.filter(author_id=author_id, fanned_out=True)
+            .order_by("-pub_date", "-id")
+            .values_list("id", "pub_date")[:settings.FEED_BACKFILL_SIZE]
+        )
+        self.bulk_create(
+            (
+                FeedEntry(
+                    user_id=user_id,
+                    recipe_id=recipe_id,
+                    author_id=author_id,
+                    pub_date=pub_date,
+                )
+                for recipe_id, pub_date in recipes
+            ),
+            ignore_conflicts=True,
+        )
+
+
+class FeedEntry(models.Model):
+    """
+    Запись ленты подписок: рецепт автора, на которого подписан
+    пользователь. Заполняется при публикации рецепта с пометкой
+    fanned_out
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Подписчик",
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name="feed_entries",
+        verbose_name="Рецепт",
+    )
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="+", verbose_name="Автор"
+    )
+    pub_date = models.DateTimeField("Дата публикации")
+
+    objects = FeedEntryQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = "Запись ленты"
+        verbose_name_plural = "Записи ленты"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "recipe"], name="unique_feed_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user", "-pub_date", "-recipe"],
+                name="feed_entry_timeline_idx",
+            ),
+            models.Index(
+                fields=["user", "author"], name="feed_entry_author_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user} - {self.recipe}"
+
+
+class DataChecksum(models.Model):
+    """
+    Контрольная сумма загруженных данных: позволяет пропускать
+    повторную загрузку, если исходные файлы не изменились
+    """
+
+    key = models.CharField("Ключ", max_length=100, unique=True)
+    checksum = models.CharField("Контрольная сумма", max_length=64)
+    updated_at = models.DateTimeField("Обновлено", auto_now=True)
+
+    class Meta:
+        verbose_name = "Контрольная сумма данных"
+        verbose_name_plural = "Контрольные суммы данных"
+
+    def __str__(self):
+        return self.key
+
+    @staticmethod
+    def of_files(paths):
+        """SHA-256 от имен и содержимого файлов"""
+        digest = hashlib.sha256()
+        for path in sorted(map(str, paths)):
+            digest.update(os.path.basename(path).encode())
+            with open(path, "rb") as file:
+                for chunk in iter(lambda: file.read(64 * 1024), b""):
+                    digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def matches(cls, key, checksum):
+        return cls.objects.filter(key=key, checksum=checksum).exists()
+
+    @classmethod
+    def store(cls, key, checksum):
+        cls.objects.update_or_create(key=key, defaults={"checksum": checksum})
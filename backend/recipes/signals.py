@@ -0,0 +1,131 @@
+import weakref
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Case, F, QuerySet, Value, When
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .images import delete_variants, schedule_variants
+from .models import (FeedEntry, Favorite, Recipe, ShoppingCart,
+                     ShoppingCartTotal)
+
+User = get_user_model()
+
+RECIPE_COUNTERS = {
+    Favorite: "favorites_count",
+    ShoppingCart: "shopping_cart_count",
+}
+
+# Число удаляемых строк по рецептам для каждого QuerySet.delete()
+BULK_DELETE_COUNTS = weakref.WeakKeyDictionary()
+
+
+def change_counter(queryset, field, delta):
+    """Атомарно меняет счетчик, не опуская его ниже нуля"""
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+def deleted_in_bulk(origin, model):
+    """Строки model удаляются через QuerySet.delete(), а не по одной"""
+    return isinstance(origin, QuerySet) and origin.model is model
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_from_cart_totals(sender, instance, **kwargs):
+    ShoppingCartTotal.objects.remove_recipe(
+        instance.pk,
+        ShoppingCart.objects.filter(recipe=instance)
+        .values_list("user_id", flat=True),
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), "recipes_count", 1
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    """
+    Раздает новый рецепт в ленты подписчиков. Рецепты авторов с числом
+    подписчиков больше FEED_FANOUT_LIMIT не раздаются, а подмешиваются
+    в ленту при чтении. Решение хранится в рецепте: оно не меняется,
+    когда число подписчиков автора потом переходит через порог
+    """
+    if not created:
+        return
+    followers_count = User.objects.filter(pk=instance.author_id).values_list(
+        "followers_count", flat=True
+    ).first()
+    if (followers_count or 0) > settings.FEED_FANOUT_LIMIT:
+        return
+    Recipe.objects.filter(pk=instance.pk).update(fanned_out=True)
+    instance.fanned_out = True
+    if followers_count:
+        transaction.on_commit(lambda: FeedEntry.objects.fan_out(instance))
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), "recipes_count", -1
+    )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            RECIPE_COUNTERS[sender], 1
+        )
+
+
+@receiver(pre_delete, sender=Favorite)
+@receiver(pre_delete, sender=ShoppingCart)
+def count_bulk_delete(sender, instance, origin=None, **kwargs):
+    if deleted_in_bulk(origin, sender):
+        counts = BULK_DELETE_COUNTS.setdefault(origin, {})
+        counts[instance.recipe_id] = counts.get(instance.recipe_id, 0) + 1
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, origin=None, **kwargs):
+    field = RECIPE_COUNTERS[sender]
+    if deleted_in_bulk(origin, sender):
+        # pre_delete уже пришли для всех строк: счетчики всех рецептов
+        # уменьшаются одним UPDATE на первой удаленной строке
+        counts = BULK_DELETE_COUNTS.pop(origin, None)
+        if counts:
+            Recipe.objects.filter(pk__in=counts).update(**{
+                field: Greatest(
+                    F(field) - Case(
+                        *(
+                            When(pk=recipe_id, then=Value(count))
+                            for recipe_id, count in counts.items()
+                        ),
+                        default=Value(0),
+                    ),
+                    0,
+                )
+            })
+        return
+    change_counter(Recipe.objects.filter(pk=instance.recipe_id), field, -1)
+
+
+@receiver(post_save, sender=Recipe)
+def build_recipe_image_variants(sender, instance, **kwargs):
+    schedule_variants(instance, "image", "image_variants")
+
+
+@receiver(post_delete, sender=Recipe)
+def delete_recipe_image_variants(sender, instance, **kwargs):
+    delete_variants(instance.image.storage, instance.image_variants or {})
@@ -1,14 +1,16 @@
 from django.contrib.auth import get_user_model
 from django.core.management.base import BaseCommand
 
+SUPERUSER_USERNAME = "admin"
+
 
 class Command(BaseCommand):
     def handle(self, *args, **options):
         User = get_user_model()
-        if User.objects.filter(username="admin").exists():
+        if User.objects.filter(username=SUPERUSER_USERNAME).exists():
             return
         User.objects.create_superuser(
-            username="admin",
+            username=SUPERUSER_USERNAME,
             email="admin@example.com",
             password="admin",
             first_name="Nikita",
@@ -2,7 +2,29 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 
 
-class User(AbstractUser):
+class ManagedFieldsMixin(models.Model):
+    """
+    Не перезаписывает при обычном save() поля, которые обновляются
+    отдельно: счетчики (атомарные UPDATE с F()) и варианты изображений
+    """
+
+    managed_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if (not self._state.adding and self.pk is not None
+                and kwargs.get("update_fields") is None):
+            kwargs["update_fields"] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.managed_fields
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(ManagedFieldsMixin, AbstractUser):
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username", "first_name", "last_name"]
@@ -14,6 +36,25 @@ class User(AbstractUser):
     avatar = models.ImageField(
         upload_to="users/avatars/", null=True, blank=True, verbose_name="Фото"
     )
+    recipes_count = models.PositiveIntegerField(
+        "Количество рецептов", default=0
+    )
+    followers_count = models.PositiveIntegerField(
+        "Количество подписчиков", default=0
+    )
+    avatar_variants = models.JSONField(
+        "Варианты фото", default=dict, blank=True
+    )
+    shopping_cart_version = models.PositiveIntegerField(
+        "Версия списка покупок", default=0, editable=False
+    )
+
+    managed_fields = (
+        "recipes_count",
+        "followers_count",
+        "avatar_variants",
+        "shopping_cart_version",
+    )
 
     class Meta:
         ordering = ["email"]